@@ -1,31 +1,48 @@
+import asyncio
+import collections
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import logging
 import voluptuous as vol
 import time
-import datetime
 
 from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException
 from meross_iot.cloud.exceptions.StatusTimeoutException import StatusTimeoutException
-from requests.exceptions import ConnectionError
 
 from homeassistant.core import callback
-from homeassistant.const import (CONF_USERNAME, CONF_PASSWORD, CONF_SCAN_INTERVAL)
+from homeassistant.const import (CONF_NAME, CONF_USERNAME, CONF_PASSWORD, CONF_SCAN_INTERVAL,
+                                 EVENT_HOMEASSISTANT_START, EVENT_HOMEASSISTANT_STOP)
 from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers import discovery
-from homeassistant.helpers.dispatcher import (async_dispatcher_connect)
+from homeassistant.helpers.dispatcher import (async_dispatcher_connect, async_dispatcher_send)
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.entity_registry import async_get_registry
+from homeassistant.helpers.event import (async_call_later, async_track_time_interval)
 
-from meross_iot.api import UnauthorizedException
 from meross_iot.manager import MerossManager
-from meross_iot.meross_event import MerossEventType
 from meross_iot.cloud.devices.power_plugs import GenericPlug
 from meross_iot.logger import set_log_level
 
+from custom_components.meross.circuit_breaker import MerossCircuitBreaker
+from custom_components.meross.cycle_manager import MerossCycleManager
+from custom_components.meross.device_adapter import MerossDeviceAdapter
+from custom_components.meross.energy import (ENERGY_STORAGE_KEY, MerossEnergyStore)
+from custom_components.meross.event_queue import MerossEventQueue
+from custom_components.meross.history import (HISTORY_TIERS, MerossMetricHistory, TIER_RAW)
+from custom_components.meross.inventory import (INVENTORY_STORAGE_KEY, MerossCachedDevice, MerossInventoryStore)
+from custom_components.meross.local_transport import MerossLocalTransport
+from custom_components.meross.metrics import (MerossPlatformMetrics, OPERATION_DISCOVERY, OPERATION_UPDATE_CYCLE,
+                                              OUTCOME_ERROR, OUTCOME_SUCCESS, OUTCOME_TIMEOUT)
+from custom_components.meross.request_queue import (PRIORITY_DISCOVERY, PRIORITY_POLL, PRIORITY_PUSH)
+from custom_components.meross.scheduler import MerossPollScheduler
+from custom_components.meross.session import (SESSION_STORAGE_KEY, MerossSessionManager)
+from custom_components.meross.state_store import MerossStateStore
+from custom_components.meross.switch_commands import (MerossCommandPipeline, RESULT_ERROR)
+from custom_components.meross.tracer import (DEFAULT_TRACE_BUFFER_SIZE, TRACER)
+
 # Setting log
 _LOGGER = logging.getLogger('meross_init')
-_LOGGER.setLevel(logging.DEBUG)
 
 set_log_level(root=logging.INFO, connection=logging.INFO, network=logging.INFO)
 
@@ -42,22 +59,175 @@ MEROSS_MANAGER = 'manager'
 HA_SWITCH = 'switch'
 HA_SENSOR = 'sensor'
 
+# sensor computed locally (energy integrated from the power samples)
+SENSOR_ENERGY = 'energy'
+
 SIGNAL_DELETE_ENTITY = 'meross_delete'
+SIGNAL_DELETE_DEVICE_ENTITIES = SIGNAL_DELETE_ENTITY + '_{}'
 SIGNAL_UPDATE_ENTITY = 'meross_update'
+SIGNAL_UPDATE_DEVICE_ENTITIES = SIGNAL_UPDATE_ENTITY + '_{}'
 
 DEFAULT_SCAN_INTERVAL = timedelta(seconds=10)
 
 CONF_MEROSS_DEVICES_SCAN_INTERVAL = 'meross_devices_scan_interval'
 DEFAULT_MEROSS_DEVICES_SCAN_INTERVAL = timedelta(minutes=15)
 
-CONFIG_SCHEMA = vol.Schema({
-    DOMAIN: vol.Schema({
+CONF_MEROSS_MAX_CONCURRENT_UPDATES = 'meross_max_concurrent_updates'
+DEFAULT_MEROSS_MAX_CONCURRENT_UPDATES = 10
+
+CONF_MEROSS_DEVICE_UPDATE_TIMEOUT = 'meross_device_update_timeout'
+DEFAULT_MEROSS_DEVICE_UPDATE_TIMEOUT = timedelta(seconds=5)
+
+CONF_MEROSS_MAX_WORKERS = 'meross_max_workers'
+DEFAULT_MEROSS_MAX_WORKERS = 10
+
+CONF_MEROSS_MIN_SCAN_INTERVAL = 'meross_min_scan_interval'
+DEFAULT_MEROSS_MIN_SCAN_INTERVAL = timedelta(seconds=10)
+
+CONF_MEROSS_MAX_SCAN_INTERVAL = 'meross_max_scan_interval'
+DEFAULT_MEROSS_MAX_SCAN_INTERVAL = timedelta(minutes=2)
+
+CONF_MEROSS_BREAKER_FAILURE_THRESHOLD = 'meross_breaker_failure_threshold'
+DEFAULT_MEROSS_BREAKER_FAILURE_THRESHOLD = 3
+
+CONF_MEROSS_BREAKER_MAX_BACKOFF = 'meross_breaker_max_backoff'
+DEFAULT_MEROSS_BREAKER_MAX_BACKOFF = timedelta(minutes=10)
+
+CONF_MEROSS_COMMAND_CONFIRM_TIMEOUT = 'meross_command_confirm_timeout'
+DEFAULT_MEROSS_COMMAND_CONFIRM_TIMEOUT = timedelta(seconds=5)
+
+CONF_MEROSS_MAX_CONCURRENT_COMMANDS = 'meross_max_concurrent_commands'
+DEFAULT_MEROSS_MAX_CONCURRENT_COMMANDS = 10
+
+SERVICE_SET_CHANNELS = 'set_channels'
+EVENT_SET_CHANNELS_RESULT = 'meross_set_channels_result'
+
+ATTR_TARGETS = 'targets'
+ATTR_DEVICE_UUID = 'device_uuid'
+ATTR_CHANNEL = 'channel'
+ATTR_STATE = 'state'
+ATTR_RESULT = 'result'
+ATTR_RESULTS = 'results'
+
+SERVICE_GET_HISTORY = 'get_history'
+EVENT_HISTORY_RESULT = 'meross_history'
+
+ATTR_METRIC = 'metric'
+ATTR_TIER = 'tier'
+ATTR_STATS = 'stats'
+ATTR_SAMPLES = 'samples'
+
+CONF_MEROSS_MAX_LOGIN_BACKOFF = 'meross_max_login_backoff'
+DEFAULT_MEROSS_MAX_LOGIN_BACKOFF = timedelta(minutes=30)
+
+CONF_MEROSS_RECONNECT_GRACE = 'meross_reconnect_grace'
+DEFAULT_MEROSS_RECONNECT_GRACE = timedelta(minutes=1)
+
+CONF_MEROSS_LOCAL_HOSTS = 'meross_local_hosts'
+CONF_MEROSS_LOCAL_KEY = 'meross_local_key'
+CONF_MEROSS_LOCAL_TIMEOUT = 'meross_local_timeout'
+DEFAULT_MEROSS_LOCAL_TIMEOUT = timedelta(seconds=2)
+
+CONF_MEROSS_MAX_SILENCE = 'meross_max_silence'
+DEFAULT_MEROSS_MAX_SILENCE = timedelta(minutes=15)
+
+CONF_MEROSS_ENERGY_RECONCILE = 'meross_energy_reconcile'
+# the local energy is reconciled with the device history at most once per ENERGY_RECONCILE_INTERVAL
+ENERGY_RECONCILE_INTERVAL = timedelta(hours=1)
+# a failed connection to the Meross cloud (at HA start) is retried after CONNECT_RETRY_DELAY
+CONNECT_RETRY_DELAY = timedelta(minutes=1)
+
+CONF_MEROSS_TRACE = 'meross_trace'
+CONF_MEROSS_TRACE_BUFFER_SIZE = 'meross_trace_buffer_size'
+
+SERVICE_SET_TRACE = 'set_trace'
+SERVICE_DUMP_TRACE = 'dump_trace'
+
+ATTR_ENABLED = 'enabled'
+ATTR_BUFFER_SIZE = 'buffer_size'
+ATTR_FILENAME = 'filename'
+
+RESULT_OFFLINE = 'offline'
+RESULT_UNKNOWN_DEVICE = 'unknown_device'
+RESULT_UNKNOWN_CHANNEL = 'unknown_channel'
+# a channel targeted more than once by the same call: only its last target is executed
+RESULT_SUPERSEDED = 'superseded'
+
+SET_CHANNELS_SCHEMA = vol.Schema({
+    vol.Required(ATTR_TARGETS): vol.All(cv.ensure_list, [vol.Schema({
+        vol.Required(ATTR_DEVICE_UUID): cv.string,
+        vol.Optional(ATTR_CHANNEL, default=0): cv.positive_int,
+        vol.Required(ATTR_STATE): cv.boolean,
+    })]),
+})
+
+GET_HISTORY_SCHEMA = vol.Schema({
+    vol.Required(ATTR_DEVICE_UUID): cv.string,
+    vol.Optional(ATTR_METRIC, default='power'): cv.string,
+    vol.Optional(ATTR_TIER, default=TIER_RAW): vol.In([tier for tier, period, size in HISTORY_TIERS]),
+})
+
+SET_TRACE_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENABLED): cv.boolean,
+    vol.Optional(ATTR_BUFFER_SIZE): cv.positive_int,
+})
+
+DUMP_TRACE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_FILENAME): cv.string,
+})
+
+
+def validate_account_names(accounts):
+    # each account has its own namespace
+    names = [account[CONF_NAME] for account in accounts]
+    if len(set(names)) != len(names):
+        raise vol.Invalid('each Meross account needs a different name')
+    # the trace is shared by all the accounts >>> configured by the first one only
+    for account in accounts[1:]:
+        for key in (CONF_MEROSS_TRACE, CONF_MEROSS_TRACE_BUFFER_SIZE):
+            if key in account:
+                raise vol.Invalid(key + ' can only be set on the first Meross account')
+    return accounts
+
+
+# one Meross account
+ACCOUNT_SCHEMA = vol.Schema({
         vol.Required(CONF_PASSWORD): cv.string,
         vol.Required(CONF_USERNAME): cv.string,
+        # namespace of the account devices (uuids, entity ids), required when there is more than one account
+        vol.Optional(CONF_NAME, default=''): vol.Any('', cv.slug),
 
         vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period,
         vol.Optional(CONF_MEROSS_DEVICES_SCAN_INTERVAL, default=DEFAULT_MEROSS_DEVICES_SCAN_INTERVAL): cv.time_period,
-    })
+        vol.Optional(CONF_MEROSS_MAX_CONCURRENT_UPDATES,
+                     default=DEFAULT_MEROSS_MAX_CONCURRENT_UPDATES): cv.positive_int,
+        vol.Optional(CONF_MEROSS_DEVICE_UPDATE_TIMEOUT,
+                     default=DEFAULT_MEROSS_DEVICE_UPDATE_TIMEOUT): cv.time_period,
+        vol.Optional(CONF_MEROSS_MAX_WORKERS, default=DEFAULT_MEROSS_MAX_WORKERS): cv.positive_int,
+        vol.Optional(CONF_MEROSS_MIN_SCAN_INTERVAL, default=DEFAULT_MEROSS_MIN_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_MEROSS_MAX_SCAN_INTERVAL, default=DEFAULT_MEROSS_MAX_SCAN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_MEROSS_BREAKER_FAILURE_THRESHOLD,
+                     default=DEFAULT_MEROSS_BREAKER_FAILURE_THRESHOLD): cv.positive_int,
+        vol.Optional(CONF_MEROSS_BREAKER_MAX_BACKOFF, default=DEFAULT_MEROSS_BREAKER_MAX_BACKOFF): cv.time_period,
+        vol.Optional(CONF_MEROSS_COMMAND_CONFIRM_TIMEOUT,
+                     default=DEFAULT_MEROSS_COMMAND_CONFIRM_TIMEOUT): cv.time_period,
+        vol.Optional(CONF_MEROSS_MAX_CONCURRENT_COMMANDS,
+                     default=DEFAULT_MEROSS_MAX_CONCURRENT_COMMANDS): cv.positive_int,
+        vol.Optional(CONF_MEROSS_MAX_LOGIN_BACKOFF, default=DEFAULT_MEROSS_MAX_LOGIN_BACKOFF): cv.time_period,
+        vol.Optional(CONF_MEROSS_RECONNECT_GRACE, default=DEFAULT_MEROSS_RECONNECT_GRACE): cv.time_period,
+        vol.Optional(CONF_MEROSS_LOCAL_HOSTS, default={}): {cv.string: cv.string},
+        vol.Optional(CONF_MEROSS_LOCAL_KEY, default=''): cv.string,
+        vol.Optional(CONF_MEROSS_LOCAL_TIMEOUT, default=DEFAULT_MEROSS_LOCAL_TIMEOUT): cv.time_period,
+        vol.Optional(CONF_MEROSS_MAX_SILENCE, default=DEFAULT_MEROSS_MAX_SILENCE): cv.time_period,
+        vol.Optional(CONF_MEROSS_ENERGY_RECONCILE, default=False): cv.boolean,
+        # first account only (see validate_account_names)
+        vol.Optional(CONF_MEROSS_TRACE): cv.boolean,
+        vol.Optional(CONF_MEROSS_TRACE_BUFFER_SIZE): cv.positive_int,
+})
+
+CONFIG_SCHEMA = vol.Schema({
+    # a single account, or a list of accounts
+    DOMAIN: vol.All(cv.ensure_list, [ACCOUNT_SCHEMA], validate_account_names),
 }, extra=vol.ALLOW_EXTRA)
 
 
@@ -72,8 +242,44 @@ async def async_setup(hass, config):
 
     _LOGGER.debug('async_setup() >>> STARTED')
 
-    # create the MerossManager object
-    hass.data[DOMAIN] = MerossPlatform(hass, config)
+    # structured trace of the hot paths (nothing is built while disabled), configured by the first account
+    if config[DOMAIN][0].get(CONF_MEROSS_TRACE, False):
+        TRACER.enable(config[DOMAIN][0].get(CONF_MEROSS_TRACE_BUFFER_SIZE, DEFAULT_TRACE_BUFFER_SIZE))
+
+    # create a MerossPlatform (with its own MerossManager, executor and timers) for each Meross account
+    hass.data[DOMAIN] = MerossHub(hass)
+    for options in config[DOMAIN]:
+        hass.data[DOMAIN].add_platform(MerossPlatform(hass, config, options))
+
+    # bulk switch service
+    hass.services.async_register(DOMAIN,
+                                 SERVICE_SET_CHANNELS,
+                                 hass.data[DOMAIN].async_handle_set_channels,
+                                 schema=SET_CHANNELS_SCHEMA)
+
+    # electricity history service
+    hass.services.async_register(DOMAIN,
+                                 SERVICE_GET_HISTORY,
+                                 hass.data[DOMAIN].async_handle_get_history,
+                                 schema=GET_HISTORY_SCHEMA)
+
+    # trace services
+    async def async_handle_set_trace(service):
+        if service.data[ATTR_ENABLED]:
+            TRACER.enable(service.data.get(ATTR_BUFFER_SIZE))
+        else:
+            TRACER.disable()
+
+    async def async_handle_dump_trace(service):
+        if ATTR_FILENAME in service.data:
+            filename = hass.config.path(service.data[ATTR_FILENAME])
+            await hass.async_add_executor_job(TRACER.dump_to_file, filename)
+            _LOGGER.info(str(len(TRACER)) + ' trace events dumped to ' + filename)
+        else:
+            TRACER.dump_to_log()
+
+    hass.services.async_register(DOMAIN, SERVICE_SET_TRACE, async_handle_set_trace, schema=SET_TRACE_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_TRACE, async_handle_dump_trace, schema=DUMP_TRACE_SCHEMA)
 
     _LOGGER.debug('async_setup() <<< TERMINATED')
 
@@ -89,45 +295,108 @@ async def async_setup(hass, config):
 
 class MerossPlug:
 
-    def __init__(self, hass, config, meross_device):
+    def __init__(self, hass, options, namespace, meross_device, executor, scheduler, metrics, state_store,
+                 energy_store, request_entities, restored_states=None):
+        # options: the configuration of the Meross account, namespace: prefix of the uuids of the account devices
+        # request_entities: callback building the HA entities of the plug (batched with the other plugs)
 
         # homeassistant
         self._hass = hass
-        self._config = config
+        self._request_entities = request_entities
+        self.max_silence = options[CONF_MEROSS_MAX_SILENCE]
 
         # device
         self.device = meross_device
-        self.uuid = meross_device.uuid
+        # devices with a LAN address are reached directly (the Meross cloud being the fallback)
+        local = None
+        local_host = options[CONF_MEROSS_LOCAL_HOSTS].get(meross_device.uuid)
+        if local_host is not None:
+            local = MerossLocalTransport(local_host,
+                                         options[CONF_MEROSS_LOCAL_KEY],
+                                         options[CONF_MEROSS_LOCAL_TIMEOUT].total_seconds())
+        self.adapter = MerossDeviceAdapter(hass.loop, executor, meross_device, metrics, local)
+        self.uuid = namespace + meross_device.uuid
         self.name = meross_device.name
         self.was_available = meross_device.online
-
-        # async register sensors & switches
-        self.sensor_states = {}
-        self.switch_states = {}
+        # what the entities are built from: a change means that the entities have to be built again
+        self.descriptor = describe_meross_device(meross_device)
+        # ids of the entities of the plug in HA (registered by the entities)
+        self.entity_ids = set()
+
+        # timeouts >>> the device is skipped by the update cycles for an exponential backoff
+        self.breaker = MerossCircuitBreaker(self.name,
+                                            options[CONF_MEROSS_BREAKER_FAILURE_THRESHOLD],
+                                            options[CONF_MEROSS_MIN_SCAN_INTERVAL],
+                                            options[CONF_MEROSS_BREAKER_MAX_BACKOFF])
+        self._update_failed = False
+        # priority (see request_queue.py) of the reads of the next update: a poll, unless the device has just been
+        # discovered or has notified to be online again
+        self.poll_priority = PRIORITY_POLL
+
+        # switch commands: coalesced per channel, serialised per device
+        self.commands = MerossCommandPipeline(hass,
+                                              self,
+                                              scheduler,
+                                              options[CONF_MEROSS_COMMAND_CONFIRM_TIMEOUT])
+
+        # energy (Wh) integrated from the power samples; two samples farther than two polls apart are a gap
+        self.energy = None
+        self._energy_store = energy_store
+        self._energy_reconcile = options[CONF_MEROSS_ENERGY_RECONCILE]
+        self._energy_reconciled_at = None
+        if meross_device.supports_electricity_reading():
+            max_gap = 2 * options[CONF_MEROSS_MAX_SCAN_INTERVAL].total_seconds()
+            self.energy = energy_store.get_meter(self.uuid, max_gap)
+
+        # async register sensors & switches (their states are slots of the platform state store)
+        # a plug restored from the inventory gets its entities (with their last-known states) right away
+        self.states = state_store
+        self._restored_states = restored_states or {}
+        self.sensor_slots = {}
+        self.switch_slots = {}
+        # in-memory history of the electricity metrics (fixed size, see history.py)
+        self.sensor_histories = {}
         self.sensor_switch_added = False
-        if self.was_available:
+        if self.was_available or not self.connected:
             self.add_sensor_and_switches()
         else:
             _LOGGER.info(self.name + ' is offline >>> no sensor or switch added')
 
     def add_sensor_and_switches(self):
-        self._hass.async_create_task(
-            discovery.async_load_platform(self._hass,
-                                          HA_SENSOR,
-                                          DOMAIN,
-                                          {'meross_device_uuid': self.uuid},
-                                          self._config))
-        self._hass.async_create_task(
-            discovery.async_load_platform(self._hass,
-                                          HA_SWITCH,
-                                          DOMAIN,
-                                          {'meross_device_uuid': self.uuid},
-                                          self._config))
+        self._request_entities(self.uuid)
         self.sensor_switch_added = True
 
+    def add_switch_slot(self, channel, available):
+        value = self._restored_states.get(channel, False)
+        self.switch_slots[channel] = self.states.add(self.uuid, channel, value, available)
+        return self.switch_slots[channel]
+
+    def add_sensor_slot(self, sensor_name, available):
+        value = self._restored_states.get(sensor_name, 0)
+        if sensor_name == SENSOR_ENERGY and self.energy is not None:
+            # restored total
+            value = self.energy.total
+        self.sensor_slots[sensor_name] = self.states.add(self.uuid, sensor_name, value, available)
+        return self.sensor_slots[sensor_name]
+
+    def add_sensor_history(self, sensor_name, factor):
+        if sensor_name not in self.sensor_histories:
+            self.sensor_histories[sensor_name] = MerossMetricHistory(factor)
+        return self.sensor_histories[sensor_name]
+
+    @property
+    def connected(self):
+        # False while the device is known from the inventory only (it cannot be acted nor polled)
+        return not isinstance(self.device, MerossCachedDevice)
+
+    def attach_device(self, meross_device):
+        # the meross_iot device replaces the cached one (same descriptor >>> the entities are kept)
+        self.device = meross_device
+        self.adapter.device = meross_device
+
     @property
     def available(self):
-        return self.device.online
+        return self.connected and self.device.online
 
     def set_availability(self, available):
         if self.was_available != available:
@@ -138,62 +407,236 @@ class MerossPlug:
                     self.add_sensor_and_switches()
             else:
                 _LOGGER.info(self.name + ' is offline')
-        for name, sensor in self.sensor_states.items():
-            sensor['available'] = available
-        for channel, switch in self.switch_states.items():
-            switch['available'] = available
+        for slot in list(self.sensor_slots.values()) + list(self.switch_slots.values()):
+            self.states.update(slot, available=available)
+
+    def close(self):
+        # the plug has been removed: its queued commands and requests are dropped
+        self.commands.cancel()
+        self.adapter.queue.close()
+
+    @callback
+    def async_push_update(self, state_key=None):
+        # push the updated states to the entities of this plug (a channel, a sensor name or all of them if None)
+        async_dispatcher_send(self._hass, SIGNAL_UPDATE_DEVICE_ENTITIES.format(self.uuid), state_key)
 
     async def async_update_status(self):
-        _LOGGER.debug(self.name + ' async_update_status() >>> STARTED')
+        if TRACER.enabled:
+            TRACER.record(self.name, 'async_update_status() >>> STARTED')
         available = self.available
         self.set_availability(available)
+        priority, self.poll_priority = self.poll_priority, PRIORITY_POLL
         if available:
-            self.update_switch_status()
-            self.update_sensor_status()
-        _LOGGER.debug(self.name + ' async_update_status() >>> TERMINATED')
-        return True
-
-    def update_switch_status(self):
+            # one snapshot of all the channels (and one of the electricity, if supported): both reads are queued at
+            # once, then executed one after the other by the device request queue (see request_queue.py), behind any
+            # pending command
+            self._update_failed = False
+            channels_status, electricity = await asyncio.gather(self.async_get_switch_snapshot(priority),
+                                                                self.async_get_sensor_snapshot(priority))
+            changed = self.apply_status_snapshot(channels_status, electricity)
+            if self.is_energy_reconcile_due():
+                await self.async_reconcile_energy(priority)
+            if self._update_failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        else:
+            # no request sent >>> the probe (if any) claimed for this update is given back
+            self.breaker.release_probe()
+            changed = False
+        self.async_push_update()
+        if TRACER.enabled:
+            TRACER.record(self.name, 'async_update_status() <<< TERMINATED', changed)
+        # True if any state (switch or sensor) has changed
+        return changed
 
-        _LOGGER.debug(self.name + 'update_switch_status() >>> STARTED')
+    async def async_get_switch_snapshot(self, priority=PRIORITY_POLL):
 
-        # for each channel (switch), update its status (on/off)
-        for channel, switch_state in self.switch_states.items():
+        channels_status = None
+        if len(self.switch_slots) > 0:
 
             try:
-                # update the Meross Device switch status
-                # WARNING: potentially blocking >>> CommandTimeoutException expected
-                channel_status = self.device.get_channel_status(channel)
-                switch_state['is_on'] = channel_status
-                _LOGGER.debug(self.name + ' >>> channel ' +
-                              str(channel) + ' >>> ' +
-                              str(channel_status))
+                # get the status (on/off) of all the channels (switches) at once
+                # run in the executor >>> CommandTimeoutException expected
+                channels_status = await self.adapter.async_get_channels_status(list(self.switch_slots.keys()),
+                                                                               priority)
 
             except StatusTimeoutException:
                 # Handle a StatusTimeoutException
+                self._update_failed = True
                 handle_status_timeout_exception(inspect.stack()[0][3])
 
             except CommandTimeoutException:
                 # Handle a CommandTimeoutException
+                self._update_failed = True
                 handle_command_timeout_exception(inspect.stack()[0][3])
 
-        _LOGGER.debug(self.name + 'update_switch_status() <<< STARTED')
+        if TRACER.enabled:
+            TRACER.record(self.name, 'async_get_switch_snapshot()', channels_status)
+
+        return channels_status
 
-    def update_sensor_status(self):
-        if len(self.sensor_states) > 0:
+    async def async_get_sensor_snapshot(self, priority=PRIORITY_POLL):
+
+        electricity = None
+        if len(self.sensor_slots) > 0:
 
             try:
-                # for each electricity <key,value> pair, save it in hass object
-                # WARNING: potentially blocking >>> CommandTimeoutException expected
-                _LOGGER.debug(self.name + ' >>> get_electricity()')
-                electricity = self.device.get_electricity()
-                for key, value in electricity.items():
-                    if key in self.sensor_states:
-                        self.sensor_states[key]['value'] = value
+                # run in the executor >>> CommandTimeoutException expected
+                electricity = await self.adapter.async_get_electricity(priority)
+                if TRACER.enabled:
+                    TRACER.record(self.name, 'async_get_sensor_snapshot()', electricity)
 
             except CommandTimeoutException:
+                self._update_failed = True
                 handle_command_timeout_exception(inspect.stack()[0][3])
 
+        return electricity
+
+    def apply_status_snapshot(self, channels_status, electricity):
+        # update the states of all the plug entities in one step, returning True if any state has changed
+        changed = False
+        if channels_status is not None:
+            for channel, channel_status in channels_status.items():
+                if channel in self.switch_slots:
+                    changed = self.states.update(self.switch_slots[channel], value=channel_status) or changed
+        if electricity is not None:
+            # for each electricity <key,value> pair, save it in hass object (and in the history)
+            now = time.time()
+            for key, value in electricity.items():
+                if key in self.sensor_slots:
+                    changed = self.states.update(self.sensor_slots[key], value=value) or changed
+                if key in self.sensor_histories:
+                    self.sensor_histories[key].add(value, now)
+            if 'power' in electricity:
+                self.update_energy(electricity['power'])
+        return changed
+
+    def update_energy(self, power):
+        # power in mW (as read from the device)
+        # the energy slot is not part of the "changed" result: it grows whenever there is a load, and would keep
+        # the device at the fastest polling rate
+        if self.energy is None:
+            return
+        self.energy.add_sample(power * 0.001, time.monotonic())
+        if SENSOR_ENERGY in self.sensor_slots:
+            self.states.update(self.sensor_slots[SENSOR_ENERGY], value=self.energy.total)
+        self._energy_store.async_schedule_save()
+
+    def is_energy_reconcile_due(self):
+        if not self._energy_reconcile or self.energy is None or not self.adapter.supports_consumption_reading():
+            return False
+        return (self._energy_reconciled_at is None or
+                time.monotonic() - self._energy_reconciled_at >= ENERGY_RECONCILE_INTERVAL.total_seconds())
+
+    async def async_reconcile_energy(self, priority=PRIORITY_POLL):
+        try:
+            # run in the executor >>> CommandTimeoutException expected
+            consumption = await self.adapter.async_get_power_consumption(priority)
+        except CommandTimeoutException:
+            self._update_failed = True
+            handle_command_timeout_exception(inspect.stack()[0][3])
+            return False
+        self._energy_reconciled_at = time.monotonic()
+        correction = self.energy.reconcile(consumption)
+        _LOGGER.debug(self.name + ' >>> energy reconciled with the device history >>> ' + str(correction) + ' Wh')
+        if SENSOR_ENERGY in self.sensor_slots:
+            self.states.update(self.sensor_slots[SENSOR_ENERGY], value=self.energy.total)
+        self._energy_store.async_schedule_save()
+        return True
+
+
+def describe_meross_device(meross_device):
+    # (name, channel layout, electricity support) of a meross_iot device
+    return (meross_device.name,
+            max(1, len(meross_device.get_channels())),
+            meross_device.get_usb_channel_index(),
+            meross_device.supports_electricity_reading())
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS HUB
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossHub:
+    # hass.data[DOMAIN]: the MerossPlatform of each Meross account, and the services spanning all of them.
+    # meross_plugs_by_uuid is a (live) view on the plugs of all the accounts.
+
+    def __init__(self, hass):
+        self._hass = hass
+        self.platforms = []
+        self.meross_plugs_by_uuid = collections.ChainMap()
+
+    def add_platform(self, platform):
+        self.platforms.append(platform)
+        self.meross_plugs_by_uuid.maps.append(platform.meross_plugs_by_uuid)
+        return platform
+
+    def get_platform(self, namespace):
+        for platform in self.platforms:
+            if platform.namespace == namespace:
+                return platform
+        return None
+
+    def get_platform_of(self, meross_device_uuid):
+        # the platform (account) of a device, None if unknown
+        for platform in self.platforms:
+            if meross_device_uuid in platform.meross_plugs_by_uuid:
+                return platform
+        return None
+
+    async def async_handle_set_channels(self, service):
+
+        start_ms = int(round(time.time() * 1000))
+
+        # group the targets by device
+        targets_by_uuid = {}
+        for target in service.data[ATTR_TARGETS]:
+            targets_by_uuid.setdefault(target[ATTR_DEVICE_UUID], []).append(target)
+
+        # fan out the devices, at most max_concurrent_commands at the same time for each account
+        semaphores = {platform.namespace: asyncio.Semaphore(platform.max_concurrent_commands)
+                      for platform in self.platforms}
+        results = await asyncio.gather(*[self.async_set_device_channels(meross_device_uuid, targets, semaphores)
+                                         for meross_device_uuid, targets in targets_by_uuid.items()])
+
+        # per-target report
+        report = [dict(target, **{ATTR_RESULT: result})
+                  for targets, device_results in zip(targets_by_uuid.values(), results)
+                  for target, result in zip(targets, device_results)]
+        duration_ms = int(round(time.time() * 1000)) - start_ms
+        _LOGGER.info(SERVICE_SET_CHANNELS + ' >>> ' + str(len(report)) + ' targets executed in ' +
+                     str(duration_ms) + ' ms')
+        self._hass.bus.async_fire(EVENT_SET_CHANNELS_RESULT, {ATTR_RESULTS: report})
+
+        return True
+
+    async def async_handle_get_history(self, service):
+        # the history is reported by an event (services do not return data)
+        meross_device_uuid = service.data[ATTR_DEVICE_UUID]
+        metric = service.data[ATTR_METRIC]
+        tier = service.data[ATTR_TIER]
+        meross_plug = self.meross_plugs_by_uuid.get(meross_device_uuid)
+        if meross_plug is None or metric not in meross_plug.sensor_histories:
+            _LOGGER.warning(SERVICE_GET_HISTORY + ' >>> no ' + metric + ' history for ' + meross_device_uuid)
+            return False
+        ring = meross_plug.sensor_histories[metric].tiers[tier]
+        self._hass.bus.async_fire(EVENT_HISTORY_RESULT, {ATTR_DEVICE_UUID: meross_device_uuid,
+                                                         ATTR_METRIC: metric,
+                                                         ATTR_TIER: tier,
+                                                         ATTR_STATS: ring.stats(),
+                                                         ATTR_SAMPLES: ring.samples()})
+        return True
+
+    async def async_set_device_channels(self, meross_device_uuid, targets, semaphores):
+        platform = self.get_platform_of(meross_device_uuid)
+        if platform is None:
+            _LOGGER.warning(SERVICE_SET_CHANNELS + ' >>> ' + meross_device_uuid + ' is not a known Meross device')
+            return [RESULT_UNKNOWN_DEVICE] * len(targets)
+        return await platform.async_set_device_channels(meross_device_uuid, targets, semaphores[platform.namespace])
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 #
@@ -202,31 +645,141 @@ class MerossPlug:
 # ----------------------------------------------------------------------------------------------------------------------
 
 class MerossPlatform:
+    # The devices of a Meross account
+    # config: the HA configuration, options: the configuration of the Meross account
 
-    def __init__(self, hass, config):
+    def __init__(self, hass, config, options, manager_factory=MerossManager):
 
         self._hass = hass
         self._config = config
+        self._options = options
+        # builds the meross_iot manager from (username, password), e.g. a simulator for benchmarking
+        self._manager_factory = manager_factory
+
+        # uuids (and entity ids) of the account devices are prefixed by the account name, if any
+        self.account_name = options[CONF_NAME]
+        self.namespace = self.account_name + '_' if self.account_name else ''
+
+        self._username = options[CONF_USERNAME]
+        self._password = options[CONF_PASSWORD]
+        self.update_status_interval = options[CONF_SCAN_INTERVAL]
+        self.discover_plugs_interval = options[CONF_MEROSS_DEVICES_SCAN_INTERVAL]
+        self.max_concurrent_updates = options[CONF_MEROSS_MAX_CONCURRENT_UPDATES]
+        self.device_update_timeout = options[CONF_MEROSS_DEVICE_UPDATE_TIMEOUT]
+        self.max_concurrent_commands = options[CONF_MEROSS_MAX_CONCURRENT_COMMANDS]
+
+        # adaptive per-device polling: at each update_status_interval only the due plugs are updated
+        self.scheduler = MerossPollScheduler(options[CONF_MEROSS_MIN_SCAN_INTERVAL],
+                                             options[CONF_MEROSS_MAX_SCAN_INTERVAL])
+        # the update cycles never overlap, and they shrink after an overrun
+        self.update_cycles = MerossCycleManager('update',
+                                                self.update_status_interval,
+                                                self.async_run_update_cycle,
+                                                self.max_concurrent_updates)
+
+        # states of all the channels and metrics of all the plugs
+        self.states = MerossStateStore()
+
+        # energy totals of the metering plugs, persisted across the restarts
+        self.energy_store = MerossEnergyStore(hass, self.storage_key(ENERGY_STORAGE_KEY))
+
+        # dedicated and bounded thread pool running all the (blocking) meross_iot calls
+        self._executor = ThreadPoolExecutor(max_workers=options[CONF_MEROSS_MAX_WORKERS],
+                                            thread_name_prefix='meross' + self.namespace)
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self.async_shutdown)
+
+        # known devices (and their last-known states), persisted across the restarts
+        self.inventory = MerossInventoryStore(hass, self.storage_key(INVENTORY_STORAGE_KEY))
+
+        # meross_iot events: enqueued by the MQTT thread, handled in batches by the event loop
+        self.events = MerossEventQueue(hass.loop, self.async_handle_events)
+
+        # meross manager: started in the background (blocking login and MQTT connection), paced, restarted after a
+        # connection loss
+        self.session = MerossSessionManager(hass,
+                                            self._executor,
+                                            manager_factory,
+                                            self._username,
+                                            self._password,
+                                            self.meross_event_handler,
+                                            self.async_request_discovery,
+                                            options[CONF_MEROSS_MAX_LOGIN_BACKOFF],
+                                            options[CONF_MEROSS_RECONNECT_GRACE],
+                                            self.storage_key(SESSION_STORAGE_KEY))
+
+        # latency and error metrics of the meross_iot calls, exposed as diagnostic sensors
+        self.metrics = MerossPlatformMetrics(self.account_name or DOMAIN)
+        hass.async_create_task(
+            discovery.async_load_platform(hass,
+                                          HA_SENSOR,
+                                          DOMAIN,
+                                          {'meross_summary': True, 'meross_namespace': self.namespace},
+                                          config))
 
-        self._username = config[DOMAIN][CONF_USERNAME]
-        self._password = config[DOMAIN][CONF_PASSWORD]
-        self.update_status_interval = config[DOMAIN][CONF_SCAN_INTERVAL]
-        self.discover_plugs_interval = config[DOMAIN][CONF_MEROSS_DEVICES_SCAN_INTERVAL]
-
-        # start meross manager
-        self._meross_manager = None
-        self.start_meross_manager()
+        # plugs whose entities are still to be built: they are built in a batch (one platform load for all of them)
+        self._entities_requested_uuids = []
 
         # first discover plugs
         self.meross_plugs_by_uuid = {}
-        hass.async_create_task(self.async_discover_plugs())
+        self._discovery_lock = asyncio.Lock()
+        self._discovery_requested = False
 
-        # first update
-        hass.async_create_task(self.async_update_plugs())
+        # entities from the inventory (local storage only: the HA setup waits for it)
+        hass.async_create_task(self.async_restore())
+
+        # connection to the Meross cloud, first discovery and first update: once HA is started, in a task HA does not
+        # wait for (neither its setup nor its start depend on the Meross cloud)
+        if hass.is_running:
+            self.async_handle_ha_start()
+        else:
+            hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, self.async_handle_ha_start)
 
         # starting timers
         hass.async_create_task(self.async_start_timer())
 
+    def storage_key(self, key):
+        # each account has its own .storage files
+        if self.account_name:
+            return key + '_' + self.account_name
+        return key
+
+    async def async_restore(self):
+        # the entities are built right away from the inventory: HA boot does not wait for the Meross cloud
+        await self.energy_store.async_load()
+        cached_devices, states_by_uuid = await self.inventory.async_load()
+        # the inventory is keyed by the raw device uuids (as listed by the Meross cloud)
+        for cached_device in cached_devices:
+            if self.namespace + cached_device.uuid not in self.meross_plugs_by_uuid:
+                self.add_plug(cached_device, states_by_uuid.get(cached_device.uuid))
+        if len(cached_devices) > 0:
+            _LOGGER.info(str(len(cached_devices)) + ' Meross devices restored from the inventory')
+        return True
+
+    @callback
+    def async_handle_ha_start(self, event=None):
+        # called once HA is started (or by the retry timer, with its time)
+        self._hass.async_create_task(self.async_connect())
+
+    async def async_connect(self):
+        # the meross manager is started and the inventory is reconciled with the Meross cloud
+        try:
+            await self.async_discover_plugs()
+            await self.async_update_plugs()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the restored plugs stay unavailable until the connection succeeds
+            _LOGGER.exception('Connection to the Meross cloud failed >>> retrying in ' + str(CONNECT_RETRY_DELAY))
+            async_call_later(self._hass, CONNECT_RETRY_DELAY.total_seconds(), self.async_handle_ha_start)
+            return False
+        return True
+
+    async def async_shutdown(self, event=None):
+        _LOGGER.debug('async_shutdown() >>> shutting down the meross executor')
+        await self.session.async_stop()
+        self._executor.shutdown(wait=False)
+        return True
+
     async def async_start_timer(self):
 
         # This is used to update the Meross Devices status periodically
@@ -244,103 +797,298 @@ class MerossPlatform:
         return True
 
     async def async_update_plugs(self, now=None):
+        # timer tick: skipped while the previous update cycle is still running (see cycle_manager.py)
+        return await self.update_cycles.async_tick(now)
+
+    async def async_run_update_cycle(self, budget=None):
+        # budget: maximum number of plugs to be updated (None: all the due plugs); returns the number of plugs updated
 
         # monitor the duration in millis
         # registering starting timestamp in ms
         start_ms = int(round(time.time() * 1000))
 
-        _LOGGER.debug('async_update_plugs() >>> STARTED at ' + str(now))
-
-        for meross_device_uuid, meross_plug in self.meross_plugs_by_uuid.items():
-            _LOGGER.debug(meross_plug.name + ' plug status update >>> STARTED')
-            await meross_plug.async_update_status()
-            _LOGGER.debug(meross_plug.name + ' plug status update <<< TERMINATED')
-        _LOGGER.debug('async_update_plugs() <<< TERMINATED')
+        _LOGGER.debug('async_run_update_cycle() >>> STARTED')
+
+        # fan out the updates of the due plugs, at most max_concurrent_updates at the same time
+        semaphore = asyncio.Semaphore(self.max_concurrent_updates)
+        # (the plugs known to be unhealthy are skipped until their circuit breaker allows a probe)
+        # after an overrun, only the most overdue plugs (the others stay due for the next cycle): the budget is checked
+        # before allow_request(), which claims the probe of a half open breaker >>> a claimed probe is always run
+        due_plugs = []
+        for meross_device_uuid in self.scheduler.due():
+            if budget is not None and len(due_plugs) >= budget:
+                break
+            meross_plug = self.meross_plugs_by_uuid.get(meross_device_uuid)
+            if meross_plug is not None and meross_plug.breaker.allow_request():
+                due_plugs.append(meross_plug)
+        update_tasks = [self.async_update_plug(meross_plug, semaphore) for meross_plug in due_plugs]
+        if len(update_tasks) > 0:
+            await asyncio.gather(*update_tasks)
+        _LOGGER.debug('async_run_update_cycle() <<< TERMINATED')
 
         # registering ending timestamp in ms
         end_ms = int(round(time.time() * 1000))
         duration_ms = end_ms - start_ms
-        duration_s = int(round(duration_ms / 1000))
-        duration_td = datetime.timedelta(seconds=duration_s)
-        if duration_td > self.update_status_interval:
-            _LOGGER.warning('Updating the Meross plug status took ' + str(duration_td))
+        self.metrics.record(OPERATION_UPDATE_CYCLE, duration_ms / 1000, OUTCOME_SUCCESS)
+        # last-known states
+        self.inventory.async_schedule_save(self.meross_plugs_by_uuid)
+
+        return len(update_tasks)
+
+    async def async_update_plug(self, meross_plug, semaphore):
+
+        async with semaphore:
+            changed = False
+            try:
+                # a slow plug must not hold up the others >>> per-device deadline
+                changed = await asyncio.wait_for(meross_plug.async_update_status(),
+                                                 self.device_update_timeout.total_seconds())
+            except asyncio.TimeoutError:
+                meross_plug.breaker.record_failure()
+                handle_update_timeout_exception(meross_plug.name, self.device_update_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # any other error (e.g. ConnectionError, meross_iot errors) only fails this plug, not the whole cycle
+                meross_plug.breaker.record_failure()
+                _LOGGER.exception('Error when updating the Meross plug ' + meross_plug.name)
+            finally:
+                self.scheduler.record_poll(meross_plug.uuid, changed)
 
         return True
 
     async def async_discover_plugs(self, now=None):
+        # one discovery at a time (timer and events)
+        async with self._discovery_lock:
+            return await self.async_discover_plugs_diff(now)
 
-        _LOGGER.debug('async_discover_plugs >>> STARTED at ' + str(now))
+    @callback
+    def async_request_discovery(self):
+        # discovery requested by an event: the requests arriving while one is queued are coalesced
+        if self._discovery_requested:
+            return
+        self._discovery_requested = True
+        self._hass.async_create_task(self._async_run_requested_discovery())
 
-        # get all the registered meross_plugs
-        meross_plugs = self._meross_manager.get_devices_by_kind(GenericPlug)
+    async def _async_run_requested_discovery(self):
+        async with self._discovery_lock:
+            self._discovery_requested = False
+            await self.async_discover_plugs_diff()
+
+    async def async_discover_plugs_diff(self, now=None):
 
-        # check each registered meross plug
-        for meross_plug in meross_plugs:
+        _LOGGER.debug('async_discover_plugs >>> STARTED at ' + str(now))
 
-            # get meross plug uuid
-            meross_plug_uuid = meross_plug.uuid
+        meross_manager = await self.session.async_get_manager()
+        if meross_manager is None:
+            # not connected (yet) >>> the session manager requests a discovery once connected
+            return False
 
-            # Check if the meross plug uuid has been already discovered
-            if meross_plug_uuid not in self.meross_plugs_by_uuid:
-                self.meross_plugs_by_uuid[meross_plug_uuid] = MerossPlug(self._hass,
-                                                                         self._config,
-                                                                         meross_plug)
+        # get all the registered meross_plugs
+        # run in the executor >>> CommandTimeoutException expected
+        outcome = OUTCOME_ERROR
+        start = time.monotonic()
+        try:
+            meross_plugs = await self._hass.loop.run_in_executor(self._executor,
+                                                                 meross_manager.get_devices_by_kind,
+                                                                 GenericPlug)
+            outcome = OUTCOME_SUCCESS
+        except CommandTimeoutException:
+            outcome = OUTCOME_TIMEOUT
+            handle_command_timeout_exception(inspect.stack()[0][3])
+            return False
+        finally:
+            self.metrics.record(OPERATION_DISCOVERY, time.monotonic() - start, outcome)
+
+        # the energy totals are restored before the first plug is built
+        await self.energy_store.async_load()
+
+        # diff with the known plugs: only the added, removed and changed plugs are processed
+        listed_plugs_by_uuid = {self.namespace + meross_plug.uuid: meross_plug for meross_plug in meross_plugs}
+        added = [uuid for uuid in listed_plugs_by_uuid if uuid not in self.meross_plugs_by_uuid]
+        changed = [uuid for uuid in listed_plugs_by_uuid if uuid in self.meross_plugs_by_uuid and
+                   self.meross_plugs_by_uuid[uuid].descriptor != describe_meross_device(listed_plugs_by_uuid[uuid])]
+        # plugs restored from the inventory (or known by a previous meross manager), now listed by the Meross cloud
+        attached = [uuid for uuid in listed_plugs_by_uuid if uuid in self.meross_plugs_by_uuid and
+                    uuid not in changed and self.meross_plugs_by_uuid[uuid].device is not listed_plugs_by_uuid[uuid]]
+        removed = []
+        if len(listed_plugs_by_uuid) > 0:
+            # (an empty list is not trusted: it would remove all the entities)
+            removed = [uuid for uuid in self.meross_plugs_by_uuid if uuid not in listed_plugs_by_uuid]
+
+        for meross_plug_uuid in removed:
+            self.remove_plug(meross_plug_uuid, vanished=True)
+        for meross_plug_uuid in changed:
+            self.remove_plug(meross_plug_uuid)
+        for meross_plug_uuid in added + changed:
+            self.add_plug(listed_plugs_by_uuid[meross_plug_uuid])
+        for meross_plug_uuid in attached:
+            self.attach_plug(listed_plugs_by_uuid[meross_plug_uuid])
+
+        if len(added) + len(changed) + len(removed) + len(attached) > 0:
+            _LOGGER.info('Meross devices discovered >>> ' + str(len(added)) + ' added, ' + str(len(changed)) +
+                         ' changed, ' + str(len(removed)) + ' removed, ' + str(len(attached)) + ' connected')
+            self.inventory.async_schedule_save(self.meross_plugs_by_uuid)
         _LOGGER.debug('async_discover_plugs <<< FINISHED')
 
         return True
 
-    def meross_event_handler(self, eventobj):
-        _LOGGER.info(str(eventobj.event_type) + " event detected")
-        if eventobj.event_type == MerossEventType.CLIENT_CONNECTION:
-            # Fired when the MQTT client connects/disconnects to the MQTT broker
-            # do nothing...
-            pass
-        elif eventobj.event_type == MerossEventType.DEVICE_ONLINE_STATUS:
-            _LOGGER.info("Device online status changed: %s went %s" % (eventobj.device.name, eventobj.status))
-            meross_device_uuid = eventobj.device.uuid
-            meross_device_availability = eventobj.status
-            if meross_device_uuid in self.meross_plugs_by_uuid:
-                # the device has been already discovered >>> update its availability
-                meross_plug = self.meross_plugs_by_uuid[meross_device_uuid]
-                meross_plug.set_availability(meross_device_availability)
-            else:
-                # the device has not yet been discovered >>> add it
-                self._hass.async_create_task(self.async_discover_plugs())
-            pass
-        elif eventobj.event_type == MerossEventType.DEVICE_SWITCH_STATUS:
-            _LOGGER.info("Switch state changed: Device %s (channel %d) went %s" %
-                         (eventobj.device.name, eventobj.channel_id, eventobj.switch_state))
-            meross_device_uuid = eventobj.device.uuid
-            channel = eventobj.channel_id
-            channel_status = eventobj.switch_state
-            meross_plug = self.meross_plugs_by_uuid[meross_device_uuid]
-            meross_plug.switch_states[channel]['is_on'] = channel_status
-        else:
-            _LOGGER.warning(str(eventobj.event_type) + " is an unknown event!")
-        pass
-
-    def start_meross_manager(self):
-
-        try:
-            # Create the manager
-            self._meross_manager = MerossManager(self._username, self._password)
+    def add_plug(self, meross_device, restored_states=None):
+        meross_plug_uuid = self.namespace + meross_device.uuid
+        self.meross_plugs_by_uuid[meross_plug_uuid] = MerossPlug(self._hass,
+                                                                 self._options,
+                                                                 self.namespace,
+                                                                 meross_device,
+                                                                 self._executor,
+                                                                 self.scheduler,
+                                                                 self.metrics.get_device_metrics(
+                                                                     meross_plug_uuid,
+                                                                     meross_device.name),
+                                                                 self.states,
+                                                                 self.energy_store,
+                                                                 self.async_request_entities,
+                                                                 restored_states)
+        if self.meross_plugs_by_uuid[meross_plug_uuid].connected:
+            # the first reads of a discovered device never delay the commands and the polls of the others
+            self.meross_plugs_by_uuid[meross_plug_uuid].poll_priority = PRIORITY_DISCOVERY
+            self.scheduler.add(meross_plug_uuid)
+
+    def attach_plug(self, meross_device):
+        meross_plug = self.meross_plugs_by_uuid[self.namespace + meross_device.uuid]
+        meross_plug.attach_device(meross_device)
+        meross_plug.set_availability(meross_device.online)
+        meross_plug.async_push_update()
+        meross_plug.poll_priority = PRIORITY_DISCOVERY
+        self.scheduler.add(meross_plug.uuid)
 
-            # Starts the manager
-            self._meross_manager.start()
+    @callback
+    def async_request_entities(self, meross_plug_uuid):
+        # the plugs added in the same pass (startup, discovery) are collected, then their entities are built at once
+        if len(self._entities_requested_uuids) == 0:
+            self._hass.loop.call_soon(self.async_load_entities)
+        if meross_plug_uuid not in self._entities_requested_uuids:
+            self._entities_requested_uuids.append(meross_plug_uuid)
 
-            # Register event handlers for the manager...
-            self._meross_manager.register_event_handler(self.meross_event_handler)
+    @callback
+    def async_load_entities(self):
+        # one async_setup_platform (and one async_add_entities) per platform for the whole batch
+        meross_plug_uuids, self._entities_requested_uuids = self._entities_requested_uuids, []
+        _LOGGER.debug('async_load_entities() >>> entities of ' + str(len(meross_plug_uuids)) + ' Meross devices')
+        for ha_platform in (HA_SENSOR, HA_SWITCH):
+            self._hass.async_create_task(
+                discovery.async_load_platform(self._hass,
+                                              ha_platform,
+                                              DOMAIN,
+                                              {'meross_device_uuids': meross_plug_uuids},
+                                              self._config))
+
+    def remove_plug(self, meross_plug_uuid, vanished=False):
+        # remove the plug entities (each one removes itself on SIGNAL_DELETE_DEVICE_ENTITIES) and forget the plug
+        # vanished: the device is not in the Meross account anymore (not only changed) >>> its energy totals and the
+        # entity registry entries of its entities are dropped too
+        meross_plug = self.meross_plugs_by_uuid.pop(meross_plug_uuid)
+        _LOGGER.info(meross_plug.name + ' >>> removing ' + str(len(meross_plug.entity_ids)) + ' entities')
+        async_dispatcher_send(self._hass, SIGNAL_DELETE_DEVICE_ENTITIES.format(meross_plug_uuid), vanished)
+        meross_plug.close()
+        if vanished and meross_plug.energy is not None:
+            self.energy_store.remove_meter(meross_plug_uuid)
+        self.scheduler.remove(meross_plug_uuid)
+        self.states.remove_device(meross_plug_uuid)
+        self.metrics.devices_by_uuid.pop(meross_plug_uuid, None)
+
+    async def async_set_device_channels(self, meross_device_uuid, targets, semaphore):
+
+        meross_plug = self.meross_plugs_by_uuid.get(meross_device_uuid)
+        if meross_plug is None:
+            _LOGGER.warning(SERVICE_SET_CHANNELS + ' >>> ' + meross_device_uuid + ' is not a known Meross device')
+            return [RESULT_UNKNOWN_DEVICE] * len(targets)
+        if not meross_plug.available:
+            _LOGGER.warning(SERVICE_SET_CHANNELS + ' >>> ' + meross_plug.name + ' is not online')
+            return [RESULT_OFFLINE] * len(targets)
+
+        # the channels the device does not have are not sent to it
+        valid_targets = [target for target in targets if target[ATTR_CHANNEL] in meross_plug.switch_slots]
+        if len(valid_targets) < len(targets):
+            _LOGGER.warning(SERVICE_SET_CHANNELS + ' >>> ' + meross_plug.name + ' >>> unknown channels: ' +
+                            str([target[ATTR_CHANNEL] for target in targets if target not in valid_targets]))
+
+        # the earlier targets of a channel targeted more than once are not sent (the pipeline would collapse them)
+        last_target_by_channel = {target[ATTR_CHANNEL]: target for target in valid_targets}
+        result_by_target = {id(target): RESULT_SUPERSEDED for target in valid_targets}
+        sent_targets = list(last_target_by_channel.values())
+
+        async with semaphore:
+            # the command pipeline serialises the commands of the device
+            results = await asyncio.gather(*[meross_plug.commands.async_set(target[ATTR_CHANNEL], target[ATTR_STATE])
+                                             for target in sent_targets],
+                                           return_exceptions=True)
+
+        result_by_target.update({id(target): result for target, result in zip(sent_targets, results)})
+        return [RESULT_ERROR if isinstance(result, Exception) else result
+                for result in [result_by_target.get(id(target), RESULT_UNKNOWN_CHANNEL) for target in targets]]
 
-        except CommandTimeoutException:
-            handle_command_timeout_exception('start_meross_manager()')
+    def meross_event_handler(self, eventobj):
+        # WARNING: called by the meross_iot MQTT thread >>> the event is only enqueued (see event_queue.py)
+        self.events.put(eventobj)
 
-        except UnauthorizedException:
-            handle_unauthorized_exception('start_meross_manager()')
+    @callback
+    def async_handle_events(self, batch):
+        # a batch of merged events (MerossEventBatch), applied with one update per affected entity
+        if batch.connection_status is not None:
+            # Fired when the MQTT client connects/disconnects to the MQTT broker
+            self.session.async_handle_connection_status(batch.connection_status)
 
-        except ConnectionError:
-            handle_connection_error_exception('start_meross_manager()')
+        # plugs whose entities are all to be updated, and {plug uuid: channels} to be updated
+        updated_plugs = set()
+        updated_channels_by_uuid = {}
 
-        pass
+        for meross_device, meross_device_availability in batch.online_by_uuid.values():
+            # lazy formatting: a power-restore batch has one online event per device
+            _LOGGER.debug("Device online status changed: %s went %s", meross_device.name, meross_device_availability)
+            meross_device_uuid = self.namespace + meross_device.uuid
+            if meross_device_uuid in self.meross_plugs_by_uuid:
+                # the device has been already discovered >>> update its availability
+                meross_plug = self.meross_plugs_by_uuid[meross_device_uuid]
+                meross_plug.set_availability(meross_device_availability)
+                if meross_device_availability:
+                    # the device is back online >>> it can be polled again right away (reconciling its state)
+                    meross_plug.breaker.reset()
+                    meross_plug.poll_priority = PRIORITY_PUSH
+                    self.scheduler.expire(meross_device_uuid)
+                else:
+                    # unreachable >>> backed off (an offline device is not polled anyway, see async_update_status)
+                    self.scheduler.record_poll(meross_device_uuid, False)
+                updated_plugs.add(meross_device_uuid)
+
+        for (uuid, channel), (meross_device, channel_status, channel_states) in batch.switch_by_channel.items():
+            _LOGGER.debug("Switch state changed: Device %s (channel %d) went %s",
+                          meross_device.name, channel, channel_status)
+            meross_device_uuid = self.namespace + uuid
+            meross_plug = self.meross_plugs_by_uuid.get(meross_device_uuid)
+            if meross_plug is not None and channel in meross_plug.switch_slots:
+                self.states.update(meross_plug.switch_slots[channel], value=channel_status)
+                # each state reached in the batch confirms the commands which targeted it
+                for is_on in channel_states:
+                    meross_plug.commands.confirm(channel, is_on)
+                updated_channels_by_uuid.setdefault(meross_device_uuid, set()).add(channel)
+                if len(meross_plug.sensor_slots) == 0:
+                    # the switches are all what this plug has, and they are covered by the push events
+                    self.scheduler.record_push(meross_device_uuid)
+
+        for meross_device_uuid in updated_plugs:
+            self.meross_plugs_by_uuid[meross_device_uuid].async_push_update()
+        for meross_device_uuid, channels in updated_channels_by_uuid.items():
+            if meross_device_uuid not in updated_plugs:
+                for channel in channels:
+                    self.meross_plugs_by_uuid[meross_device_uuid].async_push_update(channel)
+
+        if len(batch.online_by_uuid) > 0:
+            # added, removed or changed (e.g. after a firmware update) devices are discovered right away, once for
+            # the whole batch
+            self.async_request_discovery()
+
+        for event_type in batch.unknown_event_types:
+            _LOGGER.warning(str(event_type) + " is an unknown event!")
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -352,7 +1100,8 @@ class MerossPlatform:
 class MerossEntity(Entity):
     # Meross entity ( sensor / switch )
 
-    def __init__(self, hass, meross_device_uuid, meross_device_name, meross_entity_id, meross_entity_name, available):
+    def __init__(self, hass, meross_device_uuid, meross_device_name, meross_entity_id, meross_entity_name, available,
+                 meross_state_key=None):
 
         self.hass = hass
         self.entity_id = meross_entity_id
@@ -361,7 +1110,11 @@ class MerossEntity(Entity):
         self._meross_device_uuid = meross_device_uuid
         self._meross_entity_name = meross_entity_name
         self._meross_device_name = meross_device_name
+        self._meross_state_key = meross_state_key
         self._available = available
+        self._unsub_dispatchers = []
+        # the plug the entity is built for (a changed device gets a new plug, with the same uuid)
+        self._meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid.get(meross_device_uuid)
 
         _LOGGER.debug(self._meross_device_name + ' >>> ' + self._meross_entity_name + ' >>> __init__()')
 
@@ -373,12 +1126,16 @@ class MerossEntity(Entity):
         _LOGGER.debug(self._meross_device_name + ' >>> ' +
                       self._meross_entity_name + ' >>> entity_id: ' +
                       self.entity_id)
-        async_dispatcher_connect(self.hass,
-                                 SIGNAL_DELETE_ENTITY,
-                                 self._delete_callback)
-        async_dispatcher_connect(self.hass,
-                                 SIGNAL_UPDATE_ENTITY,
-                                 self._update_callback)
+        self._unsub_dispatchers.append(async_dispatcher_connect(self.hass,
+                                                                SIGNAL_DELETE_DEVICE_ENTITIES.format(
+                                                                    self._meross_device_uuid),
+                                                                self._delete_callback))
+        self._unsub_dispatchers.append(async_dispatcher_connect(self.hass,
+                                                                SIGNAL_UPDATE_DEVICE_ENTITIES.format(
+                                                                    self._meross_device_uuid),
+                                                                self._update_callback))
+        if self._meross_plug is not None:
+            self._meross_plug.entity_ids.add(self.entity_id)
         return True
 
     async def async_will_remove_from_hass(self):
@@ -386,60 +1143,83 @@ class MerossEntity(Entity):
         # unsubscribe from updates
         _LOGGER.debug(self._meross_device_name + ' >>> ' +
                       self._meross_entity_name + ' >>> async_will_remove_from_hass()')
+        for unsub_dispatcher in self._unsub_dispatchers:
+            unsub_dispatcher()
+        self._unsub_dispatchers = []
+        if self._meross_plug is not None:
+            self._meross_plug.entity_ids.discard(self.entity_id)
         return True
 
     async def async_update(self):
         # update is done in the update function
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> async_update()')
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'async_update()')
+        self.refresh_state()
+        return True
+
+    def refresh_state(self):
+        # Read the new state (from the state store); return True if it has to be written in HA
         return True
 
+    @property
+    def should_poll(self):
+        # The states are pushed by the MerossPlatform (MQTT events and status updates) >>> no polling
+        return False
+
     @property
     def device_id(self):
         # Return Meross device id.
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> device_id() >>> ' +
-                      self._meross_device_uuid)
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'device_id()', self._meross_device_uuid)
         return self._meross_device_uuid
 
     @property
     def unique_id(self):
         # Return a unique ID."
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> unique_id() >>> ' +
-                      self.entity_id)
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'unique_id()')
         return self.entity_id
 
     @property
     def name(self):
         # Return Meross device name.
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> name() >>> ' +
-                      self._meross_device_name)
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'name()', self._meross_device_name)
         return self._meross_device_name
 
     @property
     def available(self):
         # Return if the device is available.
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> available() >>> ' +
-                      str(self._available))
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'available()', self._available)
         return self._available
 
     @callback
-    def _delete_callback(self, entity_id):
-        # Remove this entity.
-        if entity_id == self.entity_id:
-            _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                          self._meross_entity_name + ' >>> _delete_callback()')
-            self.hass.async_create_task(self.async_remove())
+    def _delete_callback(self, forget=False):
+        # Remove this entity (and its entity registry entry too, if forget).
+        _LOGGER.debug(self._meross_device_name + ' >>> ' +
+                      self._meross_entity_name + ' >>> _delete_callback()')
+        self.hass.async_create_task(self.async_delete(forget))
+
+    async def async_delete(self, forget):
+        # the entity is removed before its registry entry
+        entity_id = self.entity_id
+        await self.async_remove()
+        if forget:
+            registry = await async_get_registry(self.hass)
+            if registry.async_is_registered(entity_id):
+                registry.async_remove(entity_id)
 
     @callback
-    def _update_callback(self):
-        # Call update method.
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> _update_callback()')
-        self.async_schedule_update_ha_state(True)
+    def _update_callback(self, meross_state_key=None):
+        # Call update method (if the update concerns this entity).
+        if meross_state_key is not None and meross_state_key != self._meross_state_key:
+            return
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, '_update_callback()', meross_state_key)
+        # no state write if nothing (significant) has changed
+        if self.refresh_state():
+            self.async_schedule_update_ha_state()
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -449,22 +1229,16 @@ class MerossEntity(Entity):
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def handle_unauthorized_exception(caller):
-    _LOGGER.warning('UnauthorizedException when executing ' + caller + ' >>> check: a) internet connection, b) Meross '
-                                                                       'account credentials')
-    pass
-
-
 def handle_command_timeout_exception(caller):
     _LOGGER.warning('CommandTimeoutException when executing ' + caller)
     pass
 
 
-def handle_connection_error_exception(caller):
-    _LOGGER.warning('ConnectionError when executing ' + caller + ' >>> check internet connection')
+def handle_status_timeout_exception(caller):
+    _LOGGER.warning('StatusTimeout when executing ' + caller + ' >>> check internet connection')
     pass
 
 
-def handle_status_timeout_exception(caller):
-    _LOGGER.warning('StatusTimeout when executing ' + caller + ' >>> check internet connection')
+def handle_update_timeout_exception(name, timeout):
+    _LOGGER.warning('Updating the Meross plug ' + name + ' status took more than ' + str(timeout) + ' >>> skipped')
     pass
@@ -0,0 +1,397 @@
+# Event-storm harness: records the meross_iot events (online status, switch status, client connection) to a compact
+# trace file, and replays a trace into MerossPlatform.meross_event_handler (against the simulated Meross cloud, see
+# simulator.py), at the original or at an accelerated speed. Run it from the Home Assistant configuration folder:
+#
+#     python -m custom_components.meross.bench.event_storm record --username U --password P --duration 600 storm.gz
+#     python -m custom_components.meross.bench.event_storm generate --devices 500 --window 5 storm.gz
+#     python -m custom_components.meross.bench.event_storm replay --speed 10 storm.gz
+#
+import argparse
+import asyncio
+import collections
+import gzip
+import logging
+import random
+import tempfile
+import threading
+import time
+
+from meross_iot.cloud.client_status import ClientStatus
+from meross_iot.meross_event import MerossEventType
+
+from homeassistant.components.switch import ENTITY_ID_FORMAT
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import (HomeAssistant, callback)
+from homeassistant.setup import async_setup_component
+
+from custom_components.meross import (CONFIG_SCHEMA, DOMAIN, MerossHub, MerossPlatform)
+from custom_components.meross.bench.simulator import (FakeMerossCloud, FakeMerossEvent)
+from custom_components.meross.bench.update_cycle import (LoopLagMonitor, percentile)
+
+# Setting log
+_LOGGER = logging.getLogger('meross_bench')
+
+TRACE_HEADER = '# meross event trace v1'
+# trace lines (tab separated), the event times are in ms from the previous event:
+#   D <uuid> <channels> <name>               a device, referred to by its index (order of appearance)
+#   O <ms> <device index> <0|1>              DEVICE_ONLINE_STATUS
+#   S <ms> <device index> <channel> <0|1>    DEVICE_SWITCH_STATUS
+#   C <ms> <ClientStatus name>               CLIENT_CONNECTION
+KIND_DEVICE = 'D'
+KIND_ONLINE = 'O'
+KIND_SWITCH = 'S'
+KIND_CONNECTION = 'C'
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# EVENT TRACE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossEventTrace:
+    # The devices ([uuid, channels, name]) and the events ((seconds from the start, kind, device index, channel,
+    # value)) of a trace; gzip compressed if the file name ends with .gz
+
+    def __init__(self):
+        self.devices = []
+        self.events = []
+        self._index_by_uuid = {}
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def duration(self):
+        return self.events[-1][0] if len(self.events) > 0 else 0.0
+
+    def device_index(self, uuid, channels, name):
+        if uuid not in self._index_by_uuid:
+            self._index_by_uuid[uuid] = len(self.devices)
+            self.devices.append([uuid, max(1, channels), name])
+        return self._index_by_uuid[uuid]
+
+    def add(self, timestamp, kind, device_index=None, channel=None, value=None):
+        self.events.append((timestamp, kind, device_index, channel, value))
+
+    def save(self, filename):
+        lines = [TRACE_HEADER]
+        for uuid, channels, name in self.devices:
+            lines.append('\t'.join([KIND_DEVICE, uuid, str(channels), name.replace('\t', ' ')]))
+        last_ms = 0
+        for timestamp, kind, device_index, channel, value in self.events:
+            ms = int(round(timestamp * 1000))
+            fields = [kind, str(ms - last_ms)]
+            last_ms = ms
+            if kind == KIND_ONLINE:
+                fields += [str(device_index), '1' if value else '0']
+            elif kind == KIND_SWITCH:
+                fields += [str(device_index), str(channel), '1' if value else '0']
+            else:
+                fields += [value]
+            lines.append('\t'.join(fields))
+        with open_trace(filename, 'wt') as trace_file:
+            trace_file.write('\n'.join(lines) + '\n')
+
+    @classmethod
+    def load(cls, filename):
+        trace = cls()
+        ms = 0
+        with open_trace(filename, 'rt') as trace_file:
+            for line in trace_file:
+                line = line.rstrip('\n')
+                if line == '' or line.startswith('#'):
+                    continue
+                fields = line.split('\t')
+                kind = fields[0]
+                if kind == KIND_DEVICE:
+                    trace.device_index(fields[1], int(fields[2]), fields[3])
+                    continue
+                ms += int(fields[1])
+                if kind == KIND_ONLINE:
+                    trace.add(ms / 1000.0, kind, int(fields[2]), None, fields[3] == '1')
+                elif kind == KIND_SWITCH:
+                    trace.add(ms / 1000.0, kind, int(fields[2]), int(fields[3]), fields[4] == '1')
+                elif kind == KIND_CONNECTION:
+                    trace.add(ms / 1000.0, kind, None, None, fields[2])
+        return trace
+
+
+def open_trace(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+
+class MerossEventRecorder:
+    # meross_iot event handler (called by the MQTT thread) adding the events to a trace
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._lock = threading.Lock()
+        self._start = None
+
+    def handle(self, eventobj):
+        with self._lock:
+            now = time.monotonic()
+            if self._start is None:
+                self._start = now
+            timestamp = now - self._start
+            if eventobj.event_type == MerossEventType.CLIENT_CONNECTION:
+                self.trace.add(timestamp, KIND_CONNECTION, value=eventobj.status.name)
+            elif eventobj.event_type == MerossEventType.DEVICE_ONLINE_STATUS:
+                self.trace.add(timestamp, KIND_ONLINE, self.device_index(eventobj.device), value=eventobj.status)
+            elif eventobj.event_type == MerossEventType.DEVICE_SWITCH_STATUS:
+                self.trace.add(timestamp, KIND_SWITCH, self.device_index(eventobj.device), eventobj.channel_id,
+                               eventobj.switch_state)
+
+    def device_index(self, device):
+        return self.trace.device_index(device.uuid, len(device.get_channels()), device.name)
+
+
+def generate_power_restore(devices, channels, window, seed=None):
+    # synthetic storm: all the devices come back online within window seconds, each one then notifies the status
+    # of its channels
+    generator = random.Random(seed)
+    timeline = []
+    trace = MerossEventTrace()
+    for index in range(devices):
+        device_index = trace.device_index('%032x' % index, channels, 'Simulated plug ' + str(index))
+        online_at = generator.uniform(0, window)
+        timeline.append((online_at, KIND_ONLINE, device_index, None, True))
+        for channel in range(channels):
+            timeline.append((online_at + generator.uniform(0.05, 0.5), KIND_SWITCH, device_index, channel,
+                             generator.random() < 0.5))
+    timeline.sort(key=lambda event: event[0])
+    for event in timeline:
+        trace.add(*event)
+    return trace
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# REPLAY
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossEventReplayer:
+    # Replays a trace into MerossPlatform.meross_event_handler from a dedicated thread (as the meross_iot MQTT thread
+    # does), speed times faster than recorded (0: as fast as possible), and measures the latency from each event to
+    # the first state write of an entity it affects (events merged or not changing any state get no write)
+
+    def __init__(self, hass, platform, cloud, trace, speed):
+        self._hass = hass
+        self._platform = platform
+        self._trace = trace
+        self.speed = speed
+        self._devices = cloud.devices
+        self._lock = threading.Lock()
+        # {(uuid, channel or None): [event times]} not written yet
+        self._pending = collections.defaultdict(list)
+        self._keys_by_entity_id = {}
+        self.latencies = []
+        self.sent = 0
+        self.started_at = None
+        self.sent_at = None
+
+    def map_entities(self):
+        # entity id >>> the state keys whose events it writes (any entity of a device for its online status)
+        for meross_plug in self._platform.meross_plugs_by_uuid.values():
+            name, channels, usb_channel, supports_electricity = meross_plug.descriptor
+            for entity_id in meross_plug.entity_ids:
+                self._keys_by_entity_id[entity_id] = [(meross_plug.uuid, None)]
+            for channel in range(channels):
+                suffix = ''
+                if channel > 0:
+                    suffix = '_' + str(channel)
+                if usb_channel is not None and usb_channel == channel:
+                    suffix = '_usb'
+                entity_id = ENTITY_ID_FORMAT.format(DOMAIN + '_' + meross_plug.uuid + suffix)
+                self._keys_by_entity_id.setdefault(entity_id, []).append((meross_plug.uuid, channel))
+
+    @callback
+    def async_handle_state_changed(self, event):
+        keys = self._keys_by_entity_id.get(event.data.get('entity_id'))
+        if keys is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                generated = self._pending.pop(key, None)
+                if generated:
+                    self.latencies.append(now - generated[0])
+
+    def run(self):
+        # WARNING: blocking >>> run in its own thread
+        self.started_at = time.monotonic()
+        for timestamp, kind, device_index, channel, value in self._trace.events:
+            if self.speed > 0:
+                delay = self.started_at + timestamp / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            eventobj = self.build_event(kind, device_index, channel, value)
+            if eventobj is None:
+                continue
+            if kind != KIND_CONNECTION:
+                with self._lock:
+                    self._pending[(eventobj.device.uuid, channel)].append(eventobj.generated_at)
+            self._platform.meross_event_handler(eventobj)
+            self.sent += 1
+        self.sent_at = time.monotonic()
+
+    def build_event(self, kind, device_index, channel, value):
+        if kind == KIND_CONNECTION:
+            if value not in ClientStatus.__members__:
+                return None
+            return FakeMerossEvent(MerossEventType.CLIENT_CONNECTION, None, status=ClientStatus[value])
+        device = self._devices[device_index]
+        if kind == KIND_ONLINE:
+            # meross_iot updates the device before notifying
+            device.online = value
+            return FakeMerossEvent(MerossEventType.DEVICE_ONLINE_STATUS, device, status=value)
+        if channel >= len(device.channel_states):
+            return None
+        device.channel_states[channel] = value
+        return FakeMerossEvent(MerossEventType.DEVICE_SWITCH_STATUS, device, channel_id=channel, switch_state=value)
+
+    @property
+    def unwritten(self):
+        with self._lock:
+            return sum(len(generated) for generated in self._pending.values())
+
+
+def build_cloud(trace):
+    # simulated Meross cloud with the devices of the trace (all of them offline, as after a power cut)
+    cloud = FakeMerossCloud(device_count=len(trace.devices), latency_mean=0.0, latency_jitter=0.0)
+    for device, (uuid, channels, name) in zip(cloud.devices, trace.devices):
+        device.uuid = uuid
+        device.name = name
+        device.channel_states = [False] * channels
+    return cloud
+
+
+async def async_replay(args):
+    trace = MerossEventTrace.load(args.trace)
+    cloud = build_cloud(trace)
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant()
+        hass.config.config_dir = config_dir
+        hass.config.skip_pip = True
+        await async_setup_component(hass, 'homeassistant', {})
+
+        config = CONFIG_SCHEMA({DOMAIN: {'username': 'bench', 'password': 'bench'}})
+        hass.data[DOMAIN] = MerossHub(hass)
+        # set up by hand (with the simulated Meross cloud): the sensor and switch platforms must not set it up again
+        hass.config.components.add(DOMAIN)
+        platform = hass.data[DOMAIN].add_platform(MerossPlatform(hass, config, config[DOMAIN][0],
+                                                                 manager_factory=cloud.manager_factory))
+        await platform.async_discover_plugs()
+        await hass.async_block_till_done()
+        for device in cloud.devices:
+            device.online = False
+        platform.scheduler.expire()
+        await platform.async_run_update_cycle()
+        await hass.async_block_till_done()
+
+        replayer = MerossEventReplayer(hass, platform, cloud, trace, args.speed)
+        replayer.map_entities()
+        unsub = hass.bus.async_listen(EVENT_STATE_CHANGED, replayer.async_handle_state_changed)
+
+        print('--- ' + str(len(trace)) + ' events, ' + str(len(trace.devices)) + ' devices, ' +
+              str(round(trace.duration, 1)) + ' s recorded, speed ' + (str(args.speed) if args.speed > 0 else 'max'))
+        received = platform.events.received
+        monitor = LoopLagMonitor()
+        monitor.start()
+        thread = threading.Thread(target=replayer.run, name='meross-replay', daemon=True)
+        thread.start()
+        while thread.is_alive() or platform.events.received - received < replayer.sent:
+            await asyncio.sleep(0.001)
+        handled_at = time.monotonic()
+        await hass.async_block_till_done()
+        await monitor.async_stop()
+        unsub()
+
+        elapsed = max(1e-9, handled_at - replayer.started_at)
+        print('offered  {:10.0f} events/s'.format(replayer.sent / max(1e-9, replayer.sent_at - replayer.started_at)))
+        print('handled  {:10.0f} events/s  ({} events in {:.3f} s, {} batches, {} merged)'.format(
+            replayer.sent / elapsed, replayer.sent, elapsed, platform.events.batches, platform.events.merged))
+        print('event to state write  n={:<6} p50={:8.1f} ms  p90={:8.1f} ms  p99={:8.1f} ms  max={:8.1f} ms  '
+              '({} events without a state write)'.format(len(replayer.latencies),
+                                                          1000 * percentile(replayer.latencies, 50),
+                                                          1000 * percentile(replayer.latencies, 90),
+                                                          1000 * percentile(replayer.latencies, 99),
+                                                          1000 * max(replayer.latencies or [float('nan')]),
+                                                          replayer.unwritten))
+        print('loop lag  p50={:6.1f} ms  p99={:6.1f} ms  max={:6.1f} ms  blocked={:8.1f} ms'.format(
+            1000 * percentile(monitor.lags, 50),
+            1000 * percentile(monitor.lags, 99),
+            1000 * max(monitor.lags or [0.0]),
+            1000 * monitor.blocked))
+
+        await hass.async_stop()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# RECORD
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+def record(args):
+    # WARNING: a real Meross account (the events are not replayed anywhere, just written to the trace)
+    from meross_iot.manager import MerossManager
+
+    trace = MerossEventTrace()
+    recorder = MerossEventRecorder(trace)
+    manager = MerossManager(args.username, args.password)
+    manager.register_event_handler(recorder.handle)
+    manager.start()
+    print('recording the Meross events for ' + str(args.duration) + ' s...')
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.stop()
+    trace.save(args.trace)
+    print(str(len(trace)) + ' events of ' + str(len(trace.devices)) + ' devices written to ' + args.trace)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Meross event-storm record/replay harness')
+    subparsers = parser.add_subparsers(dest='command')
+
+    record_parser = subparsers.add_parser('record', help='record the events of a Meross account')
+    record_parser.add_argument('--username', required=True)
+    record_parser.add_argument('--password', required=True)
+    record_parser.add_argument('--duration', type=float, default=600, help='seconds (Ctrl+C to stop earlier)')
+    record_parser.add_argument('trace')
+
+    generate_parser = subparsers.add_parser('generate', help='generate a power-restore storm')
+    generate_parser.add_argument('--devices', type=int, default=500)
+    generate_parser.add_argument('--channels', type=int, default=1)
+    generate_parser.add_argument('--window', type=float, default=5.0, help='seconds for all the devices to be back')
+    generate_parser.add_argument('--seed', type=int, default=None)
+    generate_parser.add_argument('trace')
+
+    replay_parser = subparsers.add_parser('replay', help='replay a trace into MerossPlatform.meross_event_handler')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='replay speed (0: as fast as possible)')
+    replay_parser.add_argument('trace')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == 'record':
+        record(args)
+    elif args.command == 'generate':
+        trace = generate_power_restore(args.devices, args.channels, args.window, args.seed)
+        trace.save(args.trace)
+        print(str(len(trace)) + ' events of ' + str(len(trace.devices)) + ' devices written to ' + args.trace)
+    elif args.command == 'replay':
+        asyncio.get_event_loop().run_until_complete(async_replay(args))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
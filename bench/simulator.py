@@ -0,0 +1,303 @@
+import hashlib
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from http.server import (BaseHTTPRequestHandler, HTTPServer)
+from socketserver import ThreadingMixIn
+
+from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException
+from meross_iot.meross_event import MerossEventType
+
+# Setting log
+_LOGGER = logging.getLogger('meross_simulator')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# FAKE MEROSS CLOUD
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FakeMerossCloud:
+    # In-process stand-in for the Meross cloud: it owns the simulated devices and the simulated MQTT broker.
+    # - device_count, channel_count, usb_channel, electricity: the simulated fleet
+    # - latency_mean, latency_jitter (seconds): the round-trip of each request (gaussian, never below 0)
+    # - timeout_rate (0..1): the probability that a request times out (after command_timeout seconds)
+    # - event_rate (events per second): the rate of the spontaneous MQTT events (switch and online status)
+
+    def __init__(self, device_count=10, channel_count=1, usb_channel=False, electricity=True,
+                 latency_mean=0.2, latency_jitter=0.05, timeout_rate=0.0, command_timeout=2.0,
+                 event_rate=0.0, seed=None):
+        self.latency_mean = latency_mean
+        self.latency_jitter = latency_jitter
+        self.timeout_rate = timeout_rate
+        self.command_timeout = command_timeout
+        self.event_rate = event_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._managers = []
+        self._local_servers = []
+        self.devices = [FakeMerossPlug(self,
+                                       '%032x' % index,
+                                       'Simulated plug ' + str(index),
+                                       channel_count + (1 if usb_channel else 0),
+                                       channel_count if usb_channel else None,
+                                       electricity)
+                        for index in range(device_count)]
+
+    def manager_factory(self, username, password):
+        # to be given to MerossPlatform instead of MerossManager
+        manager = FakeMerossManager(self)
+        self._managers.append(manager)
+        return manager
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def choice(self, items):
+        with self._lock:
+            return self._random.choice(items)
+
+    def request(self):
+        # WARNING: blocking, as the meross_iot requests
+        with self._lock:
+            self.requests += 1
+            timed_out = self._random.random() < self.timeout_rate
+            latency = max(0.0, self._random.gauss(self.latency_mean, self.latency_jitter))
+        if timed_out:
+            time.sleep(self.command_timeout)
+            raise CommandTimeoutException()
+        time.sleep(latency)
+
+    def publish(self, eventobj):
+        for manager in self._managers:
+            manager.publish(eventobj)
+
+    def start_local_servers(self, count, key, latency=0.005):
+        # LAN access to the first count devices: returns the {uuid: host} to be given to meross_local_hosts
+        hosts = {}
+        for device in self.devices[:count]:
+            server = FakeMerossLocalServer(device, key, latency)
+            server.start()
+            self._local_servers.append(server)
+            hosts[device.uuid] = server.host
+        return hosts
+
+    def stop_local_servers(self):
+        for server in self._local_servers:
+            server.stop()
+        self._local_servers = []
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# FAKE MEROSS MANAGER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FakeMerossManager:
+    # Stand-in for meross_iot.manager.MerossManager: the event handlers are called by a dedicated thread,
+    # as the meross_iot MQTT thread does
+
+    def __init__(self, cloud):
+        self._cloud = cloud
+        self._event_handlers = []
+        self._events = queue.Queue()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._mqtt_loop, name='meross-simulator-mqtt', daemon=True)]
+        if self._cloud.event_rate > 0:
+            self._threads.append(threading.Thread(target=self._events_loop, name='meross-simulator-events',
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._running = False
+        self._events.put(None)
+
+    def register_event_handler(self, handler):
+        self._event_handlers.append(handler)
+
+    def get_devices_by_kind(self, kind):
+        return list(self._cloud.devices)
+
+    def publish(self, eventobj):
+        self._events.put(eventobj)
+
+    def _mqtt_loop(self):
+        while self._running:
+            eventobj = self._events.get()
+            if eventobj is None:
+                break
+            for handler in self._event_handlers:
+                handler(eventobj)
+
+    def _events_loop(self):
+        # spontaneous events: mostly switch status changes, some online status changes
+        while self._running:
+            time.sleep(1.0 / self._cloud.event_rate)
+            device = self._cloud.choice(self._cloud.devices)
+            if self._cloud.random() < 0.9:
+                channel = self._cloud.choice(range(len(device.channel_states)))
+                device.set_channel(channel, not device.channel_states[channel])
+            else:
+                device.set_online(not device.online)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# FAKE MEROSS PLUG
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FakeMerossPlug:
+    # Stand-in for meross_iot.cloud.devices.power_plugs.GenericPlug
+
+    def __init__(self, cloud, uuid, name, channels, usb_channel, electricity):
+        self._cloud = cloud
+        self.uuid = uuid
+        self.name = name
+        self.online = True
+        self.channel_states = [False] * channels
+        self._usb_channel = usb_channel
+        self._electricity = electricity
+
+    def get_channels(self):
+        return [{} for channel in self.channel_states]
+
+    def get_usb_channel_index(self):
+        return self._usb_channel
+
+    def supports_electricity_reading(self):
+        return self._electricity
+
+    def get_sys_data(self):
+        self._cloud.request()
+        return self.sys_data()
+
+    def sys_data(self):
+        return {'all': {'digest': {'togglex': [{'channel': channel, 'onoff': 1 if is_on else 0}
+                                               for channel, is_on in enumerate(self.channel_states)]}}}
+
+    def get_channel_status(self, channel):
+        self._cloud.request()
+        return self.channel_states[channel]
+
+    def get_electricity(self):
+        self._cloud.request()
+        return self.electricity()
+
+    def electricity(self):
+        power = 0
+        if any(self.channel_states):
+            power = int(1000 * (50 + 10 * self._cloud.random()))
+        return {'channel': 0, 'power': power, 'current': power // 230, 'voltage': 2300 + int(20 * self._cloud.random())}
+
+    def turn_on_channel(self, channel):
+        self._cloud.request()
+        self.set_channel(channel, True)
+
+    def turn_off_channel(self, channel):
+        self._cloud.request()
+        self.set_channel(channel, False)
+
+    def set_channel(self, channel, is_on):
+        self.channel_states[channel] = is_on
+        self._cloud.publish(FakeMerossEvent(MerossEventType.DEVICE_SWITCH_STATUS, self, channel_id=channel,
+                                            switch_state=is_on))
+
+    def set_online(self, online):
+        self.online = online
+        self._cloud.publish(FakeMerossEvent(MerossEventType.DEVICE_ONLINE_STATUS, self, status=online))
+
+
+class FakeMerossEvent:
+    # Same attributes as the meross_iot events read by MerossEventQueue (see event_queue.py)
+
+    def __init__(self, event_type, device, **kwargs):
+        self.event_type = event_type
+        self.device = device
+        self.generated_at = time.monotonic()
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# FAKE MEROSS LOCAL SERVER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FakeMerossLocalServer:
+    # Stand-in for the HTTP server of a Meross device on the LAN (http://<host>/config): checks the signature, then
+    # answers to Appliance.System.All, Appliance.Control.Electricity and Appliance.Control.ToggleX (switch changes are
+    # also published to the simulated Meross cloud, as the real devices do)
+
+    def __init__(self, device, key, latency):
+        self.device = device
+        self.key = key
+        self.latency = latency
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.host = '127.0.0.1:' + str(self._server.server_address[1])
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='meross-simulator-local',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, message):
+        header = message.get('header', {})
+        expected_sign = hashlib.md5((header.get('messageId', '') + self.key +
+                                     str(header.get('timestamp', ''))).encode('utf-8')).hexdigest()
+        if header.get('sign') != expected_sign:
+            return 'ERROR', {'error': {'code': 5001, 'detail': 'sign error'}}
+        time.sleep(self.latency)
+        namespace = header.get('namespace')
+        if namespace == 'Appliance.System.All':
+            return 'GETACK', self.device.sys_data()
+        if namespace == 'Appliance.Control.Electricity':
+            return 'GETACK', {'electricity': self.device.electricity()}
+        if namespace == 'Appliance.Control.ToggleX':
+            togglex = message['payload']['togglex']
+            self.device.set_channel(togglex['channel'], togglex['onoff'] == 1)
+            return 'SETACK', {}
+        return 'ERROR', {'error': {'code': 5000, 'detail': 'unknown namespace ' + str(namespace)}}
+
+    def _handler_class(self):
+        local_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                message = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                method, payload = local_server.handle(message)
+                answer = json.dumps({'header': dict(message.get('header', {}), method=method),
+                                     'payload': payload}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
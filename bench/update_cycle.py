@@ -0,0 +1,210 @@
+# Update-cycle benchmark suite: MerossPlatform against the simulated Meross cloud (see simulator.py).
+# Run it from the Home Assistant configuration folder (the one containing custom_components):
+#
+#     python -m custom_components.meross.bench.update_cycle --devices 10,100,1000
+#
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from homeassistant.core import HomeAssistant
+from homeassistant.setup import async_setup_component
+
+from custom_components.meross import (CONFIG_SCHEMA, DOMAIN, MerossHub, MerossPlatform)
+from custom_components.meross.bench.simulator import FakeMerossCloud
+
+# Setting log
+_LOGGER = logging.getLogger('meross_bench')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEASURES
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class LoopLagMonitor:
+    # Measures how long the event loop is blocked: a task sleeping interval seconds should wake up in time,
+    # any further delay means that something was running on the loop without yielding
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._async_probe())
+
+    async def async_stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _async_probe(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.monotonic() - start - self.interval))
+
+    @property
+    def blocked(self):
+        return sum(self.lags)
+
+
+def percentile(samples, p):
+    if len(samples) == 0:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def report(name, samples, monitor):
+    print('{:<12} n={:<6} p50={:8.1f} ms  p90={:8.1f} ms  p99={:8.1f} ms  max={:8.1f} ms  '
+          'loop blocked={:8.1f} ms (max lag {:6.1f} ms)'.format(name,
+                                                                len(samples),
+                                                                1000 * percentile(samples, 50),
+                                                                1000 * percentile(samples, 90),
+                                                                1000 * percentile(samples, 99),
+                                                                1000 * max(samples or [float('nan')]),
+                                                                1000 * monitor.blocked,
+                                                                1000 * max(monitor.lags or [0.0])))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# SCENARIOS
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+async def async_measure(coroutine_factory, repetitions):
+    samples = []
+    monitor = LoopLagMonitor()
+    monitor.start()
+    for repetition in range(repetitions):
+        start = time.monotonic()
+        await coroutine_factory()
+        samples.append(time.monotonic() - start)
+    await monitor.async_stop()
+    return samples, monitor
+
+
+async def async_bench_discovery(hass, platform):
+    # first discovery: empty inventory, and HA not started (the platform connects to the Meross cloud on
+    # EVENT_HOMEASSISTANT_START) >>> every plug and entity is built here
+    if len(platform.meross_plugs_by_uuid) > 0:
+        raise RuntimeError('the platform has already discovered its plugs')
+
+    async def async_discover():
+        await platform.async_discover_plugs()
+        await hass.async_block_till_done()
+    return await async_measure(async_discover, 1)
+
+
+async def async_bench_update_cycle(hass, platform, cycles):
+    async def async_update():
+        # full cycle >>> every plug is due
+        platform.scheduler.expire()
+        await platform.async_run_update_cycle()
+    return await async_measure(async_update, cycles)
+
+
+async def async_bench_commands(hass, platform, cloud, commands):
+    async def async_command():
+        device = cloud.choice(cloud.devices)
+        meross_plug = platform.meross_plugs_by_uuid[device.uuid]
+        await meross_plug.commands.async_set(0, not device.channel_states[0])
+    return await async_measure(async_command, commands)
+
+
+async def async_bench_events(hass, platform, cloud, events):
+    # events are published by the simulated MQTT thread, the measure ends when all of them have been handled (in
+    # batches, by the event queue of the platform)
+    received = platform.events.received
+
+    async def async_storm():
+        for index in range(events):
+            device = cloud.devices[index % len(cloud.devices)]
+            device.set_channel(0, not device.channel_states[0])
+        while platform.events.received - received < events:
+            await asyncio.sleep(0.001)
+
+    samples, monitor = await async_measure(async_storm, 1)
+    # per-event time
+    return [sample / events for sample in samples], monitor
+
+
+async def async_bench_fleet(args, device_count):
+    cloud = FakeMerossCloud(device_count=device_count,
+                            channel_count=args.channels,
+                            latency_mean=args.latency,
+                            latency_jitter=args.jitter,
+                            timeout_rate=args.timeout_rate,
+                            command_timeout=args.command_timeout,
+                            event_rate=args.event_rate,
+                            seed=args.seed)
+
+    local_key = 'bench'
+    local_hosts = cloud.start_local_servers(min(args.local, device_count), local_key, args.local_latency)
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant()
+        hass.config.config_dir = config_dir
+        hass.config.skip_pip = True
+        await async_setup_component(hass, 'homeassistant', {})
+
+        config = CONFIG_SCHEMA({DOMAIN: {'username': 'bench', 'password': 'bench',
+                                         'meross_max_concurrent_updates': args.concurrency,
+                                         'meross_max_workers': args.concurrency,
+                                         'meross_local_hosts': local_hosts,
+                                         'meross_local_key': local_key}})
+        hass.data[DOMAIN] = MerossHub(hass)
+        # set up by hand (with the simulated Meross cloud): the sensor and switch platforms must not set it up again
+        hass.config.components.add(DOMAIN)
+        platform = hass.data[DOMAIN].add_platform(MerossPlatform(hass, config, config[DOMAIN][0],
+                                                                 manager_factory=cloud.manager_factory))
+        await hass.async_block_till_done()
+
+        print('--- ' + str(device_count) + ' devices (' + str(len(local_hosts)) + ' on the LAN)')
+        report('discovery', *await async_bench_discovery(hass, platform))
+        report('update', *await async_bench_update_cycle(hass, platform, args.cycles))
+        report('command', *await async_bench_commands(hass, platform, cloud, args.commands))
+        report('event', *await async_bench_events(hass, platform, cloud, args.events))
+        print('cloud requests: ' + str(cloud.requests))
+
+        await hass.async_stop()
+
+    cloud.stop_local_servers()
+
+
+async def async_main(args):
+    for device_count in args.devices:
+        await async_bench_fleet(args, device_count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Meross update-cycle benchmark (simulated Meross cloud)')
+    parser.add_argument('--devices', type=lambda s: [int(n) for n in s.split(',')], default=[10, 100, 1000])
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.2, help='mean request latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.05, help='request latency standard deviation (s)')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='probability of a request timeout')
+    parser.add_argument('--command-timeout', type=float, default=2.0, help='duration of a request timeout (s)')
+    parser.add_argument('--event-rate', type=float, default=0.0, help='spontaneous MQTT events per second')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--commands', type=int, default=20)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--local', type=int, default=0, help='devices reachable on the LAN (local transport)')
+    parser.add_argument('--local-latency', type=float, default=0.005, help='LAN request latency (s)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.get_event_loop().run_until_complete(async_main(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import logging
+import random
+
+from custom_components.meross.scheduler import monotonic
+
+# Setting log
+_LOGGER = logging.getLogger('meross_breaker')
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS CIRCUIT BREAKER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossCircuitBreaker:
+    # Per-device circuit breaker:
+    # - closed: requests are allowed, consecutive failures are counted
+    # - open: after failure_threshold consecutive failures, requests are refused for an exponential backoff (+ jitter)
+    # - half open: once the backoff has elapsed, a single probe request is allowed; its outcome closes or re-opens
+
+    def __init__(self, name, failure_threshold, base_backoff, max_backoff, jitter=0.2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff.total_seconds()
+        self.max_backoff = max(self.base_backoff, max_backoff.total_seconds())
+        self.jitter = jitter
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self._openings = 0
+        self._open_until = 0
+        self._probing = False
+
+    def allow_request(self, now=None):
+        if self.state == STATE_CLOSED:
+            return True
+        now = monotonic(now)
+        if self.state == STATE_OPEN and now >= self._open_until:
+            _LOGGER.info(self.name + ' >>> circuit breaker half open >>> probing')
+            self.state = STATE_HALF_OPEN
+        if self.state == STATE_HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != STATE_CLOSED:
+            _LOGGER.info(self.name + ' >>> circuit breaker closed')
+        self.reset()
+
+    def record_failure(self, now=None):
+        self.failures += 1
+        self._probing = False
+        if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** self._openings))
+            backoff *= 1 + random.uniform(-self.jitter, self.jitter)
+            self._openings += 1
+            self._open_until = monotonic(now) + backoff
+            self.state = STATE_OPEN
+            _LOGGER.warning(self.name + ' >>> ' + str(self.failures) + ' consecutive failures >>> ' +
+                            'circuit breaker open for ' + str(round(backoff, 1)) + ' s')
+
+    def release_probe(self):
+        # the probe allowed by allow_request() has not been sent (e.g. the device is offline)
+        self._probing = False
+
+    def reset(self):
+        # e.g. the device has notified to be online again
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self._openings = 0
+        self._open_until = 0
+        self._probing = False
@@ -0,0 +1,77 @@
+import logging
+import time
+
+from custom_components.meross.tracer import TRACER
+
+# Setting log
+_LOGGER = logging.getLogger('meross_cycles')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS CYCLE MANAGER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossCycleManager:
+    # Periodic cycles (e.g. the update of the due devices) which never overlap:
+    # - a tick firing while the previous cycle is still running is skipped and counted as missed; its work is merged
+    #   in the next cycle (the devices not updated stay due, the most overdue first)
+    # - after an overrun (a cycle longer than the interval) the next cycle is given a smaller budget (the number of
+    #   devices it may process), proportional to the throughput of the last one; the budget doubles back after each
+    #   cycle shorter than half the interval, and it is lifted once it does not limit the cycles anymore
+    # cycle: coroutine function (budget, None meaning no limit) returning the number of devices processed
+
+    def __init__(self, name, interval, cycle, min_budget=1):
+        self.name = name
+        self.interval = interval.total_seconds()
+        self._cycle = cycle
+        self.min_budget = max(1, min_budget)
+        self.budget = None
+        self.running = False
+        self.cycles = 0
+        self.missed_ticks = 0
+        self.overruns = 0
+        self.last_duration = None
+
+    async def async_tick(self, now=None):
+        if self.running:
+            self.missed_ticks += 1
+            _LOGGER.debug(self.name + ' cycle still running >>> tick skipped (' + str(self.missed_ticks) + ' missed)')
+            if TRACER.enabled:
+                TRACER.record(self.name, 'tick skipped', self.missed_ticks)
+            return False
+        self.running = True
+        start = time.monotonic()
+        try:
+            processed = await self._cycle(self.budget)
+        finally:
+            self.running = False
+        self.cycles += 1
+        self.adapt(processed, time.monotonic() - start)
+        return True
+
+    def adapt(self, processed, duration):
+        self.last_duration = duration
+        if duration > self.interval:
+            self.overruns += 1
+            self.budget = max(self.min_budget, int(processed * self.interval / duration))
+            _LOGGER.warning(self.name + ' cycle took ' + str(round(duration, 1)) + ' s (interval ' +
+                            str(self.interval) + ' s) >>> next cycle limited to ' + str(self.budget) + ' devices')
+        elif self.budget is not None and duration < self.interval / 2:
+            if processed < self.budget:
+                self.budget = None
+                _LOGGER.info(self.name + ' cycles back within their interval >>> no device limit')
+            else:
+                self.budget *= 2
+        if TRACER.enabled:
+            TRACER.record(self.name, 'cycle', processed, duration, self.budget)
+
+    def as_dict(self):
+        return {
+            'cycles': self.cycles,
+            'missed_ticks': self.missed_ticks,
+            'overruns': self.overruns,
+            'budget': self.budget,
+            'last_duration_ms': None if self.last_duration is None else int(round(self.last_duration * 1000)),
+        }
@@ -0,0 +1,136 @@
+import functools
+import time
+
+from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException
+from meross_iot.cloud.exceptions.StatusTimeoutException import StatusTimeoutException
+
+from custom_components.meross.local_transport import (MerossLocalError, MerossLocalTimeoutError)
+from custom_components.meross.metrics import (OPERATION_COMMAND, OPERATION_CONSUMPTION, OPERATION_ELECTRICITY,
+                                              OPERATION_LOCAL_PREFIX, OPERATION_STATUS, OUTCOME_ERROR, OUTCOME_SUCCESS,
+                                              OUTCOME_TIMEOUT)
+from custom_components.meross.request_queue import (MerossRequestQueue, PRIORITY_COMMAND, PRIORITY_POLL,
+                                                    PRIORITY_PUSH)
+from custom_components.meross.tracer import TRACER
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS DEVICE ADAPTER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossDeviceAdapter:
+    # Awaitable facade of a meross_iot device: every (blocking) meross_iot call is run on the executor
+    # (a dedicated and bounded thread pool), so that the Home Assistant event loop is never frozen.
+    # The latency and the outcome of each call are recorded in the device metrics.
+    # With a local transport (MerossLocalTransport), status reads, electricity reads and commands go through the LAN
+    # first, and through the Meross cloud (meross_iot) if the device cannot be reached locally.
+    # The requests to the device go through its request queue (see request_queue.py): serialised, by priority.
+
+    def __init__(self, loop, executor, meross_device, metrics, local=None):
+        self._loop = loop
+        self._executor = executor
+        self.device = meross_device
+        self.metrics = metrics
+        self.local = local
+        self.queue = MerossRequestQueue(loop, meross_device.name)
+
+    async def async_run(self, operation, func, *args):
+        # WARNING: func is potentially blocking >>> it must never be run in the event loop
+        if TRACER.enabled:
+            TRACER.record(self.device.name, func.__name__, *args)
+        outcome = OUTCOME_ERROR
+        start = time.monotonic()
+        try:
+            result = await self._loop.run_in_executor(self._executor, functools.partial(func, *args))
+            outcome = OUTCOME_SUCCESS
+            return result
+        except (CommandTimeoutException, StatusTimeoutException, MerossLocalTimeoutError):
+            outcome = OUTCOME_TIMEOUT
+            raise
+        finally:
+            duration = time.monotonic() - start
+            self.metrics.record(operation, duration, outcome)
+            if TRACER.enabled:
+                TRACER.record(self.device.name, func.__name__, outcome, duration)
+
+    async def async_run_local_first(self, operation, name, *args):
+        # name: the method of the local transport / of the meross_iot device
+        if self.local is not None and self.local.reachable:
+            try:
+                return await self.async_run(OPERATION_LOCAL_PREFIX + operation, getattr(self.local, name), *args)
+            except MerossLocalError:
+                if TRACER.enabled:
+                    TRACER.record(self.device.name, name, 'local failed >>> Meross cloud')
+        return await self.async_run(operation, getattr(self.device, name), *args)
+
+    async def async_get_channel_status(self, channel, priority=PRIORITY_PUSH):
+        # read back of a channel whose command has not been confirmed
+        return await self.queue.async_submit(priority, 'channel_status_' + str(channel),
+                                             self.async_run, OPERATION_STATUS, self.device.get_channel_status, channel)
+
+    async def async_get_electricity(self, priority=PRIORITY_POLL):
+        return await self.queue.async_submit(priority, 'electricity',
+                                             self.async_run_local_first, OPERATION_ELECTRICITY, 'get_electricity')
+
+    async def async_get_power_consumption(self, priority=PRIORITY_POLL):
+        return await self.queue.async_submit(priority, 'consumption',
+                                             self.async_run, OPERATION_CONSUMPTION, self.device.get_power_consumption)
+
+    def supports_consumption_reading(self):
+        # daily energy history, not available on all the metering devices
+        return (hasattr(self.device, 'get_power_consumption') and
+                getattr(self.device, 'supports_consumption_reading', lambda: True)())
+
+    async def async_turn_on_channel(self, channel):
+        return await self.queue.async_submit(PRIORITY_COMMAND, None,
+                                             self.async_run_local_first, OPERATION_COMMAND, 'turn_on_channel', channel)
+
+    async def async_turn_off_channel(self, channel):
+        return await self.queue.async_submit(PRIORITY_COMMAND, None,
+                                             self.async_run_local_first, OPERATION_COMMAND, 'turn_off_channel', channel)
+
+    async def async_get_channels_status(self, channels, priority=PRIORITY_POLL):
+        return await self.queue.async_submit(priority, 'channels_status', self._async_get_channels_status, channels)
+
+    async def _async_get_channels_status(self, channels):
+        if self.local is not None and self.local.reachable:
+            try:
+                return await self.async_run(OPERATION_LOCAL_PREFIX + OPERATION_STATUS,
+                                            self.get_channels_status, channels, self.local)
+            except MerossLocalError:
+                if TRACER.enabled:
+                    TRACER.record(self.device.name, 'get_channels_status', 'local failed >>> Meross cloud')
+        return await self.async_run(OPERATION_STATUS, self.get_channels_status, channels)
+
+    def get_channels_status(self, channels, source=None):
+        # Return the {channel: is_on} status of the channels, with a single request if the device allows it
+        # source: the meross_iot device (default) or the local transport
+        # WARNING: blocking >>> to be run in the executor
+        source = source or self.device
+        channels_status = None
+        if hasattr(source, 'get_sys_data'):
+            channels_status = parse_channels_status(source.get_sys_data())
+        if channels_status is None:
+            # the device does not report its channels in the system data >>> one request per channel
+            channels_status = {}
+            for channel in channels:
+                channels_status[channel] = source.get_channel_status(channel)
+        return channels_status
+
+
+def parse_channels_status(sys_data):
+    # Extract the {channel: is_on} status from the Appliance.System.All payload (None if not available)
+    if not isinstance(sys_data, dict):
+        return None
+    all_data = sys_data.get('all', sys_data)
+    digest = all_data.get('digest', {})
+    if 'togglex' in digest:
+        togglex = digest['togglex']
+        if isinstance(togglex, dict):
+            togglex = [togglex]
+        return {int(t['channel']): t['onoff'] == 1 for t in togglex}
+    control = all_data.get('control', {})
+    if 'toggle' in control:
+        return {0: control['toggle']['onoff'] == 1}
+    return None
@@ -0,0 +1,124 @@
+import datetime
+import logging
+
+from custom_components.meross.storage import MerossThrottledStore
+
+# Setting log
+_LOGGER = logging.getLogger('meross_energy')
+
+ENERGY_STORAGE_KEY = 'meross_energy'
+ENERGY_STORAGE_VERSION = 1
+# the running totals are saved at most once per ENERGY_SAVE_DELAY seconds
+ENERGY_SAVE_DELAY = 60
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS ENERGY METER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossEnergyMeter:
+    # Energy (Wh) of a Meross device, integrated from its power samples (W) with the trapezoidal rule.
+    # Two samples more than max_gap seconds apart (device offline, timeouts, restarts) are not integrated: the gap is
+    # counted, and the energy consumed meanwhile is recovered only by a reconciliation with the device history.
+
+    def __init__(self, max_gap, total=0.0, day=None, day_total=0.0):
+        self.max_gap = max_gap
+        self.total = total
+        # energy of the current (local) day, compared with the device consumption history
+        self.day = day
+        self.day_total = day_total
+        self.gaps = 0
+        self.reconciled_at = None
+        self._last_sample = None
+
+    def add_sample(self, power, timestamp, today=None):
+        # power in W, timestamp in seconds (monotonic); returns the energy (Wh) added
+        today = today or datetime.date.today().isoformat()
+        if self.day != today:
+            self.day = today
+            self.day_total = 0.0
+        energy = 0.0
+        if self._last_sample is not None:
+            last_power, last_timestamp = self._last_sample
+            elapsed = timestamp - last_timestamp
+            if 0 < elapsed <= self.max_gap:
+                energy = (last_power + power) / 2.0 * elapsed / 3600.0
+                self.total += energy
+                self.day_total += energy
+            elif elapsed > self.max_gap:
+                self.gaps += 1
+        self._last_sample = (power, timestamp)
+        return energy
+
+    def reconcile(self, consumption, today=None):
+        # consumption: the device history [{'date': 'YYYY-MM-DD', 'value': Wh}, ...]
+        # the local energy of today is aligned to the one measured by the device; returns the correction (Wh)
+        today = today or datetime.date.today().isoformat()
+        if self.day != today:
+            return 0.0
+        for entry in consumption or []:
+            if entry.get('date') == today:
+                correction = float(entry.get('value', 0)) - self.day_total
+                self.total = max(0.0, self.total + correction)
+                self.day_total += correction
+                self.reconciled_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                return correction
+        return 0.0
+
+    def as_dict(self):
+        return {'total': self.total, 'day': self.day, 'day_total': self.day_total}
+
+    def attributes(self):
+        return {'energy_today_kwh': round(self.day_total / 1000.0, 3),
+                'gaps': self.gaps,
+                'reconciled_at': self.reconciled_at}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS ENERGY STORE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossEnergyStore:
+    # Persistence of the energy meters (in the HA .storage folder), so that the totals survive the restarts
+
+    def __init__(self, hass, key=ENERGY_STORAGE_KEY):
+        # key: one file for each Meross account
+        self._store = MerossThrottledStore(hass, ENERGY_STORAGE_VERSION, key, ENERGY_SAVE_DELAY)
+        self._meters_by_uuid = {}
+        self._saved = None
+
+    async def async_load(self):
+        # the saved data is loaded once, before the first meter is built
+        if self._saved is None:
+            self._saved = await self._store.async_load() or {}
+            _LOGGER.debug('async_load() >>> ' + str(len(self._saved)) + ' energy totals restored')
+        return True
+
+    def get_meter(self, uuid, max_gap):
+        if uuid not in self._meters_by_uuid:
+            saved = (self._saved or {}).get(uuid, {})
+            self._meters_by_uuid[uuid] = MerossEnergyMeter(max_gap,
+                                                           saved.get('total', 0.0),
+                                                           saved.get('day'),
+                                                           saved.get('day_total', 0.0))
+        return self._meters_by_uuid[uuid]
+
+    def remove_meter(self, uuid):
+        # the device has been removed from the Meross account >>> its totals are not saved anymore
+        self._meters_by_uuid.pop(uuid, None)
+        if self._saved is not None:
+            self._saved.pop(uuid, None)
+        self.async_schedule_save()
+
+    def async_schedule_save(self):
+        self._store.async_schedule_save(self._data_to_save)
+
+    def _data_to_save(self):
+        data = dict(self._saved or {})
+        for uuid, meter in self._meters_by_uuid.items():
+            data[uuid] = meter.as_dict()
+        return data
@@ -0,0 +1,112 @@
+import collections
+import logging
+import threading
+
+from meross_iot.meross_event import MerossEventType
+
+from homeassistant.core import callback
+
+from custom_components.meross.tracer import TRACER
+
+# Setting log
+_LOGGER = logging.getLogger('meross_events')
+
+# maximum number of events handled in one pass of the event loop (the rest is handled in the next pass)
+MAX_EVENT_BATCH = 1000
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS EVENT QUEUE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossEventQueue:
+    # Ingestion of the meross_iot events: the MQTT thread only enqueues them (put), the event loop drains them in
+    # batches (handle_batch, called with a MerossEventBatch). A burst of events (e.g. a whole site back online after a
+    # power cut) costs one pass of the event loop, not one per event.
+
+    def __init__(self, loop, handle_batch, max_batch=MAX_EVENT_BATCH):
+        self._loop = loop
+        self._handle_batch = handle_batch
+        self.max_batch = max_batch
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        # counters
+        self.received = 0
+        self.batches = 0
+        self.merged = 0
+
+    def put(self, eventobj):
+        # WARNING: called by the meross_iot MQTT thread >>> nothing but the (thread-safe) deque is touched here
+        self._events.append(eventobj)
+        self._schedule_drain()
+
+    def _schedule_drain(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._loop.call_soon_threadsafe(self.async_drain)
+
+    @callback
+    def async_drain(self):
+        with self._lock:
+            self._scheduled = False
+        batch = MerossEventBatch()
+        while len(self._events) > 0 and batch.count < self.max_batch:
+            batch.add(self._events.popleft())
+        if len(self._events) > 0:
+            self._schedule_drain()
+        if batch.count == 0:
+            return
+        self.received += batch.count
+        self.batches += 1
+        self.merged += batch.count - batch.size()
+        if TRACER.enabled:
+            TRACER.record('events', 'batch', batch.count, batch.size())
+        self._handle_batch(batch)
+
+    def as_dict(self):
+        return {'received': self.received, 'batches': self.batches, 'merged': self.merged}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS EVENT BATCH
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossEventBatch:
+    # The events of a batch, merged: the latest state of each device (online status) and of each device channel
+    # (switch status). The intermediate switch states are kept too, to confirm the commands which targeted them.
+
+    def __init__(self):
+        self.count = 0
+        self.connection_status = None
+        # {device uuid: (device, online)}
+        self.online_by_uuid = collections.OrderedDict()
+        # {(device uuid, channel): (device, latest is_on, [is_on, ...] in arrival order)}
+        self.switch_by_channel = collections.OrderedDict()
+        self.unknown_event_types = []
+
+    def add(self, eventobj):
+        self.count += 1
+        if eventobj.event_type == MerossEventType.CLIENT_CONNECTION:
+            self.connection_status = eventobj.status
+        elif eventobj.event_type == MerossEventType.DEVICE_ONLINE_STATUS:
+            self.online_by_uuid[eventobj.device.uuid] = (eventobj.device, eventobj.status)
+        elif eventobj.event_type == MerossEventType.DEVICE_SWITCH_STATUS:
+            key = (eventobj.device.uuid, eventobj.channel_id)
+            states = self.switch_by_channel[key][2] if key in self.switch_by_channel else []
+            if eventobj.switch_state not in states:
+                states.append(eventobj.switch_state)
+            self.switch_by_channel[key] = (eventobj.device, eventobj.switch_state, states)
+        else:
+            self.unknown_event_types.append(eventobj.event_type)
+
+    def size(self):
+        # number of merged events
+        return ((1 if self.connection_status is not None else 0) + len(self.online_by_uuid) +
+                len(self.switch_by_channel) + len(self.unknown_event_types))
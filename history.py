@@ -0,0 +1,143 @@
+import array
+import bisect
+import math
+
+TIER_RAW = 'raw'
+TIER_1M = '1m'
+TIER_15M = '15m'
+
+# (tier, bucket period in seconds (None: every sample), number of samples kept)
+# raw: 1 hour at the fastest polling rate, 1m: 4 hours, 15m: 24 hours
+HISTORY_TIERS = (
+    (TIER_RAW, None, 360),
+    (TIER_1M, 60, 240),
+    (TIER_15M, 900, 96),
+)
+
+# each sample is a (value, timestamp) pair of doubles, plus its value in the sorted values (for the p95)
+HISTORY_SAMPLE_BYTES = 3 * array.array('d').itemsize
+# memory bound of the history of a metric (the fixed overhead of the python objects excluded)
+HISTORY_BYTES_PER_METRIC = sum(size for tier, period, size in HISTORY_TIERS) * HISTORY_SAMPLE_BYTES
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS RING BUFFER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossRingBuffer:
+    # Fixed-size buffer of the last size (value, timestamp) samples, allocated up front.
+    # The rolling sum is updated at each append (and recomputed at each wrap, to avoid the float drift); the values
+    # are also kept sorted, updated at each append (a binary search and a shift, no sort), so that min, max and p95
+    # are read by index.
+
+    def __init__(self, size):
+        self.size = size
+        self.values = array.array('d', bytes(size * array.array('d').itemsize))
+        self.timestamps = array.array('d', bytes(size * array.array('d').itemsize))
+        self.count = 0
+        self._next = 0
+        self._sum = 0.0
+        self._sorted = array.array('d')
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value, timestamp):
+        evicted = None
+        if self.count == self.size:
+            evicted = self.values[self._next]
+        else:
+            self.count += 1
+        self.values[self._next] = value
+        self.timestamps[self._next] = timestamp
+        self._next = (self._next + 1) % self.size
+        if evicted is not None:
+            del self._sorted[bisect.bisect_left(self._sorted, evicted)]
+        bisect.insort(self._sorted, value)
+
+        if self._next == 0:
+            self._sum = math.fsum(self.values[:self.count])
+        else:
+            self._sum += value - (evicted or 0.0)
+
+    @property
+    def min(self):
+        if self.count == 0:
+            return None
+        return self._sorted[0]
+
+    @property
+    def max(self):
+        if self.count == 0:
+            return None
+        return self._sorted[-1]
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self._sum / self.count
+
+    @property
+    def p95(self):
+        if self.count == 0:
+            return None
+        return self._sorted[min(self.count - 1, int(math.ceil(0.95 * self.count)) - 1)]
+
+    def samples(self):
+        # (timestamp, value) pairs, the oldest first
+        if self.count < self.size:
+            indexes = range(self.count)
+        else:
+            indexes = [(self._next + i) % self.size for i in range(self.size)]
+        return [(self.timestamps[i], self.values[i]) for i in indexes]
+
+    def stats(self):
+        return {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean, 'p95': self.p95}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS METRIC HISTORY
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossMetricHistory:
+    # History of an electricity metric of a Meross device, in three tiers (see HISTORY_TIERS): the raw samples, and
+    # the means of the 1 minute and 15 minutes buckets (buckets without samples are skipped).
+    # factor converts the raw device readings to the sensor unit of measurement.
+
+    def __init__(self, factor=1.0):
+        self.factor = factor
+        self.tiers = {tier: MerossRingBuffer(size) for tier, period, size in HISTORY_TIERS}
+        # open bucket of each downsampled tier: [start, sum, count]
+        self._buckets = {tier: [None, 0.0, 0] for tier, period, size in HISTORY_TIERS if period is not None}
+
+    def add(self, raw_value, timestamp):
+        value = raw_value * self.factor
+        for tier, period, size in HISTORY_TIERS:
+            if period is None:
+                self.tiers[tier].append(value, timestamp)
+                continue
+            bucket = self._buckets[tier]
+            start = timestamp - timestamp % period
+            if bucket[0] != start:
+                if bucket[2] > 0:
+                    # close the previous bucket
+                    self.tiers[tier].append(bucket[1] / bucket[2], bucket[0])
+                bucket[0], bucket[1], bucket[2] = start, 0.0, 0
+            bucket[1] += value
+            bucket[2] += 1
+
+    def stats(self):
+        return {tier: ring.stats() for tier, ring in self.tiers.items()}
+
+    def attributes(self, decimals=2):
+        # flat state attributes, e.g. mean_1m, p95_15m
+        attributes = {}
+        for tier, ring in self.tiers.items():
+            for name, value in (('min', ring.min), ('max', ring.max), ('mean', ring.mean), ('p95', ring.p95)):
+                attributes[name + '_' + tier] = None if value is None else round(value, decimals)
+        return attributes
@@ -0,0 +1,92 @@
+import logging
+
+from custom_components.meross.storage import MerossThrottledStore
+
+# Setting log
+_LOGGER = logging.getLogger('meross_inventory')
+
+INVENTORY_STORAGE_KEY = 'meross_inventory'
+INVENTORY_STORAGE_VERSION = 1
+# the inventory is saved at most once per INVENTORY_SAVE_DELAY seconds
+INVENTORY_SAVE_DELAY = 300
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS INVENTORY STORE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossInventoryStore:
+    # Persistence (in the HA .storage folder) of the known Meross devices: descriptor and last-known states.
+    # At startup the entities are built from it, without waiting for the Meross cloud.
+
+    def __init__(self, hass, key=INVENTORY_STORAGE_KEY):
+        # key: one file for each Meross account
+        self._store = MerossThrottledStore(hass, INVENTORY_STORAGE_VERSION, key, INVENTORY_SAVE_DELAY)
+
+    async def async_load(self):
+        # returns the cached devices (MerossCachedDevice) and their last-known states ({uuid: {key: value}})
+        data = await self._store.async_load() or {}
+        cached_devices = []
+        states_by_uuid = {}
+        for uuid, entry in data.items():
+            cached_devices.append(MerossCachedDevice(uuid,
+                                                     entry['name'],
+                                                     entry['channels'],
+                                                     entry.get('usb_channel'),
+                                                     entry.get('supports_electricity', False),
+                                                     entry.get('online', False)))
+            states_by_uuid[uuid] = {key: value for key, value in entry.get('states', [])}
+        _LOGGER.debug('async_load() >>> ' + str(len(cached_devices)) + ' Meross devices restored')
+        return cached_devices, states_by_uuid
+
+    def async_schedule_save(self, meross_plugs_by_uuid):
+        # keyed by the raw device uuid (the plugs are keyed by the namespaced one, see MerossPlatform.namespace)
+        self._store.async_schedule_save(lambda: {meross_plug.device.uuid: inventory_entry(meross_plug)
+                                                 for meross_plug in meross_plugs_by_uuid.values()})
+
+
+def inventory_entry(meross_plug):
+    name, channels, usb_channel, supports_electricity = meross_plug.descriptor
+    slots = list(meross_plug.switch_slots.items()) + list(meross_plug.sensor_slots.items())
+    return {
+        'name': name,
+        'channels': channels,
+        'usb_channel': usb_channel,
+        'supports_electricity': supports_electricity,
+        'online': meross_plug.was_available if meross_plug.connected else meross_plug.device.last_online,
+        # [key, value] pairs: the channel keys are integers (json objects only have string keys)
+        'states': [[key, slot.value] for key, slot in slots],
+    }
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS CACHED DEVICE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossCachedDevice:
+    # Stand-in for a meross_iot device known from the inventory only: it describes the device (as needed to build
+    # its entities) but cannot be acted. It is replaced by the meross_iot device once the Meross cloud is connected.
+
+    def __init__(self, uuid, name, channels, usb_channel, supports_electricity, online):
+        self.uuid = uuid
+        self.name = name
+        # last-known online status; the cached device is never online (its entities are unavailable until the
+        # meross_iot device is attached)
+        self.last_online = online
+        self.online = False
+        self._channels = channels
+        self._usb_channel = usb_channel
+        self._supports_electricity = supports_electricity
+
+    def get_channels(self):
+        return [{} for channel in range(self._channels)]
+
+    def get_usb_channel_index(self):
+        return self._usb_channel
+
+    def supports_electricity_reading(self):
+        return self._supports_electricity
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+import requests
+
+# Setting log
+_LOGGER = logging.getLogger('meross_local')
+
+NAMESPACE_SYSTEM_ALL = 'Appliance.System.All'
+NAMESPACE_ELECTRICITY = 'Appliance.Control.Electricity'
+NAMESPACE_TOGGLE = 'Appliance.Control.Toggle'
+NAMESPACE_TOGGLEX = 'Appliance.Control.ToggleX'
+
+# a device which does not answer on the LAN is reached through the Meross cloud for LOCAL_RETRY_INTERVAL seconds
+LOCAL_RETRY_INTERVAL = 60
+
+
+class MerossLocalError(Exception):
+    # the device could not be reached (or did not accept the request) on the LAN
+    pass
+
+
+class MerossLocalTimeoutError(MerossLocalError):
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS LOCAL TRANSPORT
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossLocalTransport:
+    # Direct LAN access to a Meross device: signed requests POSTed to http://<host>/config, the same messages the
+    # device receives from the Meross cloud (sign = md5(messageId + key + timestamp), key = Meross account key).
+    # Same (blocking) methods as the meross_iot devices used by MerossDeviceAdapter.
+
+    def __init__(self, host, key, timeout=2.0):
+        self.host = host
+        self.url = 'http://' + host + '/config'
+        self._key = key
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._unreachable_until = 0
+        # older single channel devices use Appliance.Control.Toggle (known from the system data)
+        self._legacy_toggle = False
+
+    @property
+    def reachable(self):
+        # False for LOCAL_RETRY_INTERVAL seconds after a failure
+        return time.monotonic() >= self._unreachable_until
+
+    def request(self, method, namespace, payload):
+        # WARNING: blocking >>> to be run in the executor
+        message = build_message(method, namespace, payload, self._key, self.url)
+        try:
+            response = self._session.post(self.url, data=json.dumps(message), timeout=self.timeout)
+            response.raise_for_status()
+            answer = response.json()
+        except requests.exceptions.Timeout as e:
+            self.set_unreachable(e)
+            raise MerossLocalTimeoutError(self.host + ' >>> ' + str(e))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.set_unreachable(e)
+            raise MerossLocalError(self.host + ' >>> ' + str(e))
+        header = answer.get('header', {})
+        if header.get('method') == 'ERROR':
+            raise MerossLocalError(self.host + ' >>> ' + str(answer.get('payload')))
+        return answer.get('payload', {})
+
+    def set_unreachable(self, error):
+        _LOGGER.debug(self.host + ' >>> not reachable on the LAN (' + str(error) + ') >>> Meross cloud for ' +
+                      str(LOCAL_RETRY_INTERVAL) + ' s')
+        self._unreachable_until = time.monotonic() + LOCAL_RETRY_INTERVAL
+
+    def get_sys_data(self):
+        sys_data = self.request('GET', NAMESPACE_SYSTEM_ALL, {})
+        all_data = sys_data.get('all', {})
+        self._legacy_toggle = ('togglex' not in all_data.get('digest', {}) and
+                               'toggle' in all_data.get('control', {}))
+        return sys_data
+
+    def get_channel_status(self, channel):
+        # the channels are read from the system data (see MerossDeviceAdapter.get_channels_status)
+        raise MerossLocalError(self.host + ' >>> single channel status not available on the LAN')
+
+    def get_electricity(self):
+        return self.request('GET', NAMESPACE_ELECTRICITY, {}).get('electricity', {})
+
+    def turn_on_channel(self, channel):
+        return self.set_channel(channel, True)
+
+    def turn_off_channel(self, channel):
+        return self.set_channel(channel, False)
+
+    def set_channel(self, channel, is_on):
+        onoff = 1 if is_on else 0
+        if self._legacy_toggle:
+            return self.request('SET', NAMESPACE_TOGGLE, {'toggle': {'onoff': onoff}})
+        return self.request('SET', NAMESPACE_TOGGLEX, {'togglex': {'channel': channel, 'onoff': onoff}})
+
+
+def build_message(method, namespace, payload, key, origin):
+    message_id = uuid.uuid4().hex
+    timestamp = int(time.time())
+    return {
+        'header': {
+            'from': origin,
+            'messageId': message_id,
+            'method': method,
+            'namespace': namespace,
+            'payloadVersion': 1,
+            'sign': sign(message_id, key, timestamp),
+            'timestamp': timestamp,
+            'timestampMs': int(time.time() * 1000) % 1000,
+        },
+        'payload': payload,
+    }
+
+
+def sign(message_id, key, timestamp):
+    return hashlib.md5((message_id + key + str(timestamp)).encode('utf-8')).hexdigest()
@@ -0,0 +1,176 @@
+import datetime
+import time
+
+# latency histogram buckets (upper bounds, in seconds)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+OPERATION_STATUS = 'status'
+OPERATION_ELECTRICITY = 'electricity'
+OPERATION_COMMAND = 'command'
+OPERATION_CONSUMPTION = 'consumption'
+OPERATION_DISCOVERY = 'discovery'
+OPERATION_UPDATE_CYCLE = 'update_cycle'
+# calls through the local transport (LAN), e.g. local_command
+OPERATION_LOCAL_PREFIX = 'local_'
+
+OUTCOME_SUCCESS = 'success'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_ERROR = 'error'
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS CALL METRICS
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossCallMetrics:
+    # Latency histogram, timeout/error counters and last success timestamp of one kind of meross_iot call
+
+    __slots__ = ('count', 'timeouts', 'errors', 'total_duration', 'max_duration', 'buckets', 'last_duration',
+                 'last_success')
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_duration = 0.0
+        self.max_duration = None
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.last_duration = None
+        self.last_success = None
+
+    def record(self, duration, outcome):
+        self.count += 1
+        self.total_duration += duration
+        self.last_duration = duration
+        if self.max_duration is None or duration > self.max_duration:
+            self.max_duration = duration
+        for index, upper_bound in enumerate(LATENCY_BUCKETS):
+            if duration <= upper_bound:
+                self.buckets[index] += 1
+                break
+        if outcome == OUTCOME_TIMEOUT:
+            self.timeouts += 1
+        elif outcome == OUTCOME_ERROR:
+            self.errors += 1
+        else:
+            self.last_success = time.time()
+
+    def merge(self, other):
+        self.count += other.count
+        self.timeouts += other.timeouts
+        self.errors += other.errors
+        self.total_duration += other.total_duration
+        if other.max_duration is not None and (self.max_duration is None or other.max_duration > self.max_duration):
+            self.max_duration = other.max_duration
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        if other.last_success is not None and (self.last_success is None or other.last_success > self.last_success):
+            self.last_success = other.last_success
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total_duration / self.count
+
+    def percentile(self, p):
+        # upper bound of the histogram bucket containing the p-th percentile (the slowest call, for the last bucket:
+        # its bound is infinite, which is not valid JSON)
+        if self.count == 0:
+            return None
+        threshold = self.count * p / 100.0
+        cumulated = 0
+        for count, upper_bound in zip(self.buckets[:-1], LATENCY_BUCKETS[:-1]):
+            cumulated += count
+            if cumulated >= threshold:
+                return upper_bound
+        return self.max_duration
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'mean_ms': to_ms(self.mean),
+            'p95_ms': to_ms(self.percentile(95)),
+            'last_ms': to_ms(self.last_duration),
+            'last_success': to_iso(self.last_success),
+            'histogram': {('le_' + str(upper_bound)): count
+                          for upper_bound, count in zip(LATENCY_BUCKETS, self.buckets)},
+        }
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS DEVICE METRICS
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossDeviceMetrics:
+    # Metrics of all the meross_iot calls (OPERATION_*) concerning a device (or the whole platform)
+
+    def __init__(self, name):
+        self.name = name
+        self.calls_by_operation = {}
+
+    def record(self, operation, duration, outcome):
+        if operation not in self.calls_by_operation:
+            self.calls_by_operation[operation] = MerossCallMetrics()
+        self.calls_by_operation[operation].record(duration, outcome)
+
+    def total(self, operations=None):
+        total = MerossCallMetrics()
+        for operation, calls in self.calls_by_operation.items():
+            if operations is None or operation in operations:
+                total.merge(calls)
+        return total
+
+    def as_dict(self):
+        return {operation: calls.as_dict() for operation, calls in self.calls_by_operation.items()}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS PLATFORM METRICS
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossPlatformMetrics(MerossDeviceMetrics):
+    # Platform-level metrics (discovery, update cycles) plus the metrics of each device
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.devices_by_uuid = {}
+
+    def get_device_metrics(self, uuid, name):
+        if uuid not in self.devices_by_uuid:
+            self.devices_by_uuid[uuid] = MerossDeviceMetrics(name)
+        return self.devices_by_uuid[uuid]
+
+    def summary(self, slowest=5):
+        devices = MerossCallMetrics()
+        for device_metrics in self.devices_by_uuid.values():
+            devices.merge(device_metrics.total())
+        slowest_devices = sorted(self.devices_by_uuid.values(),
+                                 key=lambda device_metrics: device_metrics.total().mean or 0,
+                                 reverse=True)[:slowest]
+        summary = {
+            'devices': devices.as_dict(),
+            'slowest_devices': {device_metrics.name: to_ms(device_metrics.total().mean)
+                                for device_metrics in slowest_devices},
+        }
+        summary.update(self.as_dict())
+        return summary
+
+
+def to_ms(seconds):
+    if seconds is None:
+        return None
+    return int(round(seconds * 1000))
+
+
+def to_iso(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
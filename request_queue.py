@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+
+from custom_components.meross.tracer import TRACER
+
+# priority classes of the requests to a Meross device (the lower, the sooner)
+PRIORITY_COMMAND = 0
+PRIORITY_PUSH = 1
+PRIORITY_POLL = 2
+PRIORITY_DISCOVERY = 3
+
+
+class MerossRequestQueueClosed(Exception):
+    # the device has been removed: its queued requests are not executed
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS REQUEST QUEUE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossRequestQueue:
+    # Per-device request scheduler:
+    # - the requests to a device are serialised (a single request in flight)
+    # - the queued requests are executed by priority (command > push reconciliation > poll > discovery), then in
+    #   arrival order: a switch command overtakes the reads queued by an update cycle
+    # - reads of the same kind (key) queued together are executed once, at the highest of their priorities
+    # - a queued poll (or discovery) read is dropped when a read of the same kind completes meanwhile: its waiters
+    #   get that (newer) result
+    # A request already in flight cannot be preempted (the meross_iot calls are blocking).
+
+    def __init__(self, loop, name):
+        self._loop = loop
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._queued_by_key = {}
+        self._worker = None
+        self.closed = False
+        self.dropped = 0
+
+    async def async_submit(self, priority, key, func, *args):
+        # func: coroutine function; key: kind of read (None for the commands, which are never merged nor dropped)
+        if self.closed:
+            raise MerossRequestQueueClosed(self.name)
+        request = self._queued_by_key.get(key) if key is not None else None
+        if request is None:
+            request = MerossRequest(self._loop.create_future(), priority, key, func, args)
+            if key is not None:
+                self._queued_by_key[key] = request
+            heapq.heappush(self._heap, (priority, next(self._counter), request))
+        elif priority < request.priority:
+            # the queued read is promoted (its previous heap entry is skipped)
+            request.priority = priority
+            heapq.heappush(self._heap, (priority, next(self._counter), request))
+        if self._worker is None:
+            self._worker = self._loop.create_task(self._async_run())
+        request.waiters += 1
+        try:
+            # the request may be shared by many waiters >>> a cancelled waiter must not cancel it
+            return await asyncio.shield(request.future)
+        except asyncio.CancelledError:
+            request.waiters -= 1
+            if request.waiters == 0 and not request.started:
+                self._discard(request)
+                request.future.cancel()
+            raise
+
+    async def _async_run(self):
+        try:
+            while self._heap:
+                priority, order, request = heapq.heappop(self._heap)
+                if request.started or request.future.done() or priority != request.priority:
+                    continue
+                request.started = True
+                self._discard(request)
+                try:
+                    result = await request.func(*request.args)
+                except asyncio.CancelledError:
+                    # closed while in flight
+                    if not request.future.done():
+                        request.future.set_exception(MerossRequestQueueClosed(self.name))
+                    raise
+                except Exception as e:
+                    if request.waiters > 0 and not request.future.done():
+                        request.future.set_exception(e)
+                else:
+                    if not request.future.done():
+                        request.future.set_result(result)
+                    if request.key is not None:
+                        self._drop_stale(request.key, result)
+        finally:
+            self._worker = None
+
+    def close(self):
+        # the device has been removed: the worker is stopped and the queued requests fail
+        self.closed = True
+        if self._worker is not None:
+            self._worker.cancel()
+        heap, self._heap = self._heap, []
+        self._queued_by_key = {}
+        for priority, order, request in heap:
+            if not request.future.done():
+                request.future.set_exception(MerossRequestQueueClosed(self.name))
+
+    def _drop_stale(self, key, result):
+        # a newer result of the same kind has arrived >>> the queued low-priority read is not needed anymore
+        stale = self._queued_by_key.get(key)
+        if stale is not None and stale.priority >= PRIORITY_POLL:
+            self._discard(stale)
+            stale.started = True
+            stale.future.set_result(result)
+            self.dropped += 1
+            if TRACER.enabled:
+                TRACER.record(self.name, 'stale read dropped', key)
+
+    def _discard(self, request):
+        if request.key is not None and self._queued_by_key.get(request.key) is request:
+            del self._queued_by_key[request.key]
+
+
+class MerossRequest:
+
+    def __init__(self, future, priority, key, func, args):
+        self.future = future
+        self.priority = priority
+        self.key = key
+        self.func = func
+        self.args = args
+        self.waiters = 0
+        self.started = False
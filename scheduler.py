@@ -0,0 +1,81 @@
+import time
+
+from custom_components.meross.tracer import TRACER
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS POLL SCHEDULER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossPollScheduler:
+    # Adaptive per-device polling: it keeps the next-due time of each Meross device.
+    # - devices whose readings change (or which just received a command) are polled every min_interval
+    # - stable devices (and devices covered by MQTT push events) back off, up to max_interval
+
+    def __init__(self, min_interval, max_interval, backoff_factor=2.0):
+        self.min_interval = min_interval.total_seconds()
+        self.max_interval = max(self.min_interval, max_interval.total_seconds())
+        self.backoff_factor = backoff_factor
+        self._interval_by_uuid = {}
+        self._next_due_by_uuid = {}
+
+    def add(self, uuid, now=None):
+        # a new device is due immediately
+        if uuid not in self._next_due_by_uuid:
+            self._interval_by_uuid[uuid] = self.min_interval
+            self._next_due_by_uuid[uuid] = monotonic(now)
+
+    def remove(self, uuid):
+        self._interval_by_uuid.pop(uuid, None)
+        self._next_due_by_uuid.pop(uuid, None)
+
+    def expire(self, uuid=None):
+        # make the device (or all the devices, if None) due immediately
+        for expired_uuid in ([uuid] if uuid is not None else list(self._next_due_by_uuid.keys())):
+            if expired_uuid in self._next_due_by_uuid:
+                self._next_due_by_uuid[expired_uuid] = float('-inf')
+
+    def interval(self, uuid):
+        return self._interval_by_uuid.get(uuid, self.min_interval)
+
+    def due(self, now=None):
+        # uuids of the devices to be polled, the most overdue first
+        now = monotonic(now)
+        due_uuids = [uuid for uuid, next_due in self._next_due_by_uuid.items() if next_due <= now]
+        due_uuids.sort(key=self._next_due_by_uuid.get)
+        return due_uuids
+
+    def record_poll(self, uuid, changed, now=None):
+        if uuid not in self._next_due_by_uuid:
+            return
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = min(self.max_interval, self._interval_by_uuid[uuid] * self.backoff_factor)
+        self._interval_by_uuid[uuid] = interval
+        self._next_due_by_uuid[uuid] = monotonic(now) + interval
+        if TRACER.enabled:
+            TRACER.record(uuid, 'next poll in (s)', interval)
+
+    def record_command(self, uuid, now=None):
+        # a device which just received a command is polled faster
+        if uuid not in self._next_due_by_uuid:
+            return
+        now = monotonic(now)
+        self._interval_by_uuid[uuid] = self.min_interval
+        self._next_due_by_uuid[uuid] = min(self._next_due_by_uuid[uuid], now + self.min_interval)
+
+    def record_push(self, uuid, now=None):
+        # the state of the device has just been pushed >>> no need to poll it before its (current) interval elapses
+        if uuid not in self._next_due_by_uuid:
+            return
+        now = monotonic(now)
+        self._next_due_by_uuid[uuid] = max(self._next_due_by_uuid[uuid], now + self._interval_by_uuid[uuid])
+
+
+def monotonic(now=None):
+    if now is None:
+        return time.monotonic()
+    return now
@@ -1,19 +1,32 @@
 import logging
+import time
 from datetime import timedelta
 from homeassistant.components.sensor import (DOMAIN, ENTITY_ID_FORMAT)
-from custom_components.meross import (DOMAIN, MerossEntity)
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_track_time_interval
+from custom_components.meross import (DOMAIN, SENSOR_ENERGY, MerossEntity)
+from custom_components.meross.tracer import TRACER
 
 # Setting log
 _LOGGER = logging.getLogger('meross_sensor')
-_LOGGER.setLevel(logging.DEBUG)
 
-# define the HA scan for sensor
-SCAN_INTERVAL = timedelta(seconds=10)
+# define the HA scan for the diagnostic sensors (the electricity sensors are pushed)
+SCAN_INTERVAL = timedelta(seconds=60)
+# the device diagnostic sensors are refreshed (and written in HA, if changed) every DIAGNOSTIC_REFRESH_INTERVAL
+DIAGNOSTIC_REFRESH_INTERVAL = timedelta(minutes=15)
 
+# deadband_abs (in uom) and deadband_rel (fraction of the last written value): a new value is written in HA only if
+# it differs from the last written one by more than both of them (or if max_silence has elapsed since the last write)
 MEROSS_SENSORS_MAP = {
-    'power':    {'eid': 'power',   'uom': 'W',  'icon': 'mdi:flash-outline', 'factor': 0.001,   'decimals': 2},
-    'current':  {'eid': 'current', 'uom': 'A',  'icon': 'mdi:current-ac',    'factor': 0.001,   'decimals': 2},
-    'voltage':  {'eid': 'voltage', 'uom': 'V',  'icon': 'mdi:power-plug',    'factor': 0.1,     'decimals': 2},
+    'power':    {'eid': 'power',   'uom': 'W',  'icon': 'mdi:flash-outline', 'factor': 0.001,   'decimals': 2,
+                 'deadband_abs': 0.5,  'deadband_rel': 0.02},
+    'current':  {'eid': 'current', 'uom': 'A',  'icon': 'mdi:current-ac',    'factor': 0.001,   'decimals': 2,
+                 'deadband_abs': 0.01, 'deadband_rel': 0.02},
+    'voltage':  {'eid': 'voltage', 'uom': 'V',  'icon': 'mdi:power-plug',    'factor': 0.1,     'decimals': 2,
+                 'deadband_abs': 1.0,  'deadband_rel': 0.005},
+    # computed locally (trapezoidal integration of the power samples, see energy.py), raw value in Wh
+    SENSOR_ENERGY: {'eid': 'energy',  'uom': 'kWh', 'icon': 'mdi:counter',    'factor': 0.001,   'decimals': 3,
+                    'deadband_abs': 0.001, 'deadband_rel': 0},
 }
 
 
@@ -27,25 +40,18 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     else:
         ha_entities = []
 
-        meross_device_uuid = discovery_info.get('meross_device_uuid')
-        if meross_device_uuid not in hass.data[DOMAIN].meross_plugs_by_uuid:
-            keys = str(hass.data[DOMAIN].meross_plugs_by_uuid.keys())
-            _LOGGER.error('uuid ' + meross_device_uuid + ' is not in ' + keys)
-        else:
-            # get the meross plug
-            meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid[meross_device_uuid]
-            # get the meross device
-            meross_device = meross_plug.device
-            # get the meross device name
-            meross_device_name = meross_device.name
-            # check if the device supports electricity reading
-            if meross_device.supports_electricity_reading():
-                for meross_sensor_name in MEROSS_SENSORS_MAP.keys():
-                    sensor = MerossSensorEntity(hass,
-                                                meross_device_uuid,
-                                                meross_device_name,
-                                                meross_sensor_name)
-                    ha_entities.append(sensor)
+        if discovery_info.get('meross_summary', False):
+            # diagnostic sensor of a Meross account
+            platform = hass.data[DOMAIN].get_platform(discovery_info.get('meross_namespace', ''))
+            ha_entities.append(MerossSummarySensorEntity(hass, platform))
+
+        # the entities of a batch of devices are added at once
+        for meross_device_uuid in discovery_info.get('meross_device_uuids', []):
+            if meross_device_uuid not in hass.data[DOMAIN].meross_plugs_by_uuid:
+                # removed meanwhile
+                _LOGGER.warning('uuid ' + meross_device_uuid + ' is not a known Meross device')
+            else:
+                ha_entities.extend(build_sensor_entities(hass, meross_device_uuid))
 
         if len(ha_entities) > 0:
             async_add_entities(ha_entities, update_before_add=False)
@@ -55,6 +61,27 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     return True
 
 
+def build_sensor_entities(hass, meross_device_uuid):
+    ha_entities = []
+    # get the meross plug
+    meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid[meross_device_uuid]
+    # get the meross device
+    meross_device = meross_plug.device
+    # get the meross device name
+    meross_device_name = meross_device.name
+    # check if the device supports electricity reading
+    if meross_device.supports_electricity_reading():
+        for meross_sensor_name in MEROSS_SENSORS_MAP.keys():
+            sensor = MerossSensorEntity(hass,
+                                        meross_device_uuid,
+                                        meross_device_name,
+                                        meross_sensor_name)
+            ha_entities.append(sensor)
+    # diagnostic sensor (latency and errors of the meross_iot calls)
+    ha_entities.append(MerossDiagnosticSensorEntity(hass, meross_device_uuid, meross_device_name))
+    return ha_entities
+
+
 class MerossSensorEntity(MerossEntity):
 
     def __init__(self, hass, meross_device_uuid, meross_device_name, meross_sensor_name):
@@ -66,10 +93,18 @@ class MerossSensorEntity(MerossEntity):
         self._meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid[meross_device_uuid]
         meross_device = self._meross_plug.device
         meross_device_online = meross_device.online
-        self._meross_plug.sensor_states[meross_sensor_name] = {
-            'available': meross_device_online,
-            'value': self._value,
-            }
+        self._slot = self._meross_plug.add_sensor_slot(meross_sensor_name, meross_device_online)
+        self._value = self._slot.value
+        # change detection: last slot version read, time of the last write, suppressed (deadband) changes
+        self._slot_version = self._slot.version
+        self._written_at = 0
+        self._suppressed = False
+        self._max_silence = self._meross_plug.max_silence.total_seconds()
+        # rolling min/max/mean/p95 of the instantaneous metrics (the energy is cumulative)
+        self._history = None
+        if meross_sensor_name != SENSOR_ENERGY:
+            self._history = self._meross_plug.add_sensor_history(meross_sensor_name,
+                                                                 MEROSS_SENSORS_MAP[meross_sensor_name]['factor'])
 
         # naming
         meross_sensor_id = "{}_{}_{}".format(DOMAIN, meross_device_uuid, MEROSS_SENSORS_MAP[meross_sensor_name]['eid'])
@@ -83,39 +118,186 @@ class MerossSensorEntity(MerossEntity):
                          meross_device_name,
                          meross_entity_id,
                          meross_sensor_name,
-                         meross_device_online)
-
-    async def async_update(self):
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> async_update()')
-        # update is done in the update function
-        self._value = self._meross_plug.sensor_states[self._meross_sensor_name]['value']
-        self._available = self._meross_plug.sensor_states[self._meross_sensor_name]['available']
+                         meross_device_online,
+                         meross_sensor_name)
+
+    def refresh_state(self):
+        slot = self._slot
+        now = time.monotonic()
+        silent = now - self._written_at >= self._max_silence
+        if slot.version == self._slot_version:
+            # nothing has changed since the last read: write only the pending suppressed value (heartbeat)
+            if not (self._suppressed and silent):
+                return False
+        self._slot_version = slot.version
+        if slot.available == self._available and not self.is_significant(slot.value):
+            if self.format_value(slot.value) == self.format_value(self._value):
+                self._suppressed = False
+                return False
+            if not silent:
+                if TRACER.enabled:
+                    TRACER.record(self.entity_id, 'refresh_state()', 'deadband', slot.value)
+                self._suppressed = True
+                return False
+        self._value = slot.value
+        self._available = slot.available
+        self._written_at = now
+        self._suppressed = False
         return True
 
+    def is_significant(self, value):
+        # True if value is outside both the deadbands around the last written value
+        sensor = MEROSS_SENSORS_MAP[self._meross_sensor_name]
+        f = sensor['factor']
+        delta = abs(value - self._value) * f
+        return delta > sensor.get('deadband_abs', 0) and delta > sensor.get('deadband_rel', 0) * abs(self._value * f)
+
+    def format_value(self, value):
+        sensor = MEROSS_SENSORS_MAP[self._meross_sensor_name]
+        return '{:.{d}f}'.format(value * sensor['factor'], d=sensor['decimals'])
+
     @property
     def unit_of_measurement(self):
         uom = MEROSS_SENSORS_MAP[self._meross_sensor_name]['uom']
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> unit_of_measurement() >>> ' +
-                      uom)
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'unit_of_measurement()', uom)
         # Return the unit of measurement.
         return uom
 
     @property
     def icon(self):
         icon = MEROSS_SENSORS_MAP[self._meross_sensor_name]['icon']
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> icon() >>> ' +
-                      str(icon))
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'icon()', icon)
         # Return the icon.
         return icon
 
+    @property
+    def device_state_attributes(self):
+        if self._meross_sensor_name == SENSOR_ENERGY and self._meross_plug.energy is not None:
+            return self._meross_plug.energy.attributes()
+        if self._history is not None:
+            return self._history.attributes(MEROSS_SENSORS_MAP[self._meross_sensor_name]['decimals'])
+        return None
+
     @property
     def state(self):
-        f = MEROSS_SENSORS_MAP[self._meross_sensor_name]['factor']
-        formatted_value = '{:.{d}f}'.format(self._value*f, d=MEROSS_SENSORS_MAP[self._meross_sensor_name]['decimals'])
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> state() >>> ' +
-                      formatted_value)
+        formatted_value = self.format_value(self._value)
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'state()', formatted_value)
         return formatted_value
+
+
+class MerossDiagnosticSensorEntity(MerossEntity):
+    # Latency (mean of all the meross_iot calls, in ms) of a Meross device; the details are in the attributes.
+    # The metrics change at each meross_iot call >>> they are read every DIAGNOSTIC_REFRESH_INTERVAL (one sensor per
+    # device: a short interval would fill the recorder) and written in HA only if they have changed.
+
+    def __init__(self, hass, meross_device_uuid, meross_device_name):
+        self._meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid[meross_device_uuid]
+        meross_entity_id = ENTITY_ID_FORMAT.format("{}_{}_{}".format(DOMAIN, meross_device_uuid, 'latency'))
+        # (state, attributes) last written in HA
+        self._diagnostics = (None, {})
+        super().__init__(hass,
+                         meross_device_uuid,
+                         meross_device_name,
+                         meross_entity_id,
+                         'latency',
+                         True)
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        self.refresh_diagnostics()
+        # (unsubscribed with the dispatchers)
+        self._unsub_dispatchers.append(async_track_time_interval(self.hass,
+                                                                 self.async_refresh_diagnostics,
+                                                                 DIAGNOSTIC_REFRESH_INTERVAL))
+        return True
+
+    async def async_refresh_diagnostics(self, now=None):
+        if self.refresh_diagnostics():
+            self.async_schedule_update_ha_state()
+
+    def refresh_diagnostics(self):
+        # read the metrics; return True if they have changed since the last write
+        metrics = self._meross_plug.adapter.metrics
+        mean = metrics.total().mean
+        attributes = metrics.as_dict()
+        # queued reads made useless by a newer result (see request_queue.py)
+        attributes['dropped_reads'] = self._meross_plug.adapter.queue.dropped
+        diagnostics = (None if mean is None else int(round(mean * 1000)), attributes)
+        if diagnostics == self._diagnostics:
+            return False
+        self._diagnostics = diagnostics
+        return True
+
+    def refresh_state(self):
+        # not written on the device updates (polls, online events): only every DIAGNOSTIC_REFRESH_INTERVAL
+        return False
+
+    @property
+    def name(self):
+        return self._meross_device_name + ' latency'
+
+    @property
+    def available(self):
+        return True
+
+    @property
+    def unit_of_measurement(self):
+        return 'ms'
+
+    @property
+    def icon(self):
+        return 'mdi:timer-outline'
+
+    @property
+    def state(self):
+        return self._diagnostics[0]
+
+    @property
+    def device_state_attributes(self):
+        return self._diagnostics[1]
+
+
+class MerossSummarySensorEntity(Entity):
+    # Latency (mean of all the meross_iot calls of all the devices of a Meross account, in ms) of the Meross cloud;
+    # the details (discovery, update cycles, slowest devices) are in the attributes
+
+    def __init__(self, hass, platform):
+        self.hass = hass
+        self._platform = platform
+        # sensor.meross_cloud_latency, sensor.meross_<account name>_cloud_latency for the named accounts
+        self.entity_id = ENTITY_ID_FORMAT.format("{}_{}{}".format(DOMAIN, platform.namespace, 'cloud_latency'))
+
+    @property
+    def unique_id(self):
+        return self.entity_id
+
+    @property
+    def name(self):
+        if self._platform.account_name:
+            return 'Meross ' + self._platform.account_name + ' cloud latency'
+        return 'Meross cloud latency'
+
+    @property
+    def unit_of_measurement(self):
+        return 'ms'
+
+    @property
+    def icon(self):
+        return 'mdi:cloud-outline'
+
+    @property
+    def state(self):
+        summary = self._platform.metrics.summary()
+        return summary['devices']['mean_ms']
+
+    @property
+    def device_state_attributes(self):
+        attributes = self._platform.metrics.summary()
+        # skipped timer ticks and overruns of the update cycles (see cycle_manager.py)
+        attributes['update_cycles'] = self._platform.update_cycles.as_dict()
+        # meross_iot events received, batches and events merged (see event_queue.py)
+        attributes['events'] = self._platform.events.as_dict()
+        return attributes
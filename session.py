@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import random
+import time
+
+from meross_iot.api import UnauthorizedException
+from meross_iot.cloud.client_status import ClientStatus
+from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException
+from requests.exceptions import ConnectionError
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+
+# Setting log
+_LOGGER = logging.getLogger('meross_session')
+
+SESSION_STORAGE_KEY = 'meross_session'
+SESSION_STORAGE_VERSION = 1
+
+# minimum time between two logins (also after a successful one, e.g. many HA restarts in a short window)
+MIN_LOGIN_INTERVAL = 30
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS SESSION MANAGER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossSessionManager:
+    # Owner of the meross_iot manager (login to the Meross cloud and MQTT connection):
+    # - the logins are paced: at least MIN_LOGIN_INTERVAL seconds apart, and an exponential backoff (+ jitter, up to
+    #   max_backoff) after each failure; the pacing is persisted, so that it is respected across the HA restarts
+    # - a failed login is retried by the session manager itself, once the backoff has elapsed
+    # - the manager is reused as long as its MQTT connection is alive; if the connection is lost for more than
+    #   reconnect_grace, the manager is stopped and a new one is started
+    # restarted_callback is called (in the event loop) each time a new manager replaces a failed or lost one.
+
+    def __init__(self, hass, executor, manager_factory, username, password, event_handler, restarted_callback,
+                 max_backoff, reconnect_grace, key=SESSION_STORAGE_KEY, jitter=0.2):
+        self._hass = hass
+        self._executor = executor
+        self._manager_factory = manager_factory
+        self._username = username
+        self._password = password
+        self._event_handler = event_handler
+        self._restarted_callback = restarted_callback
+        self.max_backoff = max(MIN_LOGIN_INTERVAL, max_backoff.total_seconds())
+        self.reconnect_grace = reconnect_grace.total_seconds()
+        self.jitter = jitter
+        self.manager = None
+        # login pacing (wall clock, persisted)
+        self.failures = 0
+        self.next_login = 0
+        self._store = Store(hass, SESSION_STORAGE_VERSION, key)
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._unsub_retry = None
+        self._unsub_reconnect = None
+
+    async def async_get_manager(self):
+        # the started manager, or None (login not allowed yet, or failed)
+        if self.manager is not None:
+            return self.manager
+        async with self._lock:
+            if self.manager is not None:
+                return self.manager
+            if not self._loaded:
+                data = await self._store.async_load() or {}
+                self.failures = data.get('failures', 0)
+                self.next_login = data.get('next_login', 0)
+                self._loaded = True
+            wait = self.next_login - time.time()
+            if wait > 0:
+                _LOGGER.info('Meross login postponed by ' + str(round(wait)) + ' s')
+                self.async_schedule_retry(wait)
+                return None
+            # blocking login and MQTT connection >>> run in the executor
+            meross_manager = await self._hass.loop.run_in_executor(self._executor, self.start_manager)
+            self.record_login(meross_manager is not None)
+            await self._store.async_save({'failures': self.failures, 'next_login': self.next_login})
+            if meross_manager is None:
+                self.async_schedule_retry(self.next_login - time.time())
+            self.manager = meross_manager
+            return self.manager
+
+    def start_manager(self):
+        # WARNING: blocking (login and MQTT connection) >>> to be run in the executor
+        try:
+            meross_manager = self._manager_factory(self._username, self._password)
+            meross_manager.start()
+            meross_manager.register_event_handler(self._event_handler)
+            _LOGGER.info('Meross manager started')
+            return meross_manager
+
+        except CommandTimeoutException:
+            _LOGGER.warning('CommandTimeoutException when starting the Meross manager')
+
+        except UnauthorizedException:
+            _LOGGER.warning('UnauthorizedException when starting the Meross manager >>> check: a) internet '
+                            'connection, b) Meross account credentials')
+
+        except ConnectionError:
+            _LOGGER.warning('ConnectionError when starting the Meross manager >>> check internet connection')
+
+        return None
+
+    def record_login(self, success):
+        now = time.time()
+        if success:
+            self.failures = 0
+            self.next_login = now + MIN_LOGIN_INTERVAL
+        else:
+            self.failures += 1
+            backoff = min(self.max_backoff, MIN_LOGIN_INTERVAL * (2 ** (self.failures - 1)))
+            backoff *= 1 + random.uniform(-self.jitter, self.jitter)
+            self.next_login = now + backoff
+            _LOGGER.warning('Meross login failed ' + str(self.failures) + ' times >>> next attempt in ' +
+                            str(round(backoff)) + ' s')
+
+    @callback
+    def async_schedule_retry(self, delay):
+        if self._unsub_retry is None:
+            self._unsub_retry = async_call_later(self._hass, max(0, delay), self._async_retry)
+
+    async def _async_retry(self, now=None):
+        self._unsub_retry = None
+        if await self.async_get_manager() is not None:
+            self._restarted_callback()
+
+    @callback
+    def async_handle_connection_status(self, status):
+        # CLIENT_CONNECTION events (MQTT thread >>> forwarded to the event loop)
+        if status == ClientStatus.CONNECTION_DROPPED:
+            if self._unsub_reconnect is None and self.manager is not None:
+                _LOGGER.warning('Meross MQTT connection lost')
+                self._unsub_reconnect = async_call_later(self._hass, self.reconnect_grace, self._async_restart)
+        elif status in (ClientStatus.CONNECTED, ClientStatus.SUBSCRIBED):
+            if self._unsub_reconnect is not None:
+                _LOGGER.info('Meross MQTT connection restored')
+                self._unsub_reconnect()
+                self._unsub_reconnect = None
+
+    async def _async_restart(self, now=None):
+        self._unsub_reconnect = None
+        _LOGGER.warning('Meross MQTT connection lost for more than ' + str(self.reconnect_grace) + ' s >>> ' +
+                        'restarting the Meross manager')
+        await self.async_stop()
+        if await self.async_get_manager() is not None:
+            self._restarted_callback()
+
+    async def async_stop(self):
+        meross_manager, self.manager = self.manager, None
+        if meross_manager is not None:
+            try:
+                await self._hass.loop.run_in_executor(self._executor, meross_manager.stop)
+            except Exception:
+                _LOGGER.exception('Error when stopping the Meross manager')
+        return True
@@ -0,0 +1,76 @@
+import threading
+import time
+
+# marker of the slot fields which are not updated
+UNCHANGED = object()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS STATE SLOT
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossStateSlot:
+    # State of a channel (value: is_on) or of a metric (value: raw electricity reading) of a Meross device.
+    # version is incremented at each change, timestamp is the time of the last change.
+
+    __slots__ = ('value', 'available', 'version', 'timestamp')
+
+    def __init__(self, value, available):
+        self.value = value
+        self.available = available
+        self.version = 0
+        self.timestamp = time.time()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS STATE STORE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossStateStore:
+    # Central store of the Meross states, indexed by (device uuid, channel / metric name).
+    # Writes are serialised by a lock (they may come from the meross_iot threads), reads are plain attribute reads.
+    # Entities keep a reference to their slot and the last version they have written: "has it changed since?" is
+    # a single comparison.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots_by_key = {}
+
+    def __len__(self):
+        return len(self._slots_by_key)
+
+    def add(self, uuid, key, value, available):
+        # the existing slot (if any) is kept
+        with self._lock:
+            slot = self._slots_by_key.get((uuid, key))
+            if slot is None:
+                slot = MerossStateSlot(value, available)
+                self._slots_by_key[(uuid, key)] = slot
+            return slot
+
+    def get(self, uuid, key):
+        return self._slots_by_key.get((uuid, key))
+
+    def update(self, slot, value=UNCHANGED, available=UNCHANGED):
+        # returns True if the slot has changed (and a new version has been created)
+        with self._lock:
+            changed = False
+            if value is not UNCHANGED and value != slot.value:
+                slot.value = value
+                changed = True
+            if available is not UNCHANGED and available != slot.available:
+                slot.available = available
+                changed = True
+            if changed:
+                slot.version += 1
+                slot.timestamp = time.time()
+            return changed
+
+    def remove_device(self, uuid):
+        with self._lock:
+            for key in [key for key in self._slots_by_key if key[0] == uuid]:
+                del self._slots_by_key[key]
@@ -0,0 +1,29 @@
+import time
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS THROTTLED STORE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossThrottledStore:
+    # HA Store (in the .storage folder) saved at most once per delay, however often a save is requested:
+    # async_delay_save restarts its delay at each call >>> it is called at most once per delay (the data is read when
+    # it is written, so the latest data is saved anyway)
+
+    def __init__(self, hass, version, key, delay):
+        # imported here: the modules using it (e.g. the energy maths) can be imported without Home Assistant
+        from homeassistant.helpers.storage import Store
+        self._store = Store(hass, version, key)
+        self.delay = delay
+        self._save_requested_at = None
+
+    async def async_load(self):
+        return await self._store.async_load()
+
+    def async_schedule_save(self, data_func):
+        now = time.monotonic()
+        if self._save_requested_at is None or now - self._save_requested_at >= self.delay:
+            self._save_requested_at = now
+            self._store.async_delay_save(data_func, self.delay)
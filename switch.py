@@ -1,14 +1,11 @@
 import logging
-from datetime import timedelta
+from homeassistant.core import callback
 from homeassistant.components.switch import ENTITY_ID_FORMAT, SwitchDevice
 from custom_components.meross import (DOMAIN, MerossEntity)
+from custom_components.meross.tracer import TRACER
 
 # Setting log
 _LOGGER = logging.getLogger('meross_switch')
-_LOGGER.setLevel(logging.DEBUG)
-
-# define the HA scan for switch
-SCAN_INTERVAL = timedelta(seconds=10)
 
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
@@ -21,36 +18,13 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     else:
         ha_entities = []
 
-        meross_device_uuid = discovery_info.get('meross_device_uuid')
-        if meross_device_uuid not in hass.data[DOMAIN].meross_plugs_by_uuid:
-            keys = str(hass.data[DOMAIN].meross_plugs_by_uuid.keys())
-            _LOGGER.error('uuid ' + meross_device_uuid + ' is not in ' + keys)
-        else:
-            # get the meross plug
-            meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid[meross_device_uuid]
-            # get the meross device
-            meross_device = meross_plug.device
-            # get the meross device name
-            meross_device_name = meross_device.name
-            # some devices also have a dedicated channel for USB
-            usb_channel = meross_device.get_usb_channel_index()
-            # Some Meross devices return 0 channels...
-            channels = max(1, len(meross_device.get_channels()))
-            for meross_switch_channel in range(0, channels):
-                suffix = ''
-                if meross_switch_channel > 0:
-                    suffix = '_'+str(meross_switch_channel)
-                if usb_channel is not None:
-                    if usb_channel == meross_switch_channel:
-                        suffix = '_usb'
-                # creiamo una entità Home Assistant di tipo MerossSwitchEntity
-                switch = MerossSwitchEntity(hass,
-                                            meross_device_uuid,
-                                            meross_device_name,
-                                            meross_switch_channel,
-                                            suffix)
-                # aggiungiamola alle entità da aggiungere
-                ha_entities.append(switch)
+        # the entities of a batch of devices are added at once
+        for meross_device_uuid in discovery_info.get('meross_device_uuids', []):
+            if meross_device_uuid not in hass.data[DOMAIN].meross_plugs_by_uuid:
+                # removed meanwhile
+                _LOGGER.warning('uuid ' + meross_device_uuid + ' is not a known Meross device')
+            else:
+                ha_entities.extend(build_switch_entities(hass, meross_device_uuid))
 
         if len(ha_entities) > 0:
             async_add_entities(ha_entities, update_before_add=False)
@@ -60,6 +34,36 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     return True
 
 
+def build_switch_entities(hass, meross_device_uuid):
+    ha_entities = []
+    # get the meross plug
+    meross_plug = hass.data[DOMAIN].meross_plugs_by_uuid[meross_device_uuid]
+    # get the meross device
+    meross_device = meross_plug.device
+    # get the meross device name
+    meross_device_name = meross_device.name
+    # some devices also have a dedicated channel for USB
+    usb_channel = meross_device.get_usb_channel_index()
+    # Some Meross devices return 0 channels...
+    channels = max(1, len(meross_device.get_channels()))
+    for meross_switch_channel in range(0, channels):
+        suffix = ''
+        if meross_switch_channel > 0:
+            suffix = '_'+str(meross_switch_channel)
+        if usb_channel is not None:
+            if usb_channel == meross_switch_channel:
+                suffix = '_usb'
+        # creiamo una entità Home Assistant di tipo MerossSwitchEntity
+        switch = MerossSwitchEntity(hass,
+                                    meross_device_uuid,
+                                    meross_device_name,
+                                    meross_switch_channel,
+                                    suffix)
+        # aggiungiamola alle entità da aggiungere
+        ha_entities.append(switch)
+    return ha_entities
+
+
 class MerossSwitchEntity(MerossEntity, SwitchDevice):
 
     def __init__(self, hass, meross_device_uuid, meross_device_name, meross_switch_channel, suffix):
@@ -72,10 +76,11 @@ class MerossSwitchEntity(MerossEntity, SwitchDevice):
         # add entity to the meross_plug
         meross_device = self._meross_plug.device
         meross_device_online = meross_device.online
-        self._meross_plug.switch_states[meross_switch_channel] = {
-            'available':  meross_device_online,
-            'is_on': self._is_on,
-            }
+        self._slot = self._meross_plug.add_switch_slot(meross_switch_channel, meross_device_online)
+        self._is_on = self._slot.value
+        # last slot version read by the entity; True while the written state is an optimistic one
+        self._slot_version = self._slot.version
+        self._optimistic = False
 
         # naming
         meross_switch_name = str(meross_switch_channel)
@@ -89,65 +94,68 @@ class MerossSwitchEntity(MerossEntity, SwitchDevice):
                          meross_device_name,
                          meross_entity_id,
                          meross_switch_name,
-                         meross_device_online)
-
-    async def async_execute_switch_and_set_status(self):
-        _LOGGER.debug(self._meross_device_name + ' >>> ' + self._meross_entity_name +
-                      ' >>> async_execute_switch_and_set_status()')
-        meross_plug = self.hass.data[DOMAIN].meross_plugs_by_uuid[self._meross_device_uuid]
-        meross_device = meross_plug.device
-        if meross_device is None:
-            _LOGGER.error(self._meross_device_name + ' is None')
-            return False
-        elif not meross_device.online:
+                         meross_device_online,
+                         meross_switch_channel)
+
+    @callback
+    def async_request_switch_status(self, is_on):
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'async_request_switch_status()', is_on)
+        meross_plug = self._meross_plug
+        if not meross_plug.available:
             _LOGGER.warning(self._meross_device_name + ' is not online')
-            meross_plug.switch_states[self._meross_switch_channel]['available'] = False
+            meross_plug.states.update(self._slot, available=False)
+            meross_plug.async_push_update(self._meross_switch_channel)
             return False
-        else:
-            if self._is_on:
-                meross_device.turn_on_channel(self._meross_switch_channel)
-            else:
-                meross_device.turn_off_channel(self._meross_switch_channel)
-            meross_plug.switch_states[self._meross_switch_channel]['is_on'] = self._is_on
+        # optimistic state: written right away, then reconciled by the command pipeline
+        self._is_on = is_on
+        self._optimistic = True
+        self.async_schedule_update_ha_state()
+        meross_plug.commands.async_request(self._meross_switch_channel, is_on)
         return True
 
     async def async_turn_on(self):
-        self._is_on = True
         _LOGGER.info(self._meross_device_name + ' >>> ' +
                      self._meross_entity_name + ' >>> async_turn_on()')
-        return self.hass.async_add_job(self.async_execute_switch_and_set_status)
+        return self.async_request_switch_status(True)
 
     async def async_turn_off(self):
-        self._is_on = False
         _LOGGER.info(self._meross_device_name + ' >>> ' +
                      self._meross_entity_name + ' >>> async_turn_off()')
-        return self.hass.async_add_job(self.async_execute_switch_and_set_status)
+        return self.async_request_switch_status(False)
 
-    async def async_update(self):
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> async_update()')
-        updated_is_on = self._meross_plug.switch_states[self._meross_switch_channel]['is_on']
+    def refresh_state(self):
+        slot = self._slot
+        if self._meross_plug.commands.is_pending(self._meross_switch_channel):
+            # commands in the pipeline >>> keep the optimistic state (the slot is read once they are done)
+            return False
+        if slot.version == self._slot_version and not self._optimistic:
+            # nothing has changed since the last write
+            return False
+        self._slot_version = slot.version
+        self._optimistic = False
+        changed = slot.available != self._available
+        self._available = slot.available
+        updated_is_on = slot.value
         if updated_is_on != self._is_on:
             _LOGGER.info(self._meross_device_name + ' >>> ' +
                          self._meross_entity_name + ' >>> switching from ' +
                          str(self._is_on) + ' to ' +
                          str(updated_is_on))
-        self._is_on = updated_is_on
-        self._available = self._meross_plug.switch_states[self._meross_switch_channel]['available']
-        return True
+            self._is_on = updated_is_on
+            changed = True
+        return changed
 
     @property
     def name(self):
         """Name of the device."""
-        _LOGGER.debug(self._meross_device_name + ' >>> ' +
-                      self._meross_entity_name + ' >>> name() >>> ' +
-                      self._meross_device_name)
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'name()', self._meross_device_name)
         return self._meross_device_name
 
     @property
     def is_on(self):
-        _LOGGER.debug(self._meross_device_name+' >>> ' +
-                      self._meross_device_name + ' >>> is_on() >>> ' +
-                      str(self._is_on))
+        if TRACER.enabled:
+            TRACER.record(self.entity_id, 'is_on()', self._is_on)
         return self._is_on
 
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+
+from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException
+from meross_iot.cloud.exceptions.StatusTimeoutException import StatusTimeoutException
+
+# Setting log
+_LOGGER = logging.getLogger('meross_commands')
+
+RESULT_CONFIRMED = 'confirmed'
+RESULT_UNCONFIRMED = 'unconfirmed'
+RESULT_TIMEOUT = 'timeout'
+RESULT_ERROR = 'error'
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS COMMAND PIPELINE
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossCommandPipeline:
+    # Per-device pipeline of the switch (on/off) commands:
+    # - the commands queued for the same channel collapse to the latest target state
+    # - the commands are serialised per device (a single command in flight)
+    # - each command is confirmed by the DEVICE_SWITCH_STATUS event; if the confirmation does not arrive in time,
+    #   the channel status is read back from the device (or left to the last confirmed one)
+    # While a channel has commands in the pipeline, its entity keeps the optimistic state; then it is reconciled
+    # with the confirmed state in meross_plug.switch_slots.
+
+    def __init__(self, hass, meross_plug, scheduler, confirm_timeout):
+        self._hass = hass
+        self._meross_plug = meross_plug
+        self._scheduler = scheduler
+        self._confirm_timeout = confirm_timeout.total_seconds()
+        self._lock = asyncio.Lock()
+        self._target_by_channel = {}
+        self._waiters_by_channel = {}
+        self._worker_by_channel = {}
+        self._confirmation_by_channel = {}
+
+    def is_pending(self, channel):
+        return channel in self._worker_by_channel
+
+    def async_request(self, channel, is_on):
+        # only the latest target state of the channel is kept
+        self._target_by_channel[channel] = is_on
+        if channel not in self._worker_by_channel:
+            self._worker_by_channel[channel] = self._hass.async_create_task(self.async_run_channel(channel))
+
+    async def async_set(self, channel, is_on):
+        # same as async_request, but waiting for the result (RESULT_*) of the command which executes it
+        waiter = self._hass.loop.create_future()
+        self._waiters_by_channel.setdefault(channel, []).append(waiter)
+        self.async_request(channel, is_on)
+        return await waiter
+
+    def cancel(self):
+        # the device has been removed: the queued commands are dropped and the workers stopped
+        self._target_by_channel.clear()
+        waiters_by_channel, self._waiters_by_channel = self._waiters_by_channel, {}
+        for waiters in waiters_by_channel.values():
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(RESULT_ERROR)
+        for worker in list(self._worker_by_channel.values()):
+            worker.cancel()
+
+    def confirm(self, channel, is_on):
+        # called when the DEVICE_SWITCH_STATUS event of the channel is received
+        pending = self._confirmation_by_channel.get(channel)
+        if pending is not None:
+            target, confirmation = pending
+            if target == is_on and not confirmation.done():
+                confirmation.set_result(True)
+
+    async def async_run_channel(self, channel):
+        try:
+            while channel in self._target_by_channel:
+                is_on = self._target_by_channel.pop(channel)
+                waiters = self._waiters_by_channel.pop(channel, [])
+                result = RESULT_ERROR
+                try:
+                    result = await self.async_execute(channel, is_on)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # the targets queued meanwhile must still be executed >>> keep draining the channel
+                    _LOGGER.exception(self._meross_plug.name + ' >>> channel ' + str(channel) + ' >>> command failed')
+                finally:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(result)
+        finally:
+            del self._worker_by_channel[channel]
+            # reconcile the entity with the confirmed state
+            self._meross_plug.async_push_update(channel)
+
+    async def async_execute(self, channel, is_on):
+        name = self._meross_plug.name + ' >>> channel ' + str(channel)
+        adapter = self._meross_plug.adapter
+        breaker = self._meross_plug.breaker
+
+        # the confirmation may be received before the command returns >>> expect it in advance
+        confirmation = self._hass.loop.create_future()
+        self._confirmation_by_channel[channel] = (is_on, confirmation)
+        try:
+            async with self._lock:
+                _LOGGER.debug(name + ' >>> switching ' + ('on' if is_on else 'off'))
+                if is_on:
+                    await adapter.async_turn_on_channel(channel)
+                else:
+                    await adapter.async_turn_off_channel(channel)
+            breaker.record_success()
+            await asyncio.wait_for(confirmation, self._confirm_timeout)
+            _LOGGER.debug(name + ' >>> confirmed')
+            return RESULT_CONFIRMED
+
+        except CommandTimeoutException:
+            # the command has not been executed >>> roll back to the confirmed state
+            breaker.record_failure()
+            _LOGGER.warning(name + ' >>> CommandTimeoutException >>> rolling back')
+            return RESULT_TIMEOUT
+
+        except asyncio.TimeoutError:
+            # the command has been sent, but not confirmed >>> read back the channel status
+            _LOGGER.warning(name + ' >>> not confirmed within ' + str(self._confirm_timeout) + ' s')
+            await self.async_read_back(channel)
+            return RESULT_UNCONFIRMED
+
+        finally:
+            del self._confirmation_by_channel[channel]
+            # a device which has just received a command is polled faster
+            self._scheduler.record_command(self._meross_plug.uuid)
+
+    async def async_read_back(self, channel):
+        try:
+            channel_status = await self._meross_plug.adapter.async_get_channel_status(channel)
+            self._meross_plug.states.update(self._meross_plug.switch_slots[channel], value=channel_status)
+        except (CommandTimeoutException, StatusTimeoutException):
+            # roll back to the last confirmed state, the next poll will reconcile it
+            _LOGGER.warning(self._meross_plug.name + ' >>> channel ' + str(channel) + ' >>> read back failed')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _LOGGER.exception(self._meross_plug.name + ' >>> channel ' + str(channel) + ' >>> read back failed')
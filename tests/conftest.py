@@ -0,0 +1,73 @@
+# The modules are imported as in the HA configuration folder (custom_components.meross.<module>).
+# With Home Assistant, meross_iot and requests installed, the whole custom-component is loaded (and the tests of the
+# platform run against the simulated Meross cloud, see bench/simulator.py); without them, the package __init__ is not
+# run, and only the modules depending on the standard library are tested.
+import asyncio
+import importlib.util
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEPENDENCIES = ('homeassistant', 'meross_iot', 'requests')
+HAS_DEPENDENCIES = all(importlib.util.find_spec(name) is not None for name in DEPENDENCIES)
+
+if 'custom_components.meross' not in sys.modules:
+    custom_components = types.ModuleType('custom_components')
+    custom_components.__path__ = []
+    sys.modules['custom_components'] = custom_components
+    if HAS_DEPENDENCIES:
+        spec = importlib.util.spec_from_file_location('custom_components.meross', os.path.join(ROOT, '__init__.py'),
+                                                      submodule_search_locations=[ROOT])
+        meross = importlib.util.module_from_spec(spec)
+        sys.modules['custom_components.meross'] = meross
+        spec.loader.exec_module(meross)
+    else:
+        meross = types.ModuleType('custom_components.meross')
+        meross.__path__ = [ROOT]
+        sys.modules['custom_components.meross'] = meross
+    custom_components.meross = meross
+
+
+@pytest.fixture
+def run_with_hass():
+    # runs scenario(hass) in a new HA instance (with its own configuration folder)
+    if not HAS_DEPENDENCIES:
+        pytest.skip('Home Assistant, meross_iot and requests are needed')
+
+    from homeassistant.core import HomeAssistant
+    from homeassistant.setup import async_setup_component
+
+    async def async_run(scenario):
+        with tempfile.TemporaryDirectory() as config_dir:
+            hass = HomeAssistant()
+            hass.config.config_dir = config_dir
+            hass.config.skip_pip = True
+            await async_setup_component(hass, 'homeassistant', {})
+            try:
+                return await scenario(hass)
+            finally:
+                await hass.async_stop()
+
+    return lambda scenario: asyncio.run(async_run(scenario))
+
+
+async def async_setup_simulated_platform(hass, cloud, **options):
+    # a Meross account on the simulated Meross cloud, set up as the benchmarks do (see bench/update_cycle.py)
+    from custom_components.meross import (CONFIG_SCHEMA, DOMAIN, MerossHub, MerossPlatform)
+    config = CONFIG_SCHEMA({DOMAIN: dict({'username': 'test', 'password': 'test'}, **options)})
+    hass.data[DOMAIN] = MerossHub(hass)
+    hass.config.components.add(DOMAIN)
+    platform = hass.data[DOMAIN].add_platform(MerossPlatform(hass, config, config[DOMAIN][0],
+                                                             manager_factory=cloud.manager_factory))
+    await hass.async_block_till_done()
+    return platform
+
+
+@pytest.fixture
+def setup_simulated_platform():
+    return async_setup_simulated_platform
@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from custom_components.meross.circuit_breaker import (MerossCircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN,
+                                                      STATE_OPEN)
+
+
+def make_breaker():
+    return MerossCircuitBreaker('plug', 3, timedelta(seconds=10), timedelta(seconds=600), jitter=0)
+
+
+def test_opens_after_threshold():
+    breaker = make_breaker()
+    breaker.record_failure(now=0)
+    breaker.record_failure(now=0)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow_request(now=0)
+    breaker.record_failure(now=0)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow_request(now=5)
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = make_breaker()
+    for i in range(3):
+        breaker.record_failure(now=0)
+    assert breaker.allow_request(now=10)
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow_request(now=10)
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow_request(now=10)
+
+
+def test_failed_probe_reopens_with_a_longer_backoff():
+    breaker = make_breaker()
+    for i in range(3):
+        breaker.record_failure(now=0)
+    assert breaker.allow_request(now=10)
+    breaker.record_failure(now=10)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow_request(now=29)
+    assert breaker.allow_request(now=30)
+
+
+def test_released_probe_can_be_claimed_again():
+    breaker = make_breaker()
+    for i in range(3):
+        breaker.record_failure(now=0)
+    assert breaker.allow_request(now=10)
+    breaker.release_probe()
+    assert breaker.allow_request(now=10)
+
+
+def test_reset_closes():
+    breaker = make_breaker()
+    for i in range(3):
+        breaker.record_failure(now=0)
+    breaker.reset()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.failures == 0
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import timedelta
+
+from custom_components.meross.cycle_manager import MerossCycleManager
+
+
+def test_overlapping_tick_is_skipped():
+    async def scenario():
+        release = asyncio.Event()
+        calls = []
+
+        async def cycle(budget):
+            calls.append(budget)
+            await release.wait()
+            return 1
+
+        manager = MerossCycleManager('test', timedelta(seconds=60), cycle)
+        first = asyncio.ensure_future(manager.async_tick())
+        await asyncio.sleep(0)
+        assert await manager.async_tick() is False
+        release.set()
+        assert await first is True
+        return manager, calls
+
+    manager, calls = asyncio.run(scenario())
+    assert calls == [None]
+    assert manager.missed_ticks == 1
+    assert manager.cycles == 1
+
+
+def test_overrun_shrinks_then_budget_grows_back():
+    manager = MerossCycleManager('test', timedelta(seconds=10), None, min_budget=5)
+    # 100 devices in 20 s >>> 50 devices fit in the interval
+    manager.adapt(100, 20.0)
+    assert manager.budget == 50
+    assert manager.overruns == 1
+    # never below min_budget
+    manager.adapt(50, 1000.0)
+    assert manager.budget == 5
+    # fast cycles, limited by the budget >>> doubled
+    manager.adapt(5, 1.0)
+    assert manager.budget == 10
+    # fast cycle, not limited by the budget >>> lifted
+    manager.adapt(3, 1.0)
+    assert manager.budget is None
+
+
+def test_cycle_within_interval_keeps_budget():
+    manager = MerossCycleManager('test', timedelta(seconds=10), None)
+    manager.adapt(10, 20.0)
+    budget = manager.budget
+    manager.adapt(budget, 7.0)
+    assert manager.budget == budget
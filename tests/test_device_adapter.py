@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip('meross_iot')
+pytest.importorskip('requests')
+
+from custom_components.meross.device_adapter import parse_channels_status  # noqa: E402
+
+
+def test_togglex_channels():
+    sys_data = {'all': {'digest': {'togglex': [{'channel': 0, 'onoff': 1}, {'channel': '1', 'onoff': 0}]}}}
+    assert parse_channels_status(sys_data) == {0: True, 1: False}
+
+
+def test_single_togglex_and_payload_without_all():
+    assert parse_channels_status({'digest': {'togglex': {'channel': 0, 'onoff': 0}}}) == {0: False}
+
+
+def test_legacy_toggle():
+    assert parse_channels_status({'all': {'control': {'toggle': {'onoff': 1}}}}) == {0: True}
+
+
+def test_channels_not_reported():
+    assert parse_channels_status({'all': {'digest': {}}}) is None
+    assert parse_channels_status(None) is None
@@ -0,0 +1,29 @@
+import pytest
+
+from custom_components.meross.energy import MerossEnergyMeter
+
+
+def test_trapezoidal_integration():
+    meter = MerossEnergyMeter(max_gap=120)
+    meter.add_sample(100.0, 0, today='2020-01-01')
+    # (100 + 200) / 2 W for 36 s = 1.5 Wh
+    assert meter.add_sample(200.0, 36, today='2020-01-01') == pytest.approx(1.5)
+    assert meter.total == pytest.approx(1.5)
+    assert meter.day_total == pytest.approx(1.5)
+
+
+def test_gaps_are_not_integrated():
+    meter = MerossEnergyMeter(max_gap=60)
+    meter.add_sample(100.0, 0, today='2020-01-01')
+    assert meter.add_sample(100.0, 600, today='2020-01-01') == 0.0
+    assert meter.gaps == 1
+
+
+def test_new_day_and_reconciliation():
+    meter = MerossEnergyMeter(max_gap=120, total=10.0, day='2020-01-01', day_total=5.0)
+    meter.add_sample(0.0, 0, today='2020-01-02')
+    assert meter.day_total == 0.0
+    correction = meter.reconcile([{'date': '2020-01-02', 'value': 3}], today='2020-01-02')
+    assert correction == pytest.approx(3.0)
+    assert meter.total == pytest.approx(13.0)
+    assert meter.reconcile([{'date': '2020-01-01', 'value': 3}], today='2020-01-03') == 0.0
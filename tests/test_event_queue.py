@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('homeassistant')
+meross_event = pytest.importorskip('meross_iot.meross_event')
+
+from custom_components.meross.event_queue import MerossEventQueue  # noqa: E402
+
+MerossEventType = meross_event.MerossEventType
+
+
+class Device:
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.name = uuid
+
+
+class Event:
+
+    def __init__(self, event_type, device=None, **kwargs):
+        self.event_type = event_type
+        self.device = device
+        self.__dict__.update(kwargs)
+
+
+def test_events_from_a_thread_are_merged_in_batches():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        batches = []
+        queue = MerossEventQueue(loop, batches.append)
+        device = Device('a')
+        events = [Event(MerossEventType.DEVICE_ONLINE_STATUS, device, status=True)]
+        events += [Event(MerossEventType.DEVICE_SWITCH_STATUS, device, channel_id=0, switch_state=i % 2 == 0)
+                   for i in range(5)]
+        thread = threading.Thread(target=lambda: [queue.put(eventobj) for eventobj in events])
+        thread.start()
+        thread.join()
+        while queue.received < len(events):
+            await asyncio.sleep(0.001)
+        return queue, batches
+
+    queue, batches = asyncio.run(scenario())
+    assert queue.batches == len(batches) == 1
+    batch = batches[0]
+    assert batch.count == 6
+    assert batch.size() == 2
+    assert list(batch.online_by_uuid) == ['a']
+    device, is_on, states = batch.switch_by_channel[('a', 0)]
+    assert is_on is True
+    assert states == [True, False]
+    assert queue.merged == 4
+
+
+def test_batches_are_bounded():
+    async def scenario():
+        batches = []
+        queue = MerossEventQueue(asyncio.get_running_loop(), batches.append, max_batch=2)
+        for channel in range(5):
+            queue.put(Event(MerossEventType.DEVICE_SWITCH_STATUS, Device('a'), channel_id=channel, switch_state=True))
+        while queue.received < 5:
+            await asyncio.sleep(0.001)
+        return batches
+
+    assert [batch.count for batch in asyncio.run(scenario())] == [2, 2, 1]
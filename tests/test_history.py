@@ -0,0 +1,46 @@
+import pytest
+
+from custom_components.meross.history import (MerossMetricHistory, MerossRingBuffer, TIER_15M, TIER_1M, TIER_RAW)
+
+
+def test_ring_buffer_stats():
+    ring = MerossRingBuffer(4)
+    assert ring.stats() == {'count': 0, 'min': None, 'max': None, 'mean': None, 'p95': None}
+    for value in (1.0, 2.0, 3.0):
+        ring.append(value, value)
+    assert ring.stats() == {'count': 3, 'min': 1.0, 'max': 3.0, 'mean': 2.0, 'p95': 3.0}
+
+
+def test_ring_buffer_wraps_and_evicts_extremes():
+    ring = MerossRingBuffer(3)
+    for timestamp, value in enumerate((10.0, 1.0, 5.0, 6.0, 7.0)):
+        ring.append(value, timestamp)
+    assert len(ring) == 3
+    assert ring.samples() == [(2, 5.0), (3, 6.0), (4, 7.0)]
+    assert ring.min == 5.0
+    assert ring.max == 7.0
+    assert ring.mean == pytest.approx(6.0)
+
+
+def test_metric_history_tiers():
+    history = MerossMetricHistory(factor=0.5)
+    # two 1 minute buckets (0 and 60), then a sample closing the second one
+    for timestamp, raw_value in ((0, 2), (30, 4), (60, 10), (120, 0)):
+        history.add(raw_value, timestamp)
+    assert len(history.tiers[TIER_RAW]) == 4
+    assert history.tiers[TIER_1M].samples() == [(0, 1.5), (60, 5.0)]
+    # the 15 minutes bucket is still open
+    assert len(history.tiers[TIER_15M]) == 0
+    attributes = history.attributes()
+    assert attributes['max_raw'] == 5.0
+    assert attributes['mean_1m'] == 3.25
+
+
+def test_ring_buffer_p95_follows_the_window():
+    ring = MerossRingBuffer(20)
+    values = [float((i * 7) % 23) for i in range(100)]
+    for timestamp, value in enumerate(values):
+        ring.append(value, timestamp)
+        window = sorted(values[max(0, timestamp - 19):timestamp + 1])
+        assert ring.p95 == window[-(-95 * len(window) // 100) - 1]
+        assert (ring.min, ring.max) == (window[0], window[-1])
@@ -0,0 +1,79 @@
+import hashlib
+
+import pytest
+
+pytest.importorskip('requests')
+
+from custom_components.meross.local_transport import (MerossLocalError, MerossLocalTransport,  # noqa: E402
+                                                      NAMESPACE_TOGGLE, NAMESPACE_TOGGLEX, build_message, sign)
+
+
+def test_sign_is_the_md5_of_message_id_key_and_timestamp():
+    assert sign('abc', 'key', 1500000000) == hashlib.md5(b'abckey1500000000').hexdigest()
+
+
+def test_build_message():
+    message = build_message('SET', NAMESPACE_TOGGLEX, {'togglex': {'channel': 1, 'onoff': 1}}, 'key',
+                            'http://host/config')
+    header = message['header']
+    assert (header['method'], header['namespace'], header['from']) == ('SET', NAMESPACE_TOGGLEX,
+                                                                       'http://host/config')
+    assert header['sign'] == sign(header['messageId'], 'key', header['timestamp'])
+    assert 0 <= header['timestampMs'] < 1000
+    assert message['payload'] == {'togglex': {'channel': 1, 'onoff': 1}}
+    assert build_message('GET', NAMESPACE_TOGGLEX, {}, 'key', '')['header']['messageId'] != header['messageId']
+
+
+class Transport(MerossLocalTransport):
+    # requests answered from the system data, without any HTTP server
+
+    def __init__(self, sys_data):
+        super().__init__('host', 'key')
+        self.sys_data = sys_data
+        self.requests = []
+
+    def request(self, method, namespace, payload):
+        self.requests.append((method, namespace, payload))
+        return self.sys_data if method == 'GET' else {}
+
+
+def test_switches_with_togglex():
+    transport = Transport({'all': {'digest': {'togglex': [{'channel': 0, 'onoff': 0}]}}})
+    transport.get_sys_data()
+    transport.turn_on_channel(2)
+    assert transport.requests[-1] == ('SET', NAMESPACE_TOGGLEX, {'togglex': {'channel': 2, 'onoff': 1}})
+
+
+def test_switches_legacy_devices_with_toggle():
+    transport = Transport({'all': {'digest': {}, 'control': {'toggle': {'onoff': 1}}}})
+    transport.get_sys_data()
+    transport.turn_off_channel(0)
+    assert transport.requests[-1] == ('SET', NAMESPACE_TOGGLE, {'toggle': {'onoff': 0}})
+
+
+def test_unreachable_device():
+    # nothing listens on port 9 (discard) >>> the device is not reachable for a while
+    transport = MerossLocalTransport('127.0.0.1:9', 'key', timeout=0.5)
+    assert transport.reachable
+    with pytest.raises(MerossLocalError):
+        transport.get_electricity()
+    assert not transport.reachable
+
+
+def test_signed_requests_to_the_simulated_device():
+    pytest.importorskip('meross_iot')
+    from custom_components.meross.bench.simulator import FakeMerossCloud
+    cloud = FakeMerossCloud(device_count=1, latency_mean=0, latency_jitter=0)
+    device = cloud.devices[0]
+    host = cloud.start_local_servers(1, 'key', latency=0)[device.uuid]
+    try:
+        transport = MerossLocalTransport(host, 'key')
+        transport.turn_on_channel(0)
+        assert device.channel_states == [True]
+        assert transport.get_sys_data()['all']['digest']['togglex'] == [{'channel': 0, 'onoff': 1}]
+        # wrong key >>> refused by the device
+        with pytest.raises(MerossLocalError):
+            MerossLocalTransport(host, 'wrong').turn_off_channel(0)
+        assert device.channel_states == [True]
+    finally:
+        cloud.stop_local_servers()
@@ -0,0 +1,39 @@
+import json
+
+from custom_components.meross.metrics import (MerossCallMetrics, MerossPlatformMetrics, OPERATION_STATUS,
+                                              OUTCOME_ERROR, OUTCOME_SUCCESS, OUTCOME_TIMEOUT)
+
+
+def test_counters_and_percentile():
+    calls = MerossCallMetrics()
+    for i in range(19):
+        calls.record(0.05, OUTCOME_SUCCESS)
+    calls.record(3.0, OUTCOME_TIMEOUT)
+    calls.record(0.3, OUTCOME_ERROR)
+    data = calls.as_dict()
+    assert (data['count'], data['timeouts'], data['errors']) == (21, 1, 1)
+    assert data['p95_ms'] == 500
+    assert data['last_ms'] == 300
+    assert data['histogram']['le_0.1'] == 19
+    assert data['last_success'] is not None
+
+
+def test_calls_slower_than_the_last_bound_are_valid_json():
+    calls = MerossCallMetrics()
+    for i in range(10):
+        calls.record(10.5, OUTCOME_TIMEOUT)
+    data = calls.as_dict()
+    assert data['p95_ms'] == 10500
+    json.dumps(data, allow_nan=False)
+
+
+def test_platform_summary_merges_the_devices():
+    metrics = MerossPlatformMetrics('meross')
+    metrics.get_device_metrics('a', 'slow').record(OPERATION_STATUS, 2.0, OUTCOME_SUCCESS)
+    metrics.get_device_metrics('b', 'fast').record(OPERATION_STATUS, 0.2, OUTCOME_SUCCESS)
+    metrics.get_device_metrics('b', 'fast').record(OPERATION_STATUS, 12.0, OUTCOME_SUCCESS)
+    summary = metrics.summary(slowest=1)
+    assert summary['devices']['count'] == 3
+    assert summary['devices']['p95_ms'] == 12000
+    assert summary['slowest_devices'] == {'fast': 6100}
+    json.dumps(summary, allow_nan=False)
@@ -0,0 +1,143 @@
+# MerossPlatform against the simulated Meross cloud (see bench/simulator.py): discovery, events and set_channels
+import asyncio
+
+import pytest
+
+
+def build_cloud(device_count, **kwargs):
+    from custom_components.meross.bench.simulator import FakeMerossCloud
+    return FakeMerossCloud(device_count=device_count, latency_mean=0, latency_jitter=0, **kwargs)
+
+
+async def async_discover(hass, platform):
+    await platform.async_discover_plugs()
+    await hass.async_block_till_done()
+
+
+def switch_entity_id(uuid):
+    return 'switch.meross_' + uuid
+
+
+def test_discovery_diff(run_with_hass, setup_simulated_platform):
+    from homeassistant.helpers.entity_registry import async_get_registry
+
+    async def scenario(hass):
+        cloud = build_cloud(3)
+        platform = await setup_simulated_platform(hass, cloud)
+        await async_discover(hass, platform)
+        unchanged, changed, removed = cloud.devices
+        plugs = dict(platform.meross_plugs_by_uuid)
+        assert set(plugs) == {device.uuid for device in cloud.devices}
+        entity_ids = {uuid: set(plug.entity_ids) for uuid, plug in plugs.items()}
+        assert switch_entity_id(removed.uuid) in entity_ids[removed.uuid]
+        assert hass.states.get(switch_entity_id(removed.uuid)) is not None
+        platform.energy_store.async_schedule_save()
+
+        # an empty list is not trusted
+        cloud.devices = []
+        await async_discover(hass, platform)
+        assert set(platform.meross_plugs_by_uuid) == set(plugs)
+
+        cloud.devices = [unchanged, changed]
+        changed.name = 'Renamed plug'
+        await async_discover(hass, platform)
+        registry = await async_get_registry(hass)
+
+        assert platform.meross_plugs_by_uuid[unchanged.uuid] is plugs[unchanged.uuid]
+
+        # changed >>> new plug, same entities (the teardown of the old ones does not touch the new plug)
+        assert platform.meross_plugs_by_uuid[changed.uuid] is not plugs[changed.uuid]
+        assert platform.meross_plugs_by_uuid[changed.uuid].entity_ids == entity_ids[changed.uuid]
+        assert registry.async_is_registered(switch_entity_id(changed.uuid))
+
+        # removed >>> entities, registry entries and energy total dropped
+        assert removed.uuid not in platform.meross_plugs_by_uuid
+        for entity_id in entity_ids[removed.uuid]:
+            assert hass.states.get(entity_id) is None
+            assert not registry.async_is_registered(entity_id)
+        assert removed.uuid not in platform.energy_store._data_to_save()
+        assert changed.uuid in platform.energy_store._data_to_save()
+        assert plugs[removed.uuid].adapter.queue.closed
+
+    run_with_hass(scenario)
+
+
+def test_events_are_handled_in_batches(run_with_hass, setup_simulated_platform):
+    from custom_components.meross.bench.simulator import FakeMerossEvent
+    from custom_components.meross.event_queue import MerossEventBatch
+    from meross_iot.meross_event import MerossEventType
+
+    async def scenario(hass):
+        cloud = build_cloud(2)
+        platform = await setup_simulated_platform(hass, cloud)
+        await async_discover(hass, platform)
+        switching, going_offline = cloud.devices
+        scheduler = platform.scheduler
+        for uuid in platform.meross_plugs_by_uuid:
+            scheduler.record_poll(uuid, True, now=0)
+
+        batch = MerossEventBatch()
+        for is_on in (True, False, True):
+            batch.add(FakeMerossEvent(MerossEventType.DEVICE_SWITCH_STATUS, switching, channel_id=0,
+                                      switch_state=is_on))
+        going_offline.online = False
+        batch.add(FakeMerossEvent(MerossEventType.DEVICE_ONLINE_STATUS, going_offline, status=False))
+        assert batch.size() == 2
+        platform.async_handle_events(batch)
+        await hass.async_block_till_done()
+
+        assert hass.states.get(switch_entity_id(switching.uuid)).state == 'on'
+        assert hass.states.get(switch_entity_id(going_offline.uuid)).state == 'unavailable'
+        # an offline device is backed off, not polled at the fastest rate
+        assert scheduler.interval(going_offline.uuid) > scheduler.min_interval
+
+        # back online >>> due right away
+        going_offline.online = True
+        batch = MerossEventBatch()
+        batch.add(FakeMerossEvent(MerossEventType.DEVICE_ONLINE_STATUS, going_offline, status=True))
+        platform.async_handle_events(batch)
+        await hass.async_block_till_done()
+        assert going_offline.uuid in scheduler.due(now=0)
+        assert hass.states.get(switch_entity_id(going_offline.uuid)).state == 'off'
+
+        # events from the (simulated) MQTT thread
+        received = platform.events.received
+        switching.set_channel(0, False)
+        while platform.events.received == received:
+            await asyncio.sleep(0.001)
+        await hass.async_block_till_done()
+        assert hass.states.get(switch_entity_id(switching.uuid)).state == 'off'
+
+    run_with_hass(scenario)
+
+
+def test_set_channels_reports_each_target(run_with_hass, setup_simulated_platform):
+    from homeassistant.core import ServiceCall
+    from custom_components.meross import (ATTR_RESULTS, DOMAIN, EVENT_SET_CHANNELS_RESULT, SERVICE_SET_CHANNELS,
+                                          SET_CHANNELS_SCHEMA)
+
+    async def scenario(hass):
+        cloud = build_cloud(2)
+        platform = await setup_simulated_platform(hass, cloud)
+        await async_discover(hass, platform)
+        online, offline = cloud.devices
+        offline.online = False
+        reports = []
+        hass.bus.async_listen(EVENT_SET_CHANNELS_RESULT, lambda event: reports.append(event.data[ATTR_RESULTS]))
+
+        data = SET_CHANNELS_SCHEMA({'targets': [
+            {'device_uuid': online.uuid, 'channel': 0, 'state': False},
+            {'device_uuid': online.uuid, 'channel': 0, 'state': True},
+            {'device_uuid': online.uuid, 'channel': 5, 'state': True},
+            {'device_uuid': offline.uuid, 'state': True},
+            {'device_uuid': 'unknown', 'state': True},
+        ]})
+        await hass.data[DOMAIN].async_handle_set_channels(ServiceCall(DOMAIN, SERVICE_SET_CHANNELS, data))
+        await hass.async_block_till_done()
+        return reports, online, offline
+
+    reports, online, offline = run_with_hass(scenario)
+    assert [target['result'] for target in reports[0]] == ['superseded', 'confirmed', 'unknown_channel', 'offline',
+                                                           'unknown_device']
+    assert online.channel_states == [True]
+    assert offline.channel_states == [False]
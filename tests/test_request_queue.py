@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from custom_components.meross.request_queue import (MerossRequestQueue, MerossRequestQueueClosed, PRIORITY_COMMAND,
+                                                    PRIORITY_POLL, PRIORITY_PUSH)
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_commands_overtake_queued_reads():
+    async def scenario():
+        queue = MerossRequestQueue(asyncio.get_running_loop(), 'plug')
+        release = asyncio.Event()
+        order = []
+
+        async def request(name):
+            order.append(name)
+            if name == 'first':
+                await release.wait()
+            return name
+
+        tasks = [asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'first', request, 'first'))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'electricity', request, 'poll')))
+        tasks.append(asyncio.ensure_future(queue.async_submit(PRIORITY_PUSH, 'channel', request, 'push')))
+        tasks.append(asyncio.ensure_future(queue.async_submit(PRIORITY_COMMAND, None, request, 'command')))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario) == ['first', 'command', 'push', 'poll']
+
+
+def test_reads_of_the_same_kind_are_merged_and_promoted():
+    async def scenario():
+        queue = MerossRequestQueue(asyncio.get_running_loop(), 'plug')
+        release = asyncio.Event()
+        calls = []
+
+        async def request(name):
+            calls.append(name)
+            if name == 'first':
+                await release.wait()
+            return name
+
+        first = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'first', request, 'first'))
+        await asyncio.sleep(0)
+        poll = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'status', request, 'status'))
+        other = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'other', request, 'other'))
+        push = asyncio.ensure_future(queue.async_submit(PRIORITY_PUSH, 'status', request, 'status'))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, poll, other, push)
+        return calls, results
+
+    calls, results = run(scenario)
+    assert calls == ['first', 'status', 'other']
+    assert results == ['first', 'status', 'other', 'status']
+
+
+def test_stale_poll_gets_the_newer_result():
+    async def scenario():
+        queue = MerossRequestQueue(asyncio.get_running_loop(), 'plug')
+        release = asyncio.Event()
+        calls = []
+
+        async def request(value):
+            calls.append(value)
+            await release.wait()
+            return value
+
+        in_flight = asyncio.ensure_future(queue.async_submit(PRIORITY_PUSH, 'status', request, 'fresh'))
+        await asyncio.sleep(0)
+        stale = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'status', request, 'stale'))
+        await asyncio.sleep(0)
+        release.set()
+        return calls, await in_flight, await stale, queue.dropped
+
+    calls, in_flight, stale, dropped = run(scenario)
+    assert calls == ['fresh']
+    assert (in_flight, stale, dropped) == ('fresh', 'fresh', 1)
+
+
+def test_errors_reach_the_waiters_and_the_queue_goes_on():
+    async def scenario():
+        queue = MerossRequestQueue(asyncio.get_running_loop(), 'plug')
+
+        async def failing():
+            raise ValueError('boom')
+
+        async def succeeding():
+            return 'ok'
+
+        with pytest.raises(ValueError):
+            await queue.async_submit(PRIORITY_COMMAND, None, failing)
+        return await queue.async_submit(PRIORITY_COMMAND, None, succeeding)
+
+    assert run(scenario) == 'ok'
+
+
+def test_cancelled_sole_waiter_discards_the_queued_request():
+    async def scenario():
+        queue = MerossRequestQueue(asyncio.get_running_loop(), 'plug')
+        release = asyncio.Event()
+        calls = []
+
+        async def request(name):
+            calls.append(name)
+            if name == 'first':
+                await release.wait()
+            return name
+
+        first = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'first', request, 'first'))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'status', request, 'status'))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await first
+        await asyncio.sleep(0)
+        return calls
+
+    assert run(scenario) == ['first']
+
+
+def test_closed_queue_fails_the_pending_requests():
+    async def scenario():
+        queue = MerossRequestQueue(asyncio.get_running_loop(), 'plug')
+
+        async def request():
+            await asyncio.sleep(10)
+
+        in_flight = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'first', request))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(queue.async_submit(PRIORITY_POLL, 'status', request))
+        await asyncio.sleep(0)
+        queue.close()
+        results = await asyncio.gather(in_flight, queued, return_exceptions=True)
+        with pytest.raises(MerossRequestQueueClosed):
+            await queue.async_submit(PRIORITY_COMMAND, None, request)
+        return results
+
+    assert [type(result) for result in run(scenario)] == [MerossRequestQueueClosed, MerossRequestQueueClosed]
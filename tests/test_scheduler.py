@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from custom_components.meross.scheduler import MerossPollScheduler
+
+
+def make_scheduler():
+    return MerossPollScheduler(timedelta(seconds=10), timedelta(seconds=40))
+
+
+def test_new_device_is_due_immediately():
+    scheduler = make_scheduler()
+    scheduler.add('a', now=0)
+    assert scheduler.due(now=0) == ['a']
+
+
+def test_stable_device_backs_off_up_to_max_interval():
+    scheduler = make_scheduler()
+    scheduler.add('a', now=0)
+    intervals = []
+    for i in range(4):
+        scheduler.record_poll('a', False, now=0)
+        intervals.append(scheduler.interval('a'))
+    assert intervals == [20, 40, 40, 40]
+    scheduler.record_poll('a', True, now=0)
+    assert scheduler.interval('a') == 10
+    assert scheduler.due(now=9) == []
+    assert scheduler.due(now=10) == ['a']
+
+
+def test_due_devices_most_overdue_first():
+    scheduler = make_scheduler()
+    scheduler.add('a', now=0)
+    scheduler.add('b', now=0)
+    scheduler.record_poll('a', True, now=0)
+    scheduler.record_poll('b', True, now=5)
+    assert scheduler.due(now=100) == ['a', 'b']
+
+
+def test_expire_makes_the_device_due():
+    scheduler = make_scheduler()
+    scheduler.add('a', now=0)
+    scheduler.record_poll('a', False, now=0)
+    assert scheduler.due(now=1) == []
+    scheduler.expire('a')
+    assert scheduler.due(now=1) == ['a']
+
+
+def test_command_and_push():
+    scheduler = make_scheduler()
+    scheduler.add('a', now=0)
+    scheduler.record_poll('a', False, now=0)
+    scheduler.record_poll('a', False, now=0)
+    scheduler.record_command('a', now=0)
+    assert scheduler.interval('a') == 10
+    assert scheduler.due(now=10) == ['a']
+    scheduler.record_push('a', now=10)
+    assert scheduler.due(now=19) == []
+
+
+def test_removed_device_is_ignored():
+    scheduler = make_scheduler()
+    scheduler.add('a', now=0)
+    scheduler.remove('a')
+    scheduler.record_poll('a', True, now=0)
+    assert scheduler.due(now=100) == []
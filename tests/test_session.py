@@ -0,0 +1,90 @@
+from datetime import timedelta
+import time
+
+import pytest
+
+
+class Manager:
+    # stand-in for the meross_iot manager
+
+    def __init__(self):
+        self.started = False
+        self.handlers = []
+
+    def start(self):
+        self.started = True
+
+    def register_event_handler(self, handler):
+        self.handlers.append(handler)
+
+    def stop(self):
+        self.started = False
+
+
+def build_session(hass, manager_factory, key='meross_session_test'):
+    from custom_components.meross.session import MerossSessionManager
+    return MerossSessionManager(hass, None, manager_factory, 'user', 'password', print, lambda: None,
+                                timedelta(minutes=30), timedelta(minutes=1), key=key, jitter=0)
+
+
+def failing_factory(username, password):
+    from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException
+    raise CommandTimeoutException()
+
+
+def test_failed_logins_back_off(run_with_hass):
+    from custom_components.meross.session import MIN_LOGIN_INTERVAL
+
+    async def scenario(hass):
+        session = build_session(hass, failing_factory)
+        backoffs = []
+        for i in range(8):
+            session.record_login(False)
+            backoffs.append(round(session.next_login - time.time()))
+        session.record_login(True)
+        return backoffs, session
+
+    backoffs, session = run_with_hass(scenario)
+    assert backoffs == [MIN_LOGIN_INTERVAL * 2 ** i for i in range(6)] + [1800, 1800]
+    assert session.failures == 0
+    assert session.next_login - time.time() == pytest.approx(MIN_LOGIN_INTERVAL, abs=1)
+
+
+def test_failed_login_is_persisted_and_postpones_the_next_one(run_with_hass):
+    async def scenario(hass):
+        calls = []
+
+        def factory(username, password):
+            calls.append(username)
+            return failing_factory(username, password)
+
+        first = build_session(hass, factory)
+        assert await first.async_get_manager() is None
+        # e.g. HA restarted right away: the pacing is loaded from the .storage folder
+        second = build_session(hass, factory)
+        assert await second.async_get_manager() is None
+        return calls, second
+
+    calls, second = run_with_hass(scenario)
+    assert calls == ['user']
+    assert second.failures == 1
+
+
+def test_started_manager_is_reused(run_with_hass):
+    async def scenario(hass):
+        managers = []
+
+        def factory(username, password):
+            managers.append(Manager())
+            return managers[-1]
+
+        session = build_session(hass, factory)
+        manager = await session.async_get_manager()
+        assert await session.async_get_manager() is manager
+        await session.async_stop()
+        return managers
+
+    managers = run_with_hass(scenario)
+    assert len(managers) == 1
+    assert managers[0].handlers == [print]
+    assert not managers[0].started
@@ -0,0 +1,23 @@
+from custom_components.meross.state_store import MerossStateStore
+
+
+def test_update_versions_only_on_change():
+    store = MerossStateStore()
+    slot = store.add('a', 0, False, True)
+    assert store.add('a', 0, True, True) is slot
+    assert not store.update(slot, value=False)
+    assert slot.version == 0
+    assert store.update(slot, value=True)
+    assert store.update(slot, available=False)
+    assert slot.version == 2
+    assert store.get('a', 0) is slot
+
+
+def test_remove_device():
+    store = MerossStateStore()
+    store.add('a', 0, False, True)
+    store.add('a', 'power', 0, True)
+    store.add('b', 0, False, True)
+    store.remove_device('a')
+    assert len(store) == 1
+    assert store.get('a', 0) is None
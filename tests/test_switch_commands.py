@@ -0,0 +1,167 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip('meross_iot')
+
+from meross_iot.cloud.exceptions.CommandTimeoutException import CommandTimeoutException  # noqa: E402
+
+from custom_components.meross.circuit_breaker import MerossCircuitBreaker  # noqa: E402
+from custom_components.meross.scheduler import MerossPollScheduler  # noqa: E402
+from custom_components.meross.state_store import MerossStateStore  # noqa: E402
+from custom_components.meross.switch_commands import (MerossCommandPipeline, RESULT_CONFIRMED,  # noqa: E402
+                                                      RESULT_ERROR, RESULT_TIMEOUT, RESULT_UNCONFIRMED)
+
+
+class Hass:
+    # the part of HA used by the pipeline
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def async_create_task(self, coroutine):
+        return self.loop.create_task(coroutine)
+
+
+class Adapter:
+    # commands recorded; each one confirmed (as the DEVICE_SWITCH_STATUS event would) unless confirm is False
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pipeline = None
+        self.commands = []
+        self.confirm = True
+        self.errors = []
+        self.release = None
+        self.channel_status = None
+
+    async def async_turn_on_channel(self, channel):
+        await self.async_command(channel, True)
+
+    async def async_turn_off_channel(self, channel):
+        await self.async_command(channel, False)
+
+    async def async_command(self, channel, is_on):
+        self.commands.append(is_on)
+        if self.release is not None:
+            await self.release.wait()
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        if self.confirm:
+            self.loop.call_soon(self.pipeline.confirm, channel, is_on)
+
+    async def async_get_channel_status(self, channel):
+        return self.channel_status
+
+
+class Plug:
+
+    def __init__(self, loop):
+        self.name = 'plug'
+        self.uuid = 'plug'
+        self.adapter = Adapter(loop)
+        self.breaker = MerossCircuitBreaker('plug', 3, timedelta(seconds=10), timedelta(seconds=600))
+        self.states = MerossStateStore()
+        self.switch_slots = {0: self.states.add('plug', 0, False, True)}
+        self.pushes = []
+
+    def async_push_update(self, state_key=None):
+        self.pushes.append(state_key)
+
+
+def run(scenario, confirm_timeout=timedelta(seconds=1)):
+    async def async_run():
+        loop = asyncio.get_running_loop()
+        plug = Plug(loop)
+        scheduler = MerossPollScheduler(timedelta(seconds=10), timedelta(seconds=120))
+        pipeline = MerossCommandPipeline(Hass(loop), plug, scheduler, confirm_timeout)
+        plug.adapter.pipeline = pipeline
+        return await scenario(plug, pipeline)
+    return asyncio.run(async_run())
+
+
+def test_confirmed_command():
+    async def scenario(plug, pipeline):
+        result = await pipeline.async_set(0, True)
+        await asyncio.sleep(0)
+        return result, plug
+
+    result, plug = run(scenario)
+    assert result == RESULT_CONFIRMED
+    assert plug.adapter.commands == [True]
+    # the entity is reconciled once the channel has no more commands
+    assert plug.pushes == [0]
+
+
+def test_queued_commands_collapse_to_the_latest_target():
+    async def scenario(plug, pipeline):
+        plug.adapter.release = asyncio.Event()
+        first = asyncio.ensure_future(pipeline.async_set(0, True))
+        await asyncio.sleep(0)
+        queued = [asyncio.ensure_future(pipeline.async_set(0, is_on)) for is_on in (True, False, True, False)]
+        await asyncio.sleep(0)
+        assert pipeline.is_pending(0)
+        plug.adapter.release.set()
+        results = await asyncio.gather(first, *queued)
+        return results, plug
+
+    results, plug = run(scenario)
+    assert plug.adapter.commands == [True, False]
+    assert results == [RESULT_CONFIRMED] * 5
+
+
+def test_command_timeout_rolls_back():
+    async def scenario(plug, pipeline):
+        plug.adapter.errors = [CommandTimeoutException()]
+        return await pipeline.async_set(0, True), plug
+
+    result, plug = run(scenario)
+    assert result == RESULT_TIMEOUT
+    assert plug.breaker.failures == 1
+    assert plug.switch_slots[0].value is False
+
+
+def test_unconfirmed_command_is_read_back():
+    async def scenario(plug, pipeline):
+        plug.adapter.confirm = False
+        plug.adapter.channel_status = True
+        return await pipeline.async_set(0, True), plug
+
+    result, plug = run(scenario, confirm_timeout=timedelta(milliseconds=10))
+    assert result == RESULT_UNCONFIRMED
+    assert plug.switch_slots[0].value is True
+
+
+def test_unexpected_error_does_not_stop_the_channel():
+    async def scenario(plug, pipeline):
+        plug.adapter.release = asyncio.Event()
+        plug.adapter.errors = [ValueError('boom')]
+        first = asyncio.ensure_future(pipeline.async_set(0, True))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(pipeline.async_set(0, False))
+        await asyncio.sleep(0)
+        plug.adapter.release.set()
+        return await asyncio.gather(first, second), plug
+
+    results, plug = run(scenario)
+    assert results == [RESULT_ERROR, RESULT_CONFIRMED]
+    assert plug.adapter.commands == [True, False]
+
+
+def test_cancel_resolves_all_the_waiters():
+    async def scenario(plug, pipeline):
+        plug.adapter.release = asyncio.Event()
+        in_flight = asyncio.ensure_future(pipeline.async_set(0, True))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(pipeline.async_set(0, False))
+        await asyncio.sleep(0)
+        pipeline.cancel()
+        results = await asyncio.gather(in_flight, queued)
+        await asyncio.sleep(0)
+        return results, pipeline, plug
+
+    results, pipeline, plug = run(scenario)
+    assert results == [RESULT_ERROR, RESULT_ERROR]
+    assert not pipeline.is_pending(0)
+    assert plug.adapter.commands == [True]
@@ -0,0 +1,66 @@
+import collections
+import datetime
+import logging
+import time
+
+# Setting log
+_LOGGER = logging.getLogger('meross_trace')
+
+DEFAULT_TRACE_BUFFER_SIZE = 1000
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#
+# MEROSS TRACER
+#
+# ----------------------------------------------------------------------------------------------------------------------
+
+class MerossTracer:
+    # Structured trace of the hot paths (entity properties, updates, meross_iot calls).
+    # - disabled: nothing is built; call sites check TRACER.enabled before calling record()
+    # - enabled: (timestamp, source, event, args) tuples are appended to a bounded ring buffer, without any
+    #   string formatting; the strings are built only when the buffer is dumped
+
+    def __init__(self, size=DEFAULT_TRACE_BUFFER_SIZE):
+        self.enabled = False
+        self._events = collections.deque(maxlen=size)
+
+    def enable(self, size=None):
+        if size is not None and size != self._events.maxlen:
+            self._events = collections.deque(self._events, maxlen=size)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self._events.clear()
+
+    def record(self, source, event, *args):
+        self._events.append((time.time(), source, event, args))
+
+    def __len__(self):
+        return len(self._events)
+
+    def dump(self):
+        # format the buffered events, the oldest first
+        return [format_event(*event) for event in list(self._events)]
+
+    def dump_to_log(self):
+        for line in self.dump():
+            _LOGGER.info(line)
+
+    def dump_to_file(self, filename):
+        # WARNING: blocking >>> to be run in the executor
+        with open(filename, 'w') as trace_file:
+            for line in self.dump():
+                trace_file.write(line + '\n')
+
+
+def format_event(timestamp, source, event, args):
+    return (datetime.datetime.fromtimestamp(timestamp).isoformat() + ' ' + str(source) + ' >>> ' + event +
+            ('' if len(args) == 0 else ' >>> ' + ', '.join(str(arg) for arg in args)))
+
+
+# the tracer shared by all the meross modules
+TRACER = MerossTracer()